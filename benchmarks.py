@@ -0,0 +1,177 @@
+from rest_framework.test import APIRequestFactory
+from cache import section_render_cache, validation_cache
+from helpers import parse_haproxy_configtest_output, override_haproxy_settings
+from models import HaProxyConfigModel, HaProxyActiveConfigModel
+from contextlib import contextmanager
+from itertools import count
+import settings
+import platform
+import tempfile
+import shutil
+import json
+import time
+import os
+import views
+
+# Stub of a 'haproxy' binary, it reports a valid configuration for a validation and succeeds for a reload
+STUB_HAPROXY = '#!/bin/sh\necho "Configuration file is valid"\n'
+
+
+def measure(func, repeat, setup=None):
+    """
+    Function measures a wall clock time of a repeated call of a function.
+    :param func: function without arguments
+    :param repeat: number of calls
+    :param setup: function called before every call, not measured
+    :return: dictionary of a number of runs and a minimum, median, mean and maximum time in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+
+    timings.sort()
+    return {
+        'runs': repeat,
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'mean': sum(timings) / len(timings),
+        'max': timings[-1],
+    }
+
+
+@contextmanager
+def benchmark_environment():
+    """
+    Context manager pointing configuration paths and commands of api_haproxy to a temporary directory with a stub
+    'haproxy' binary, thus a benchmark never touches a real HAProxy. A deploy lock and a state of coalesced deployments
+    are kept there as well, thus deployments of a host are neither blocked by a benchmark nor share its outcome.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    executable = os.path.join(tmp_dir, 'haproxy')
+    with open(executable, 'w') as f:
+        f.write(STUB_HAPROXY)
+    os.chmod(executable, 0o755)
+
+    dev_path, prod_path = os.path.join(tmp_dir, 'haproxy.cfg.dev'), os.path.join(tmp_dir, 'haproxy.cfg')
+    overrides = {
+        'HAPROXY_EXECUTABLE': executable,
+        'HAPROXY_CONFIG_DEV_PATH': dev_path,
+        'HAPROXY_CONFIG_PATH': prod_path,
+        'HAPROXY_VALIDATION_CMD': '{0} -f {1} -c'.format(executable, dev_path),
+        'HAPROXY_RELOAD_CMD': '{0} -f {1}'.format(executable, prod_path),
+        'BASH_PATH': '/bin/sh',
+        'HAPROXY_DEPLOY_LOCK_PATH': os.path.join(tmp_dir, 'haproxy-deploy.lock'),
+        'HAPROXY_DEPLOY_STATE_PATH': os.path.join(tmp_dir, 'haproxy-deploy.state'),
+    }
+    try:
+        with override_haproxy_settings(**overrides):
+            yield tmp_dir
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def create_dataset(backends, versions):
+    """
+    Function replaces stored sections with a synthetic configuration of a given number of backends, each of them with
+    a given number of versions. Versions are stored oldest first, thus a last one becomes active.
+    :param backends: number of backends
+    :param versions: number of versions of every backend
+    """
+    HaProxyActiveConfigModel.objects.all().delete()
+    HaProxyConfigModel.objects.all().delete()
+
+    sections = [
+        HaProxyConfigModel(section='global', configuration=json.dumps({'daemon': '', 'maxconn': '4096'})),
+        HaProxyConfigModel(section='defaults', configuration=json.dumps({'mode': 'http', 'timeout connect': '5s'})),
+        HaProxyConfigModel(section='frontend', section_name='nodes', configuration=json.dumps({'bind': '*:80'})),
+    ]
+    HaProxyConfigModel.objects.bulk_upsert(sections)
+
+    for version in range(versions):
+        configs = []
+        for backend in range(backends):
+            configuration = {
+                'balance': 'roundrobin',
+                'server web1': '10.{0}.{1}.1:80 check weight {2}'.format(backend // 256 % 256, backend % 256, version),
+                'server web2': '10.{0}.{1}.2:80 check weight {2}'.format(backend // 256 % 256, backend % 256, version),
+            }
+            configs.append(HaProxyConfigModel(
+                section='backend', section_name='bak{}'.format(backend), configuration=json.dumps(configuration)
+            ))
+        HaProxyConfigModel.objects.bulk_upsert(configs)
+
+
+def configtest_output(config_path, warnings):
+    """
+    Function creates a synthetic output of a configuration test containing a given number of warnings.
+    :param config_path: path to a configuration referred to by warnings
+    :param warnings: number of warnings
+    :return: output string
+    """
+    lines = []
+    for line in range(1, warnings + 1):
+        lines.append("[WARNING] 123/164812 (1234) : parsing [{0}:{1}] : a warning\n".format(config_path, line))
+        lines.append("   | continued on a next line\n")
+    lines.append("[ALERT] 123/164812 (1234) : Fatal errors found in configuration.\n")
+    return ''.join(lines)
+
+
+def run_benchmark(sizes, versions, repeat):
+    """
+    Function benchmarks a build, generation, validation and deployment of a configuration for datasets of given sizes.
+    Views are called directly without a routing of a project, against a database of a current connection, which is
+    expected to be a test one.
+    :param sizes: list of numbers of backends
+    :param versions: number of versions of every backend
+    :param repeat: number of measured calls of every stage
+    :return: dictionary of results, which is serializable into a JSON
+    """
+    factory = APIRequestFactory()
+    build = views.HaProxyConfigBuildView.as_view()
+    generate = views.HaProxyConfigGenerateView.as_view()
+    validate = views.HaProxyConfigValidationView.as_view()
+    deploy = views.HaProxyConfigDeployView.as_view()
+    results = {'python': platform.python_version(), 'versions': versions, 'repeat': repeat, 'sizes': {}}
+
+    with benchmark_environment():
+        for size in sizes:
+            start = time.time()
+            create_dataset(size, versions)
+            stages = {'dataset': {'runs': 1, 'seconds': time.time() - start, 'rows': size * versions + 3}}
+            posted = count()
+
+            def build_post():
+                data = {'section': 'backend', 'section_name': 'new', 'configuration': json.dumps({'n': next(posted)})}
+                build(factory.post('/', data))
+
+            def clear_caches():
+                section_render_cache.clear()
+                validation_cache.clear()
+
+            def touch_prod():
+                with open(settings.HAPROXY_CONFIG_PATH, 'w') as f:
+                    f.write('# outdated\n')
+
+            stages['build_post'] = measure(build_post, repeat)
+            stages['build_get_page'] = measure(lambda: build(factory.get('/', {'limit': 1000})).render(), repeat)
+            stages['build_get_stream'] = measure(
+                lambda: ''.join(build(factory.get('/', {'stream': 1})).streaming_content), repeat
+            )
+            stages['generate_get'] = measure(lambda: generate(factory.get('/')).render(), repeat)
+            stages['generate_post_cold'] = measure(lambda: generate(factory.post('/')), repeat, clear_caches)
+            stages['generate_post_warm'] = measure(lambda: generate(factory.post('/')), repeat)
+
+            output = configtest_output(settings.HAPROXY_CONFIG_DEV_PATH, size)
+            stages['parse_configtest_output'] = measure(lambda: parse_haproxy_configtest_output(output), repeat)
+            stages['validate_cold'] = measure(lambda: validate(factory.get('/')), repeat, clear_caches)
+            stages['validate_warm'] = measure(lambda: validate(factory.get('/')), repeat)
+            stages['deploy_changed'] = measure(lambda: deploy(factory.post('/')), repeat, touch_prod)
+            stages['deploy_unchanged'] = measure(lambda: deploy(factory.post('/')), repeat)
+
+            results['sizes'][str(size)] = stages
+
+    return results
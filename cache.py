@@ -0,0 +1,102 @@
+from collections import OrderedDict
+from threading import Lock
+import settings
+
+
+class SectionRenderCache(object):
+    """
+    SectionRenderCache keeps rendered configuration blocks in a memory of a running process. Blocks are keyed by
+    a checksum of a section, which is immutable, thus a cached block never goes stale. Entries are evicted when a
+    section is deleted or when a newer version of a section supersedes it in a generated configuration.
+    """
+
+    def __init__(self):
+        self._fragments = {}
+        self._lock = Lock()
+
+    def __contains__(self, checksum):
+        return checksum in self._fragments
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def get_many(self, checksums):
+        """
+        Method returns cached blocks for given checksums. Checksums without a cached block are left out.
+        :param checksums: iterable of section checksums
+        :return: dictionary mapping checksums to rendered blocks
+        """
+        with self._lock:
+            return dict((c, self._fragments[c]) for c in checksums if c in self._fragments)
+
+    def set_many(self, fragments):
+        """
+        Method stores rendered blocks in a cache.
+        :param fragments: dictionary mapping checksums to rendered blocks
+        """
+        with self._lock:
+            self._fragments.update(fragments)
+
+    def evict(self, *checksums):
+        """
+        Method removes blocks of given checksums, e.g. when a section is deleted.
+        :param checksums: section checksums
+        """
+        with self._lock:
+            for checksum in checksums:
+                self._fragments.pop(checksum, None)
+
+    def retain(self, checksums):
+        """
+        Method removes all blocks except the ones listed, which are blocks of sections superseded by newer versions.
+        :param checksums: checksums of sections used in a current configuration
+        """
+        checksums = set(checksums)
+        with self._lock:
+            for checksum in set(self._fragments) - checksums:
+                del self._fragments[checksum]
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+
+section_render_cache = SectionRenderCache()
+
+
+class LRUCache(object):
+    """
+    LRUCache keeps a bounded number of entries in a memory of a running process. When a cache is full, a least recently
+    used entry is evicted.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+validation_cache = LRUCache(settings.HAPROXY_VALIDATION_CACHE_SIZE)
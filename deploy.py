@@ -0,0 +1,320 @@
+from api_core.exceptions import InternalServerErrorException
+from rest_framework.exceptions import APIException
+from helpers import raise_500_error, file_digest, config_digest, atomic_copy, list_section_files, install_section_files
+from jobs import WorkerPool
+from reload import reload_target, read_pids, pids_alive
+from threading import BoundedSemaphore, Event
+from contextlib import contextmanager
+from os.path import isfile, isdir
+import settings
+import metrics
+import fcntl
+import errno
+import json
+import time
+import os
+
+
+class DeployTarget(object):
+    """
+    DeployTarget is a single HAProxy instance a generated configuration is deployed to. It is described by a path to its
+    configuration file, a path to its pid file, a path to its runtime API socket and a way it is reloaded, see
+    reload.reload_target.
+    """
+
+    def __init__(self, name, config_path, pid_file_path=None, reload_cmd=None, restart_cmd=None, reload_mode=None,
+                 socket_path=None):
+        self.name = name
+        self.config_path = config_path
+        self.pid_file_path = pid_file_path or settings.HAPROXY_PID_FILE_PATH
+        self.reload_cmd = reload_cmd
+        self.restart_cmd = restart_cmd
+        self.reload_mode = reload_mode
+        self.socket_path = socket_path or settings.HAPROXY_RUNTIME_SOCKET_PATH
+
+    def reload_command(self):
+        """
+        Method creates a command reloading an instance. A reload is graceful when bash is available, otherwise an
+        instance is restarted.
+        :return: list of command arguments
+        """
+        haproxy_executable = getattr(settings, 'HAPROXY_EXECUTABLE', None) or 'haproxy'
+
+        if getattr(settings, 'BASH_PATH', None):
+            reload_cmd = self.reload_cmd or '{0} -f {1} -p {2} -sf $(<{2})'.format(
+                haproxy_executable, self.config_path, self.pid_file_path
+            )
+            return [settings.BASH_PATH, '-c', reload_cmd]
+        return (self.restart_cmd or '/etc/init.d/haproxy restart').split()
+
+
+def get_deploy_targets():
+    """
+    Function creates deploy targets listed in the HAPROXY_DEPLOY_TARGETS variable. When no targets are listed, a single
+    target is created from the HAPROXY_CONFIG_PATH, HAPROXY_PID_FILE_PATH, HAPROXY_RELOAD_CMD and HAPROXY_RESTART_CMD
+    variables.
+    :return: list of DeployTarget
+    """
+    targets = getattr(settings, 'HAPROXY_DEPLOY_TARGETS', None)
+    if targets:
+        return [DeployTarget(**target) for target in targets]
+
+    return [DeployTarget(
+        'default', settings.HAPROXY_CONFIG_PATH, getattr(settings, 'HAPROXY_PID_FILE_PATH', None),
+        getattr(settings, 'HAPROXY_RELOAD_CMD', None), getattr(settings, 'HAPROXY_RESTART_CMD', None)
+    )]
+
+
+def deploy_target(target, dev_config, dev_digest, reload_slots, failed):
+    """
+    Function deploys a configuration to a single target. A production file of a target is backed up to a file ending
+    with a .bak extension and replaced atomically, then a target is reloaded. Nothing is deployed nor reloaded, when a
+    content of both files is identical, or when another target has already failed and a deployment fails fast. A split
+    configuration is deployed same way, a directory of a target and its backup are switched as a whole, see
+    helpers.install_section_files. When a reload fails, a backed up configuration is restored, see roll_back_target.
+    :param target: DeployTarget
+    :param dev_config: path to a deployed configuration
+    :param dev_digest: digest of a deployed configuration
+    :param reload_slots: semaphore limiting a number of reloads running at once
+    :param failed: event set when a deployment of any target fails
+    :return: dictionary containing a return code, whether a target was reloaded and a result of a reload
+    :raises: api_core.exceptions.InternalServerErrorException
+    """
+    if failed.is_set():
+        return {'return code': 0, 'reloaded': False, 'skipped': True}
+
+    try:
+        split = isdir(dev_config)
+        if not (isdir if split else isfile)(target.config_path):
+            raise_500_error(2, '{0} is not a {1}.'.format(target.config_path, 'directory' if split else 'file'))
+
+        with metrics.timed('deploy_digest'):
+            if split:
+                unchanged = list_section_files(dev_config) == list_section_files(target.config_path)
+            else:
+                unchanged = dev_digest == file_digest(target.config_path)
+        if unchanged:
+            metrics.reloads_skipped.inc()
+            return {'return code': 0, 'reloaded': False}
+
+        try:
+            with metrics.timed('deploy_copy'):
+                if split:
+                    install_section_files(target.config_path, target.config_path + '.bak')
+                    install_section_files(dev_config, target.config_path)
+                else:
+                    atomic_copy(target.config_path, target.config_path + '.bak')
+                    atomic_copy(dev_config, target.config_path)
+        except (IOError, OSError) as e:
+            raise_500_error(e.errno, '{0} {1}'.format(e.strerror, e.filename or target.config_path))
+
+        with reload_slots:
+            old_pids = read_pids(target.pid_file_path)
+            try:
+                with metrics.timed('deploy_reload'):
+                    result = reload_target(target)
+            except APIException as e:
+                handed_over = isinstance(e.detail, dict) and e.detail.get('handed over', False)
+                rolled_back = roll_back_target(target, split, old_pids, handed_over)
+                if isinstance(e.detail, dict):
+                    e.detail['rolled back'] = rolled_back
+                raise
+
+        metrics.reloads.inc()
+        result['reloaded'] = True
+        return result
+    except:
+        failed.set()
+        raise
+
+
+def roll_back_target(target, split, old_pids, handed_over):
+    """
+    Function restores a backed up configuration of a target after a failed reload. An old HAProxy process keeps running
+    when a new one fails to start, thus restoring files is enough. When a running instance has been handed over to
+    a new process already, or processes listed by a pid file differ from ones running before a reload or do not run
+    anymore, a target is reloaded with a restored configuration.
+    :param target: DeployTarget
+    :param split: whether a configuration is a directory of section files
+    :param old_pids: pids listed by a pid file of a target before a failed reload
+    :param handed_over: whether a failed reload has reloaded a running instance, see reload.reload_target
+    :return: True when a restored configuration is the one being served
+    """
+    try:
+        if split:
+            install_section_files(target.config_path + '.bak', target.config_path)
+        else:
+            atomic_copy(target.config_path + '.bak', target.config_path)
+        pids = read_pids(target.pid_file_path)
+        if handed_over or pids != old_pids or not pids_alive(pids):
+            reload_target(target)
+    except (APIException, IOError, OSError):
+        return False
+    return True
+
+
+# Number of finished deploy jobs remembered by deploy_workers, jobs are waited for through their objects by
+# a deployment, which submitted them, thus none of them is ever looked up by an identifier
+DEPLOY_JOBS_KEPT = 100
+
+# Threads deploying targets, a queue is unbounded, as a number of queued jobs is limited by a number of targets
+deploy_workers = WorkerPool(settings.HAPROXY_DEPLOY_WORKERS, 0, DEPLOY_JOBS_KEPT)
+
+
+def deploy_configuration(dev_config, targets=None, fail_fast=None):
+    """
+    Function deploys a configuration to all targets concurrently by deploy_workers threads, thus a deployment takes as
+    long as a slowest target. At most HAPROXY_DEPLOY_RELOADS_MAX targets are reloaded at once. When a deployment fails
+    fast, targets not started yet are skipped after a first failure.
+    :param dev_config: path to a deployed configuration
+    :param targets: list of DeployTarget, targets from settings are used when omitted
+    :param fail_fast: boolean overriding the HAPROXY_DEPLOY_FAIL_FAST variable
+    :return: dictionary containing a return code, whether any target was reloaded, results of targets in an order of
+    targets and a digest of a deployed configuration
+    :raises: api_core.exceptions.InternalServerErrorException when any target fails
+    """
+    targets = targets or get_deploy_targets()
+    if fail_fast is None:
+        fail_fast = settings.HAPROXY_DEPLOY_FAIL_FAST
+
+    dev_digest = config_digest(dev_config)
+    reload_slots = BoundedSemaphore(settings.HAPROXY_DEPLOY_RELOADS_MAX)
+    failed = Event() if fail_fast else None
+    deadline = time.time() + settings.HAPROXY_DEPLOY_TIMEOUT
+
+    jobs = []
+    for target in targets:
+        # Without a fail fast, every target gets its own event, thus a failure is never seen by other targets
+        jobs.append(deploy_workers.submit(
+            lambda target=target: deploy_target(target, dev_config, dev_digest, reload_slots, failed or Event())
+        ))
+
+    results = []
+    for target, job in zip(targets, jobs):
+        if not job.wait(max(deadline - time.time(), 0)):
+            result = {'return code': 1, 'error': 'Deployment has not finished in time.'}
+        elif job.status_code == 200:
+            result = job.result
+        elif isinstance(job.result, dict):
+            result = dict(job.result)
+        else:
+            result = {'return code': 1, 'error': job.result}
+        result['target'] = target.name
+        results.append(result)
+
+    data = {
+        'return code': next((result['return code'] for result in results if result['return code']), 0),
+        'reloaded': any(result.get('reloaded') for result in results),
+        'targets': results,
+        'digest': dev_digest,
+    }
+    if data['return code']:
+        raise InternalServerErrorException(detail=data)
+    return data
+
+
+@contextmanager
+def file_lock(path, timeout=None):
+    """
+    Context manager holding an exclusive lock of a file, which is shared by all processes and threads, as every holder
+    opens a file on its own. A lock is released by an operating system, when a holding process dies.
+    :param path: path to a lock file, it is created when missing
+    :param timeout: number of seconds to wait for a lock at most, it is waited without a limit when omitted
+    :return: descriptor of a locked file
+    :raises: api_core.exceptions.InternalServerErrorException when a lock is not acquired in time
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (fcntl.LOCK_NB if deadline else 0))
+                break
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                if time.time() > deadline:
+                    raise_500_error(e.errno, 'Lock of {} has not been acquired in time.'.format(path))
+                time.sleep(0.05)
+        yield fd
+    finally:
+        os.close(fd)
+
+
+def update_deploy_state(func):
+    """
+    Function reads and updates a state of deployments shared by all processes through a file given by the
+    HAPROXY_DEPLOY_STATE_PATH variable. A state holds a number of a last requested deployment, a number of a last
+    requested deployment covered by a completed one and an outcome of a completed deployment.
+    :param func: function changing a state dictionary in place, it is called while a state file is locked
+    :return: value returned by a function
+    """
+    with file_lock(settings.HAPROXY_DEPLOY_STATE_PATH) as fd:
+        content = []
+        for chunk in iter(lambda: os.read(fd, 65536), b''):
+            content.append(chunk)
+        content = b''.join(content)
+        state = json.loads(content) if content else {'requested': 0, 'completed': 0, 'outcome': None}
+
+        value = func(state)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, json.dumps(state))
+        return value
+
+
+def shared_outcome(outcome):
+    """
+    Function turns an outcome of a deployment into a value returned to every caller, or into an exception raised.
+    :param outcome: dictionary containing a status code and data of a deployment
+    :return: data of a successful deployment
+    :raises: rest_framework.exceptions.APIException with a status code of a failed deployment
+    """
+    if outcome['status code'] == 200:
+        return outcome['data']
+
+    exception = APIException(detail=outcome['data'])
+    exception.status_code = outcome['status code']
+    raise exception
+
+
+def coalesce_deployment(deploy):
+    """
+    Function serializes deployments of all processes and coalesces requests waiting for a running deployment into
+    a single one. Every request takes a ticket first, then a request holding the HAPROXY_DEPLOY_LOCK_PATH lock waits
+    HAPROXY_DEPLOY_DEBOUNCE seconds for other requests and deploys a latest generated configuration for all tickets
+    taken meanwhile. Requests, whose ticket was covered by a completed deployment, only return its shared outcome,
+    thus a burst of requests results in a single reload.
+    :param deploy: function deploying a configuration, returning data of a response
+    :return: data of a deployment covering a request
+    :raises: rest_framework.exceptions.APIException when a deployment covering a request failed
+    """
+    def take_ticket(state):
+        state['requested'] += 1
+        return state['requested']
+
+    ticket = update_deploy_state(take_ticket)
+
+    with file_lock(settings.HAPROXY_DEPLOY_LOCK_PATH, settings.HAPROXY_DEPLOY_LOCK_TIMEOUT):
+        state = update_deploy_state(lambda state: dict(state))
+        if state['completed'] >= ticket:
+            metrics.deployments_coalesced.inc()
+            return shared_outcome(state['outcome'])
+
+        if settings.HAPROXY_DEPLOY_DEBOUNCE:
+            time.sleep(settings.HAPROXY_DEPLOY_DEBOUNCE)
+        # Requests taking a ticket until now find a configuration generated before, which is deployed next
+        covered = update_deploy_state(lambda state: state['requested'])
+
+        outcome = {'status code': 500, 'data': {'return code': 1, 'error': 'Deployment has been interrupted.'}}
+        try:
+            outcome = {'status code': 200, 'data': deploy()}
+        except APIException as e:
+            outcome = {'status code': e.status_code, 'data': e.detail}
+        except Exception as e:
+            outcome = {'status code': 500, 'data': {'return code': 1, 'error': str(e)}}
+            raise
+        finally:
+            update_deploy_state(lambda state: state.update(completed=covered, outcome=outcome))
+
+    return shared_outcome(outcome)
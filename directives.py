@@ -0,0 +1,178 @@
+from collections import OrderedDict, Counter
+import json
+
+# Operations of a section patch, see patch_directives
+PATCH_OPERATIONS = ('add', 'remove', 'replace')
+
+
+def directive_items(configuration):
+    """
+    Function lists directives of a section configuration in an order they are rendered in. A configuration is either
+    an ordered list of [key, value] pairs, which may repeat a key like a server, an acl or a use_backend, or a former
+    dictionary mapping unique keys to values.
+    :param configuration: list of pairs or dictionary
+    :return: list of (key, value) tuples
+    """
+    if isinstance(configuration, dict):
+        return list(configuration.iteritems())
+    return [tuple(item) for item in configuration]
+
+
+def validate_directives(configuration):
+    """
+    Function checks a structure of a section configuration.
+    :param configuration: decoded configuration
+    :raises: ValueError when a configuration is neither a dictionary nor a list of [key, value] pairs of strings
+    """
+    if isinstance(configuration, dict):
+        return
+    if not isinstance(configuration, list):
+        raise ValueError('Configuration must be a dictionary or a list of [key, value] pairs.')
+    for item in configuration:
+        if not isinstance(item, list) or len(item) != 2 or not isinstance(item[0], basestring) or \
+                not isinstance(item[1], (basestring, type(None))):
+            raise ValueError('Directive {} is not a [key, value] pair of strings.'.format(json.dumps(item)))
+
+
+def keyed_directives(configuration):
+    """
+    Function maps directives of a section to unique keys. A repeated key is extended by as many leading words of its
+    value as needed to make it unique, e.g. two servers become 'server web1' and 'server web2', thus versions of a same
+    section may be compared directive by directive.
+    :param configuration: list of pairs or dictionary
+    :return: ordered dictionary mapping unique keys to remaining values
+    """
+    items = directive_items(configuration)
+    counts = Counter(key for key, _ in items)
+    keyed = OrderedDict()
+
+    for key, value in items:
+        words = (value or '').split()
+        if counts[key] > 1:
+            key, words = ' '.join([key] + words[:1]), words[1:]
+            while key in keyed and words:
+                key += ' ' + words.pop(0)
+            value = ' '.join(words)
+        keyed[key] = value
+    return keyed
+
+
+def directive_matches(item, key, match=None):
+    """
+    Function checks, whether a line of a directive starts with words of a key followed by words of a match. A server is
+    thus matched by a 'server' key and its name, no matter whether it is stored under a 'server' or a 'server <name>'
+    key.
+    :param item: (key, value) pair of a directive
+    :param key: key of a directive
+    :param match: leading words of a value or None to match any value
+    :return: boolean
+    """
+    prefix = key.split() + (match or '').split()
+    return u'{0} {1}'.format(item[0], item[1] or '').split()[:len(prefix)] == prefix
+
+
+def clean_operations(operations):
+    """
+    Function validates operations of a section patch. An operation is a dictionary of an op, a key, a value and a match:
+    'add' inserts a [key, value] directive behind a last directive of a same key, or appends it, when there is none,
+    'remove' removes all directives matching a key and a match,
+    'replace' replaces a first directive matching a key and a match with a [key, value] directive.
+    A match selects directives by leading words of their values, e.g. a name of a server, see directive_matches.
+    :param operations: list of operations
+    :return: list of operations containing known keys only
+    :raises: ValueError when operations are invalid
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('Operations must be a non empty list.')
+
+    cleaned = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in PATCH_OPERATIONS:
+            raise ValueError('Operation must be one of {}.'.format(', '.join(PATCH_OPERATIONS)))
+        op, key, match, value = operation['op'], operation.get('key'), operation.get('match'), operation.get('value')
+        if not isinstance(key, basestring) or not key.strip():
+            raise ValueError('Operation {} requires a key.'.format(op))
+        if match is not None and not isinstance(match, basestring):
+            raise ValueError('Match of an operation must be a string.')
+        if op != 'remove' and not isinstance(value, basestring):
+            raise ValueError('Operation {} requires a value.'.format(op))
+
+        operation = {'op': op, 'key': key.strip()}
+        if match is not None and op != 'add':
+            operation['match'] = match
+        if op != 'remove':
+            operation['value'] = value
+        cleaned.append(operation)
+    return cleaned
+
+
+def patch_directives(configuration, operations):
+    """
+    Function applies operations of a section patch to a configuration, see clean_operations.
+    :param configuration: list of pairs or dictionary
+    :param operations: list of validated operations
+    :return: new list of [key, value] pairs
+    :raises: ValueError when a remove or a replace operation matches no directive
+    """
+    items = [list(item) for item in directive_items(configuration)]
+
+    for operation in operations:
+        key = operation['key']
+        if operation['op'] == 'add':
+            index = len(items)
+            for position, item in enumerate(items):
+                if item[0].split()[:1] == key.split()[:1]:
+                    index = position + 1
+            items.insert(index, [key, operation['value']])
+            continue
+
+        match = operation.get('match')
+        matched = [position for position, item in enumerate(items) if directive_matches(item, key, match)]
+        if not matched:
+            raise ValueError('Directive {} does not exist.'.format(' '.join([key] + (match or '').split())))
+        if operation['op'] == 'replace':
+            items[matched[0]] = [key, operation['value']]
+        else:
+            for position in reversed(matched):
+                del items[position]
+
+    return items
+
+
+def server_operations(configuration, server, action, value=None):
+    """
+    Function translates a change of a server into operations of a section patch, thus a change made through a runtime
+    API persists a next reload and is stored as a small patch of a backend section.
+    :param configuration: configuration of a backend section
+    :param server: name of a server
+    :param action: weight, maxconn, enable, disable, add or del
+    :param value: value of a change, e.g. a weight or an address of an added server
+    :return: list of operations
+    :raises: ValueError when a server is missing or already present
+    """
+    words = None
+    for item in directive_items(configuration):
+        if directive_matches(item, 'server', server):
+            words = u'{0} {1}'.format(item[0], item[1] or '').split()[2:]
+            break
+
+    if action == 'add':
+        if words is not None:
+            raise ValueError('Server {} already exists.'.format(server))
+        return [{'op': 'add', 'key': 'server', 'value': ' '.join([server] + str(value).split())}]
+    if words is None:
+        raise ValueError('Server {} does not exist.'.format(server))
+    if action == 'del':
+        return [{'op': 'remove', 'key': 'server', 'match': server}]
+
+    if action in ('weight', 'maxconn'):
+        if action in words[1:]:
+            words[words.index(action, 1) + 1] = str(value)
+        else:
+            words += [action, str(value)]
+    elif action == 'disable' and 'disabled' not in words:
+        words.append('disabled')
+    elif action == 'enable' and 'disabled' in words:
+        words.remove('disabled')
+
+    return [{'op': 'replace', 'key': 'server', 'match': server, 'value': ' '.join([server] + words)}]
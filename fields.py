@@ -1,41 +1,149 @@
 from django.db import models
+import settings
 import json
 import base64
+import zlib
+
+STORAGE_PREFIXES = ('json:', 'zlib:', 'base64:')
+
+
+def encode_json_value(value, storage_format=None, compress_threshold=None):
+    """
+    Function serializes JSON data into a string stored in a database. Data are stored in a format given by the
+    HAPROXY_JSON_FIELD_FORMAT variable, which is 'json' for a compact JSON, 'zlib' for a compressed JSON, when it
+    exceeds the HAPROXY_JSON_FIELD_COMPRESS_THRESHOLD size, and 'base64' for a former Base64 format. Every format is
+    marked by a prefix, thus data stored in different formats may be mixed in a single column.
+    :param value: JSON data or a string containing them
+    :param storage_format: format overriding the HAPROXY_JSON_FIELD_FORMAT variable
+    :param compress_threshold: size overriding the HAPROXY_JSON_FIELD_COMPRESS_THRESHOLD variable
+    :return: prefixed string
+    """
+    storage_format = storage_format or settings.HAPROXY_JSON_FIELD_FORMAT
+    if compress_threshold is None:
+        compress_threshold = settings.HAPROXY_JSON_FIELD_COMPRESS_THRESHOLD
+
+    if storage_format == 'base64':
+        if not isinstance(value, basestring):
+            value = json.dumps(value)
+        return 'base64:' + base64.encodestring(json.dumps(value))
+
+    if isinstance(value, basestring):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+    data = json.dumps(value, separators=(',', ':'))
+
+    if storage_format == 'zlib' and len(data) >= compress_threshold:
+        return 'zlib:' + base64.b64encode(zlib.compress(data))
+    return 'json:' + data
+
+
+def decode_json_value(value):
+    """
+    Function deserializes JSON data stored in any of formats produced by the encode_json_value function.
+    :param value: prefixed string
+    :return: JSON data
+    """
+    prefix, data = value.split(':', 1)
+
+    if prefix == 'json':
+        return json.loads(data)
+    if prefix == 'zlib':
+        return json.loads(zlib.decompress(base64.b64decode(data)))
+
+    data = json.loads(base64.decodestring(data))
+    if isinstance(data, basestring):
+        data = json.loads(data)
+    return data
+
+
+def is_encoded(value):
+    """
+    Function checks, whether a value is serialized data retrieved from a database.
+    :param value: value to be checked
+    :return: boolean
+    """
+    return isinstance(value, basestring) and value.startswith(STORAGE_PREFIXES)
+
+
+class LazyJsonDescriptor(object):
+    """
+    Descriptor holding a raw value retrieved from a database in a model instance until a field is actually read. Data
+    are deserialized on a first access only and kept for subsequent ones, thus rows loaded for other columns never pay
+    for a decoding.
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+
+        value = obj.__dict__[self.field.name]
+        if is_encoded(value):
+            value = obj.__dict__[self.field.name] = decode_json_value(value)
+        return value
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.field.name] = value if is_encoded(value) else self.field.to_python(value)
 
 
 class Base64JsonField(models.TextField):
     """
-    Base64JsonField is a custom field intended to store a JSON data in a Base64 format to a text column in relational
-    databases. Stored data are first serialized into a JSON string representation and then encoded into a Base64 format.
-    When retrieving this data, same logic is applied in a reverse order.
+    Base64JsonField is a custom field intended to store a JSON data to a text column in relational databases. Stored
+    data are serialized into a compact JSON string representation, optionally compressed, see encode_json_value. The
+    field was storing data encoded into a Base64 format formerly, these are still read, until they are converted by
+    a migration. When retrieving this data, same logic is applied in a reverse order, once a field is accessed. A field
+    may override a storage format and a compression threshold given by settings, e.g. to compress every value.
     """
-    __metaclass__ = models.SubfieldBase
+
+    def __init__(self, *args, **kwargs):
+        self.descriptor_class = kwargs.pop('descriptor_class', LazyJsonDescriptor)
+        self.storage_format = kwargs.pop('storage_format', None)
+        self.compress_threshold = kwargs.pop('compress_threshold', None)
+        super(Base64JsonField, self).__init__(*args, **kwargs)
+
+    def contribute_to_class(self, cls, name):
+        super(Base64JsonField, self).contribute_to_class(cls, name)
+        setattr(cls, name, self.descriptor_class(self))
+
+    def pre_save(self, model_instance, add):
+        """
+        Returns a raw value held by a model instance, thus a value, which was never read, is written back as it was
+        retrieved and a descriptor is not asked to resolve it.
+        :param model_instance: model instance being saved
+        :param add: whether an instance is being created
+        :return: raw value
+        """
+        return model_instance.__dict__.get(self.attname)
 
     def get_prep_value(self, value):
         """
-        Encodes JSON data into a Base64 format, when preparing them to be written to a database.
+        Serializes JSON data, when preparing them to be written to a database.
         :param value: data to be serialized and stored
-        :return: Base64 string
+        :return: prefixed string
         """
+        if is_encoded(value):
+            return value
         if value is not None:
-            return 'base64:' + base64.encodestring(json.dumps(value))
+            return encode_json_value(value, self.storage_format, self.compress_threshold)
 
     def to_python(self, value):
         """
-        Decodes Base64 serialized JSON data. This method is called when data are gathered from a database as well as
+        Deserializes stored JSON data. This method is called when data are assigned to a model instance as well as
         when this class is instantiated, introducing need to differ a passed in value due to later processing.
-        Distinction is accomplished by appending of a 'base64:' prefix before encoded data.
+        Distinction is accomplished by a prefix of serialized data, see encode_json_value.
         :param value: serialized data from database
         :return: JSON data
         """
         if value is not None and isinstance(value, basestring):
+            if is_encoded(value):
+                return decode_json_value(value)
             value = str(value)
-            if value.startswith('base64:'):
-                value = value.split(':')[1]
-                prepared_data = json.loads(base64.decodestring(value))
-                return json.loads(prepared_data)
         elif value is not None and isinstance(value, dict):
             value = json.dumps(value)
             return value
 
-        return value
\ No newline at end of file
+        return value
@@ -1,35 +1,630 @@
-from api_core.exceptions import InternalServerErrorException
+from api_core.exceptions import InternalServerErrorException, DoesNotExistException
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags, quote_etag
+from models import HaProxyConfigModel
+from directives import validate_directives, keyed_directives
+from cache import validation_cache
+from distutils.spawn import find_executable
+from contextlib import contextmanager
+from itertools import islice
+from bisect import bisect_right
+from hashlib import md5
+import subprocess
+import metrics
+import tempfile
 import settings
+import shutil
+import os
+import base64
+import json
 import re
 
 
-def parse_haproxy_configtest_output(output):
+def parse_haproxy_configtest_output(output, line_map=None, config_path=None):
     """
-    This function parses an output of a HAProxy configuration test.
+    This function parses an output of a HAProxy configuration test in a single pass. Every message is turned into
+    a diagnostic containing its level, a file and a line number it refers to, and a message itself. Continuation lines
+    are joined to a message they belong to. When a line map of a generated configuration is passed in, a diagnostic
+    referring to a line of that configuration contains a checksum of a section, which produced the line. A diagnostic
+    referring to a section file of a split configuration contains a checksum from a name of a file.
     :param output: output of a 'haproxy' command
-    :return: parsed output in a form of a list
+    :param line_map: line map of a generated configuration, see write_line_map
+    :param config_path: path to a generated configuration the line map belongs to
+    :return: parsed output in a form of a list of dictionaries
     """
-    output_sections = re.compile('^\[[A-Z]+\]')
-    blacklisted_lines = ' '.join(settings.HAPROXY_BLACKLISTED_OUTPUT)
-    configtest_output = output.splitlines()
+    header = re.compile(r'^\[(?P<level>[A-Z]+)\]\s*(?:[0-9/]+\s+)?(?:\(\d+\)\s*)?:\s?(?P<message>.*)$')
+    location = re.compile(r'\[(?P<file>[^\[\]]+):(?P<line>\d+)\]')
+    blacklisted = tuple(settings.HAPROXY_BLACKLISTED_OUTPUT)
+    config_path = os.path.abspath(config_path) if config_path else None
+    starts, checksums = zip(*line_map) if line_map else ((), ())
     parsed_output = []
-    previous_line = ''
+    diagnostic = None
 
-    if not output:
-        return []
+    for line in (output or '').splitlines():
+        match = header.match(line)
+        if match:
+            message = match.group('message').strip()
+            diagnostic = None
+            if message.startswith(blacklisted):
+                continue
 
-    for line in configtest_output:
-        if line not in blacklisted_lines:
-            if output_sections.match(line):
-                if previous_line:
-                    parsed_output.append(previous_line)
-                previous_line = line
-            elif line.startswith('   |'):
-                previous_line += line.replace('   |', '')
+            diagnostic = {'level': match.group('level'), 'file': None, 'line': None, 'message': message,
+                          'checksum': None}
+            found = location.search(message)
+            if found:
+                diagnostic['file'], diagnostic['line'] = found.group('file'), int(found.group('line'))
+                if starts and os.path.abspath(diagnostic['file']) == config_path:
+                    index = bisect_right(starts, diagnostic['line']) - 1
+                    diagnostic['checksum'] = checksums[index] if index >= 0 else None
+                else:
+                    section_file = SECTION_FILE_PATTERN.match(os.path.basename(diagnostic['file']))
+                    diagnostic['checksum'] = section_file.group('checksum') if section_file else None
+            parsed_output.append(diagnostic)
+        elif diagnostic is not None and line.startswith('   |'):
+            diagnostic['message'] += ' ' + line[4:].strip()
 
     return parsed_output
 
 
+# Name of a section file of a split configuration, see section_file_name
+SECTION_FILE_PATTERN = re.compile(r'^\d+-.+-(?P<checksum>[0-9a-f]{32})\.cfg$')
+
+
+def section_file_name(weight, section, section_name, checksum):
+    """
+    Function creates a name of a file holding a single section of a split configuration. HAProxy loads files of
+    a directory in a lexical order, thus names start with a weight of a section. A checksum in a name identifies
+    a content of a file, a file is rewritten only when a new version of a section becomes active.
+    :param weight: weight of a section, see HaProxyConfigModel.get_section_weight
+    :param section: section type
+    :param section_name: name of a section or None
+    :param checksum: checksum of a section
+    :return: file name
+    """
+    name = re.sub(r'[^\w.-]', '_', '{0}-{1}'.format(section, section_name or ''))
+    return '{0:02d}-{1}-{2}.cfg'.format(weight or 0, name, checksum)
+
+
+def list_section_files(directory):
+    """
+    Function lists section files of a split configuration, other files of a directory are left out.
+    :param directory: path to a directory
+    :return: sorted list of file names
+    """
+    return sorted(name for name in os.listdir(directory) if SECTION_FILE_PATTERN.match(name))
+
+
+def install_section_files(source, destination):
+    """
+    Function installs section files of a source directory into a destination atomically. Files are staged in a new
+    directory next to a destination, then a destination, which is a symbolic link to a staged directory, is switched
+    to it by a rename, thus HAProxy never loads a mix of old and new files, even when an installation is interrupted.
+    Files are hard linked from a source, as they are only ever replaced and never changed in place, and copied only
+    when a source is on another file system. A formerly staged directory of a destination is removed afterwards.
+    A destination, which is a plain directory, is moved aside once, which is the only moment it is missing.
+    :param source: path to a source directory
+    :param destination: path to a destination link
+    :return: list of installed file names
+    """
+    parent, base = os.path.split(os.path.abspath(destination))
+    prefix = '.{}.'.format(base)
+    former = os.path.realpath(destination) if os.path.isdir(destination) else None
+    stage = tempfile.mkdtemp(dir=parent, prefix=prefix)
+    names = list_section_files(source)
+
+    try:
+        for name in names:
+            try:
+                os.link(os.path.join(source, name), os.path.join(stage, name))
+            except OSError:
+                atomic_copy(os.path.join(source, name), os.path.join(stage, name))
+        os.chmod(stage, os.stat(former).st_mode & 0o7777 if former else 0o755)
+        fsync_directory(stage)
+
+        if former is not None and not os.path.islink(destination):
+            former = os.path.join(parent, prefix + os.path.basename(stage)[len(prefix):] + '.former')
+            os.rename(destination, former)
+        link = stage + '.link'
+        os.symlink(os.path.basename(stage), link)
+        os.rename(link, destination)  # Atomic replace of a link on POSIX systems
+    except:
+        shutil.rmtree(stage, ignore_errors=True)
+        raise
+
+    fsync_directory(parent)
+    # Only a directory staged by this function is removed, not a directory a link was pointed to by hand
+    if former is not None and os.path.basename(former).startswith(prefix) and \
+            os.path.realpath(os.path.dirname(former)) == os.path.realpath(parent):
+        shutil.rmtree(former, ignore_errors=True)
+    return names
+
+
+def read_config_checksums(config_path, digest=None):
+    """
+    Function lists checksums of sections contained in a generated configuration, which is either a single file with
+    a line map or a directory of section files.
+    :param config_path: path to a generated configuration
+    :param digest: digest of a single file a line map has to describe, see read_line_map
+    :return: list of checksums in an order of a configuration, empty when a line map does not describe a file
+    """
+    if os.path.isdir(config_path):
+        return [SECTION_FILE_PATTERN.match(name).group('checksum') for name in list_section_files(config_path)]
+    return [checksum for _, checksum in read_line_map(config_path, digest) or []]
+
+
+def read_config_files(config_path):
+    """
+    Function reads a whole configuration, which is either a single file or a directory of section files.
+    :param config_path: path to a configuration
+    :return: list of pairs of a file name and a content, a single file has an empty name
+    """
+    if not os.path.isdir(config_path):
+        with open(config_path, 'rb') as f:
+            return [['', f.read()]]
+
+    files = []
+    for name in list_section_files(config_path):
+        with open(os.path.join(config_path, name), 'rb') as f:
+            files.append([name, f.read()])
+    return files
+
+
+def write_config_files(config_path, files):
+    """
+    Function writes a configuration read by read_config_files. A single file is written atomically, section files of
+    a directory are written only when missing, as their names contain checksums of sections, and stale ones are removed.
+    A file or a directory of a different kind found in a path is replaced.
+    :param config_path: path to a configuration
+    :param files: list of pairs of a file name and a content
+    """
+    def encode(content):
+        return content if isinstance(content, bytes) else content.encode('utf-8')
+
+    if len(files) == 1 and not files[0][0]:
+        if os.path.isdir(config_path):
+            shutil.rmtree(config_path)
+        atomic_write(config_path, [encode(files[0][1])])
+        return
+
+    if os.path.isfile(config_path):
+        os.unlink(config_path)
+    if not os.path.isdir(config_path):
+        os.makedirs(config_path)
+    existing = set(list_section_files(config_path))
+    for name, content in files:
+        if name not in existing:
+            atomic_write(os.path.join(config_path, name), [encode(content)])
+    for name in existing - set(name for name, _ in files):
+        os.unlink(os.path.join(config_path, name))
+
+
+def files_digest(files):
+    """
+    Function computes a digest of a configuration read by read_config_files, which equals to a digest computed by
+    config_digest from a file or a directory.
+    :param files: list of pairs of a file name and a content
+    :return: md5 hex digest
+    """
+    if len(files) == 1 and not files[0][0]:
+        return md5(files[0][1]).hexdigest()
+
+    digest = md5()
+    for name, content in sorted(files):
+        digest.update('{0} {1}\n'.format(name, md5(content).hexdigest()))
+    return digest.hexdigest()
+
+
+def write_line_map(config_path, line_map, digest):
+    """
+    Function stores a line map of a generated configuration next to it, in a file with a .map extension. A map is
+    stored along with a digest of a configuration it describes, thus a map and a configuration replaced one after
+    another are never read as a pair, see read_line_map.
+    :param config_path: path to a generated configuration
+    :param line_map: list of pairs of a first line number of a section and its checksum, in an order of lines
+    :param digest: md5 hex digest of a generated configuration
+    """
+    atomic_write(config_path + '.map', [json.dumps({'digest': digest, 'lines': line_map})])
+
+
+def read_line_map(config_path, digest=None):
+    """
+    Function loads a line map of a generated configuration, see write_line_map.
+    :param config_path: path to a generated configuration
+    :param digest: digest of a configuration a map has to describe, a digest of a current file when omitted
+    :return: list of pairs of a first line number of a section and its checksum, or None when there is no map or
+    a map describes another configuration
+    """
+    try:
+        with open(config_path + '.map') as f:
+            data = json.load(f)
+        if digest is None:
+            digest = file_digest(config_path)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('digest') != digest:
+        return None
+    return data['lines']
+
+
+def build_section(data):
+    """
+    Function validates posted section data and prepares a section to be stored. Validation is shared by a single as
+    well as by a bulk creation of sections.
+    :param data: dictionary containing section, section_name and configuration keys
+    :return: unsaved HaProxyConfigModel object
+    :raises: ValueError when data are invalid
+    """
+    section = data.get('section', None)
+    section_name = data.get('section_name', None)
+    configuration = data.get('configuration', None)
+
+    if section is None or configuration is None:
+        raise ValueError('Section and configuration are required.')
+    if section in settings.HAPROXY_CONFIG_NAMED_SECTIONS and section_name is None:
+        raise ValueError('Section {} must be named.'.format(section))
+    if not isinstance(configuration, basestring):
+        configuration = json.dumps(configuration)
+    validate_directives(json.loads(configuration))  # Should raise ValueError if configuration data are invalid
+
+    return HaProxyConfigModel(section=section, section_name=section_name, configuration=configuration)
+
+
+def parse_haproxy_config(lines):
+    """
+    Generator parses an existing HAProxy configuration file line by line, thus a file of any size is never loaded into
+    memory as a whole. Comments are stripped. Directives are kept as an ordered list of [key, value] pairs, thus
+    a directive repeated within a section, like a server or an acl, renders back into same lines in a same order.
+    :param lines: iterable of configuration file lines
+    :return: generator of dictionaries containing section, section_name and configuration keys
+    :raises: ValueError when a directive is found outside of a section
+    """
+    comment = re.compile(r'(^|\s)#.*$')
+    section = None
+
+    for line in lines:
+        words = comment.sub('', line).split(None, 1)
+        if not words:
+            continue
+
+        if words[0] in settings.HAPROXY_CONFIG_SECTIONS:
+            if section is not None:
+                section['configuration'] = json.dumps(section['configuration'])
+                yield section
+            section_name = words[1].strip() if len(words) > 1 else None
+            section = {'section': words[0], 'section_name': section_name, 'configuration': []}
+        elif section is None:
+            raise ValueError('Directive {} is outside of a section.'.format(words[0]))
+        else:
+            section['configuration'].append([words[0], words[1].strip() if len(words) > 1 else ''])
+
+    if section is not None:
+        section['configuration'] = json.dumps(section['configuration'])
+        yield section
+
+
+def diff_directives(old, new):
+    """
+    Function compares directives of two versions of a section. Repeated directives are compared by their unique keys,
+    see directives.keyed_directives.
+    :param old: configuration of a former version
+    :param new: configuration of a latter version
+    :return: dictionary of added and removed directives and of changed ones with their former and latter values
+    """
+    old, new = keyed_directives(old), keyed_directives(new)
+    return {
+        'added': dict((key, value) for key, value in new.iteritems() if key not in old),
+        'removed': dict((key, value) for key, value in old.iteritems() if key not in new),
+        'changed': dict(
+            (key, {'old': old[key], 'new': value}) for key, value in new.iteritems() if key in old and old[key] != value
+        ),
+    }
+
+
+def proxy_sections():
+    """
+    Function maps proxies of a running HAProxy to active sections, which configure them, see map_proxy_sections.
+    :return: dictionary mapping (name, 'frontend' or 'backend') tuples to (section, checksum) tuples
+    """
+    active = HaProxyConfigModel.objects.active().filter(section__in=settings.HAPROXY_CONFIG_NAMED_SECTIONS)
+    return map_proxy_sections(active.values_list('section', 'section_name', 'checksum'))
+
+
+def deployed_proxy_sections(deployment):
+    """
+    Function maps proxies of a running HAProxy to sections of a deployed configuration, which configure them, see
+    map_proxy_sections.
+    :param deployment: HaProxyDeploymentModel of a last deployment, None when nothing has been deployed
+    :return: dictionary mapping (name, 'frontend' or 'backend') tuples to (section, checksum) tuples
+    """
+    deployed = deployment.get_sections() if deployment is not None else {}
+    return map_proxy_sections(
+        (section, section_name, checksum) for (section, section_name), checksum in deployed.iteritems()
+    )
+
+
+def map_proxy_sections(sections):
+    """
+    Function maps proxies to sections, which configure them. A frontend is configured by a frontend or a listen section,
+    a backend and its servers by a backend or a listen section. Sections without a name configure no proxy.
+    :param sections: iterable of (section, section_name, checksum) tuples
+    :return: dictionary mapping (name, 'frontend' or 'backend') tuples to (section, checksum) tuples
+    """
+    proxies = {}
+    for section, section_name, checksum in sections:
+        if section not in settings.HAPROXY_CONFIG_NAMED_SECTIONS:
+            continue
+        proxies[(section_name, 'frontend' if section == 'frontend' else 'backend')] = (section, checksum)
+        if section == 'listen':
+            proxies[(section_name, 'frontend')] = (section, checksum)
+    return proxies
+
+
+@contextmanager
+def override_haproxy_settings(**kwargs):
+    """
+    Context manager overriding variables of api_haproxy settings, which are restored on an exit. Tests and benchmarks
+    use it to point paths and commands elsewhere.
+    :param kwargs: names of variables and their values
+    """
+    original = dict((key, getattr(settings, key)) for key in kwargs)
+    for key, value in kwargs.items():
+        setattr(settings, key, value)
+    try:
+        yield
+    finally:
+        for key, value in original.items():
+            setattr(settings, key, value)
+
+
+def chunked(iterable, size):
+    """
+    Generator splits an iterable into lists of a given size. It keeps queries with a long list of checksums in an IN
+    clause within limits of a database backend.
+    :param iterable: items to be split
+    :param size: maximum length of a chunk
+    :return: generator of lists
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def encode_cursor(config):
+    """
+    Function creates an opaque pagination cursor pointing behind a given section.
+    :param config: last section of a page
+    :return: cursor string
+    """
+    return base64.urlsafe_b64encode('{0}|{1}'.format(config.create_time.isoformat(), config.checksum))
+
+
+def decode_cursor(cursor):
+    """
+    Function decodes a pagination cursor created by the encode_cursor function.
+    :param cursor: cursor string
+    :return: tuple of a create time and a checksum
+    :raises: ValueError when a cursor is malformed
+    """
+    try:
+        create_time, checksum = base64.urlsafe_b64decode(str(cursor)).split('|')
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor.')
+
+    create_time = parse_datetime(create_time)
+    if create_time is None:
+        raise ValueError('Invalid cursor.')
+    return create_time, checksum
+
+
+def iter_sections(queryset, chunk_size):
+    """
+    Generator walks through sections of a queryset in an order of a create time and a checksum. Sections are fetched
+    in chunks following a last seen section, thus memory usage stays flat no matter how many sections there are.
+    Versions patched by sections of a chunk are loaded along, see HaProxyConfigManager.resolve_patches.
+    :param queryset: HaProxyConfigQuerySet
+    :param chunk_size: number of sections fetched at once
+    :return: generator of sections
+    """
+    queryset = queryset.order_by('create_time', 'checksum')
+    chunk = HaProxyConfigModel.objects.resolve_patches(queryset[:chunk_size])
+
+    while chunk:
+        for config in chunk:
+            yield config
+        last = chunk[-1]
+        chunk = HaProxyConfigModel.objects.resolve_patches(queryset.after(last.create_time, last.checksum)[:chunk_size])
+
+
+def section_etag(checksum, create_time):
+    """
+    Function creates a strong ETag of a section. Configuration of a section is immutable per checksum, while its meta
+    changes only together with a create time, when a section is touched.
+    :param checksum: checksum of a section
+    :param create_time: create time of a section
+    :return: quoted ETag
+    """
+    return quote_etag('{0}-{1}'.format(checksum, create_time.strftime('%Y%m%d%H%M%S%f')))
+
+
+def configuration_etag(sections):
+    """
+    Function creates a strong ETag of a configuration, which is fully identified by its active sections.
+    :param sections: iterable of checksum and create time pairs of active sections
+    :return: quoted ETag
+    """
+    digest = md5()
+    for checksum, create_time in sorted(sections):
+        digest.update(section_etag(checksum, create_time))
+    return quote_etag(digest.hexdigest())
+
+
+def etag_matches(request, etag):
+    """
+    Function checks an If-None-Match header of a request against a current ETag of a resource.
+    :param request: request data
+    :param etag: quoted ETag
+    :return: True when a client already has a current representation
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', None)
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or parse_etags(etag)[0] in etags
+
+
+def file_digest(path, chunk_size=65536):
+    """
+    Function computes a digest of a file content, reading a file in chunks.
+    :param path: path to a file
+    :param chunk_size: number of bytes read at once
+    :return: md5 hex digest
+    """
+    digest = md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def config_digest(path):
+    """
+    Function computes a digest of a configuration, which is either a single file or a directory of section files. A
+    digest of a directory is computed from names and contents of its section files.
+    :param path: path to a file or a directory
+    :return: md5 hex digest
+    """
+    if not os.path.isdir(path):
+        return file_digest(path)
+
+    digest = md5()
+    for name in list_section_files(path):
+        digest.update('{0} {1}\n'.format(name, file_digest(os.path.join(path, name))))
+    return digest.hexdigest()
+
+
+def atomic_write(path, chunks):
+    """
+    Function writes a file atomically. Data are written to a temporary file in a same directory, flushed to a disk and
+    renamed over a destination, thus a reader never sees a half-written file. Permissions of a replaced file are kept.
+    :param path: path to a destination file
+    :param chunks: iterable of strings to be written
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.{}.'.format(os.path.basename(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.writelines(chunks)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.rename(tmp_path, path)  # Atomic replace on POSIX systems
+    except:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    fsync_directory(directory)
+
+
+def fsync_directory(path):
+    """
+    Function flushes entries of a directory to a disk, thus created and renamed files survive a crash.
+    :param path: path to a directory
+    """
+    dir_fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def atomic_copy(source, destination, chunk_size=65536):
+    """
+    Function copies a file atomically, see atomic_write.
+    :param source: path to a source file
+    :param destination: path to a destination file
+    :param chunk_size: number of bytes copied at once
+    """
+    with open(source, 'rb') as f:
+        atomic_write(destination, iter(lambda: f.read(chunk_size), b''))
+
+
+def validate_configuration():
+    """
+    Function is calling 'haproxy' command to validate newly generated configuration in a location provided by the
+    HAPROXY_CONFIG_DEV_PATH variable. Validation is performed by a command specified in the HAPROXY_VALIDATION_CMD
+    variable, which output is then parsed. Parsed outputs are cached, thus a repeated validation of an unchanged
+    configuration with an unchanged haproxy binary does not execute a command again.
+    :return: dictionary containing a return code and a parsed output
+    :raises: api_core.exceptions.DoesNotExistException, api_core.exceptions.InternalServerErrorException
+    """
+    haproxy_executable = getattr(settings, 'HAPROXY_EXECUTABLE', None) or 'haproxy'
+    haproxy_validation_cmd = getattr(settings, 'HAPROXY_VALIDATION_CMD', None)
+    haproxy_dev_conf = settings.HAPROXY_CONFIG_DEV_PATH
+
+    if not haproxy_validation_cmd:
+        haproxy_validation_cmd = '{0} -f {1} -c'.format(haproxy_executable, haproxy_dev_conf)
+
+    if not os.path.exists(haproxy_dev_conf):
+        raise DoesNotExistException(detail='{} is not a file nor a directory.'.format(haproxy_dev_conf))
+
+    with metrics.timed('validate_cache_key'):
+        cache_key = validation_cache_key(haproxy_validation_cmd, haproxy_dev_conf)
+    cached = validation_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        metrics.validation_cache_hits.inc()
+        return_code, validate_output = cached
+    else:
+        return_code, validate = 0, 'There has been no output so far.'
+        try:
+            with metrics.timed('validate_command'):
+                validate = subprocess.check_output(haproxy_validation_cmd.split(), stderr=subprocess.STDOUT)
+        # Exception is caught when an executed command returns a non zero code
+        except subprocess.CalledProcessError as e:
+            return_code, validate = e.returncode, e.output
+
+        # Exception is caught when no executable is found
+        except OSError as e:
+            metrics.validation_failures.inc()
+            err_message = str(e.strerror) + '. Make sure HAProxy is installed and a path to its binary is correct.'
+            raise_500_error(e.errno, err_message)
+
+        with metrics.timed('validate_parse'):
+            line_map = read_line_map(haproxy_dev_conf)
+            validate_output = parse_haproxy_configtest_output(validate, line_map, haproxy_dev_conf)
+        # Result is cached only when a configuration has not changed during a validation
+        if cache_key and cache_key == validation_cache_key(haproxy_validation_cmd, haproxy_dev_conf):
+            validation_cache.set(cache_key, (return_code, validate_output))
+
+    if return_code:
+        metrics.validation_failures.inc()
+        raise_500_error(return_code, validate_output)
+    return {'return code': 0, 'detail': validate_output}
+
+
+def validation_cache_key(validation_cmd, config_path):
+    """
+    Function creates a key of a validation result. A result depends on a content of a validated configuration,
+    a validation command and a haproxy binary, identified by its path, size and modification time.
+    :param validation_cmd: command validating a configuration
+    :param config_path: path to a validated configuration
+    :return: tuple or None, when a binary is not found
+    """
+    executable = validation_cmd.split()[0]
+    if os.path.dirname(executable):
+        executable = os.path.abspath(executable)
+    else:
+        executable = find_executable(executable)
+    if not executable or not os.path.isfile(executable):
+        return None
+
+    executable_stat = os.stat(executable)
+    return (config_digest(config_path), validation_cmd, executable, executable_stat.st_size, executable_stat.st_mtime)
+
+
 def raise_500_error(return_code, error_message):
     """
     Function simplifies generation of a Internal Server Error with a custom body message. Its primary purpose is to make
@@ -0,0 +1,205 @@
+from rest_framework.exceptions import APIException
+from helpers import atomic_write
+from collections import OrderedDict
+from threading import Thread, Event, Lock
+from Queue import Queue, Full
+from uuid import uuid4
+import settings
+import errno
+import json
+import time
+import os
+
+# Number of seconds between reads of a state of a job, which is waited for by another process
+JOB_POLL_INTERVAL = 0.1
+
+
+class Job(object):
+    """
+    Job wraps a function executed by a WorkerPool. Its state, result and a status code of a result are kept for a client
+    polling for them. Results of functions raising an APIException are reported same way as a view would report them.
+    When a pool keeps states in a directory, every change of a state is written to a file, see StoredJob.
+    """
+
+    def __init__(self, func, state_dir=None):
+        self.id = uuid4().hex
+        self.func = func
+        self.status = 'queued'
+        self.status_code = None
+        self.result = None
+        self.state_path = os.path.join(state_dir, self.id + '.json') if state_dir else None
+        self._finished = Event()
+
+    def store(self):
+        if self.state_path:
+            try:
+                atomic_write(self.state_path, [json.dumps(self.to_dict())])
+            except (IOError, OSError):
+                pass  # A job is still polled for through a process, which accepted it
+
+    def run(self):
+        self.status = 'running'
+        self.store()
+        try:
+            self.result = self.func()
+            self.status_code = 200
+        except APIException as e:
+            self.result = e.detail
+            self.status_code = e.status_code
+        except Exception as e:
+            self.result = str(e)
+            self.status_code = 500
+        finally:
+            self.status = 'finished'
+            self.store()
+            self._finished.set()
+
+    def wait(self, timeout):
+        """
+        Method blocks until a job is finished or a timeout expires.
+        :param timeout: number of seconds to wait at most
+        :return: True when a job is finished
+        """
+        self._finished.wait(timeout)
+        return self._finished.is_set()
+
+    def to_dict(self):
+        return {'job': self.id, 'status': self.status, 'status code': self.status_code, 'result': self.result}
+
+
+class StoredJob(object):
+    """
+    StoredJob is a state of a Job read from a file, thus a job submitted to a worker process is polled for through any
+    other process of a same host. Waiting for a job reads its file repeatedly.
+    """
+
+    def __init__(self, state_path, data):
+        self.state_path = state_path
+        self.data = data
+
+    @classmethod
+    def load(cls, state_path):
+        """
+        Method reads a state of a job.
+        :param state_path: path to a state file
+        :return: StoredJob or None, when a file does not exist
+        """
+        try:
+            with open(state_path) as f:
+                return cls(state_path, json.load(f))
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+    def wait(self, timeout):
+        """
+        Method blocks until a job is finished or a timeout expires.
+        :param timeout: number of seconds to wait at most
+        :return: True when a job is finished
+        """
+        deadline = time.time() + timeout
+        while self.data['status'] != 'finished' and time.time() < deadline:
+            time.sleep(JOB_POLL_INTERVAL)
+            self.data = (self.load(self.state_path) or self).data
+        return self.data['status'] == 'finished'
+
+    def to_dict(self):
+        return self.data
+
+
+class WorkerPool(object):
+    """
+    WorkerPool executes jobs by a fixed number of daemon threads started on a first submission. Submitted jobs wait in
+    a queue of a bounded size, a submission is refused when a queue is full. Finished jobs are kept for polling until
+    a number of kept jobs exceeds a limit, oldest ones are forgotten first. Workers and a queue belong to a process,
+    but with a state directory given, states of jobs are kept in files shared by all processes, thus a job is polled
+    for through any process of a multi-process server.
+    """
+
+    def __init__(self, workers, queue_size, jobs_kept, state_dir=None):
+        self.workers = workers
+        self.jobs_kept = jobs_kept
+        self.state_dir = state_dir
+        self._queue = Queue(maxsize=queue_size)
+        self._jobs = OrderedDict()
+        self._lock = Lock()
+        self._threads = []
+
+    def _start(self):
+        while len(self._threads) < self.workers:
+            thread = Thread(target=self._work, name='api-haproxy-worker-{}'.format(len(self._threads)))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job.run()
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func):
+        """
+        Method queues a function to be executed by a worker.
+        :param func: function without arguments
+        :return: Job
+        :raises: Queue.Full when a queue is full
+        """
+        if self.state_dir and not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+
+        job = Job(func, self.state_dir)
+        # A state is stored before a job is queued, thus a worker never has it overwritten by a queued state
+        job.store()
+        with self._lock:
+            self._start()
+            try:
+                self._queue.put_nowait(job)
+            except Full:
+                if job.state_path:
+                    os.unlink(job.state_path)
+                raise
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.jobs_kept:
+                self._jobs.popitem(last=False)
+        self._forget_stored()
+        return job
+
+    def _forget_stored(self):
+        if not self.state_dir:
+            return
+        paths = [os.path.join(self.state_dir, name) for name in os.listdir(self.state_dir) if name.endswith('.json')]
+        if len(paths) <= self.jobs_kept:
+            return
+
+        def mtime(path):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                return 0
+
+        for path in sorted(paths, key=mtime)[:len(paths) - self.jobs_kept]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def get(self, job_id):
+        """
+        Method finds a submitted job. A job submitted to another process is read from a state directory.
+        :param job_id: identifier of a job
+        :return: Job, StoredJob or None, when a job does not exist or was already forgotten
+        """
+        job = self._jobs.get(job_id, None)
+        if job is None and self.state_dir and job_id.isalnum():
+            job = StoredJob.load(os.path.join(self.state_dir, job_id + '.json'))
+        return job
+
+
+validation_jobs = WorkerPool(
+    settings.HAPROXY_VALIDATION_WORKERS, settings.HAPROXY_VALIDATION_QUEUE_SIZE, settings.HAPROXY_VALIDATION_JOBS_KEPT,
+    settings.HAPROXY_VALIDATION_JOBS_PATH
+)
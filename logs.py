@@ -0,0 +1,262 @@
+from helpers import atomic_write
+from collections import defaultdict
+from deploy import file_lock
+import settings
+import metrics
+import mmap
+import math
+import json
+import os
+import re
+
+# Part of an HTTP log line following a client address: accept date, frontend, backend/server, timers, status and bytes
+# read. A frontend of an SSL connection ends with a '~', aborted timers are -1 and logasap prefixes values with a '+'.
+HTTP_LOG_PATTERN = re.compile(
+    r' \[[^\]]+\] (\S+?)~? ([^\s/]+)/(\S+) (-?\d+)/(-?\d+)/(-?\d+)/(-?\d+)/\+?(-?\d+) (-?\d+) \+?(\d+) '
+)
+TIMERS = ('Tq', 'Tw', 'Tc', 'Tr', 'Tt')
+# Positions of timers among groups of a match of HTTP_LOG_PATTERN
+TIMER_POSITIONS = (3, 4, 5, 6, 7)
+
+
+class LogSketch(object):
+    """
+    LogSketch estimates quantiles of non negative values. Values are counted in buckets of logarithmically growing
+    widths, thus an estimate is within a given relative accuracy, while a number of buckets grows with a logarithm of
+    a range of values rather than with a number of values. Sketches are small enough to be stored in a state file and
+    updated by every scan of a log.
+    """
+
+    def __init__(self, accuracy, zero=0, buckets=None):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.zero = zero
+        self.buckets = dict(buckets or ())
+
+    def index(self, value):
+        """
+        Method computes an index of a bucket of a positive value.
+        :param value: positive number
+        :return: integer index
+        """
+        return int(math.ceil(math.log(value, self.gamma)))
+
+    def add_index(self, index, count=1):
+        if index is None:
+            self.zero += count
+        else:
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def count(self):
+        return self.zero + sum(self.buckets.itervalues())
+
+    def quantile(self, q):
+        """
+        Method estimates a quantile of added values.
+        :param q: quantile between 0 and 1
+        :return: estimated value or None, when nothing was added
+        """
+        count = self.count()
+        if not count:
+            return None
+
+        rank = q * (count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {'accuracy': self.accuracy, 'zero': self.zero, 'buckets': sorted(self.buckets.items())}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['accuracy'], data['zero'], (tuple(item) for item in data['buckets']))
+
+
+class LogStats(object):
+    """
+    LogStats aggregates parsed lines of an HTTP log per frontend, backend and server. Every proxy keeps counters of
+    requests, bytes read and status classes, and a sketch of every timer, see LogSketch.
+    """
+
+    def __init__(self, accuracy, proxies=None, unparsed=0):
+        self.accuracy = accuracy
+        self.proxies = proxies or {}
+        self.unparsed = unparsed
+        self._indexes = {}  # Buckets of distinct timer values, see bucket
+        self._sketch = LogSketch(accuracy)
+
+    def proxy(self, kind, name):
+        key = '{0}:{1}'.format(kind, name)
+        proxy = self.proxies.get(key)
+        if proxy is None:
+            proxy = self.proxies[key] = {
+                'type': kind, 'name': name, 'requests': 0, 'bytes': 0, 'status': {},
+                'timers': dict((timer, LogSketch(self.accuracy)) for timer in TIMERS),
+            }
+        return proxy
+
+    def targets(self, frontend, backend, server):
+        """
+        Method lists proxies a request is counted to.
+        :param frontend: name of a frontend
+        :param backend: name of a backend
+        :param server: name of a server, '<NOSRV>' when a request has not reached any
+        :return: list of proxies
+        """
+        proxies = [self.proxy('frontend', frontend), self.proxy('backend', backend)]
+        if server != '<NOSRV>':
+            proxies.append(self.proxy('server', '{0}/{1}'.format(backend, server)))
+        return proxies
+
+    def bucket(self, value):
+        """
+        Method maps a value of a timer to a bucket of a sketch.
+        :param value: string of a timer in milliseconds, -1 when a timer was not reached
+        :return: index of a bucket, None for a zero value and False for a timer, which was not reached
+        """
+        number = int(value)
+        if number > 0:
+            return self._sketch.index(number)
+        return None if number == 0 else False
+
+    def consume(self, buf, start, end):
+        """
+        Method parses complete lines of a buffer, e.g. of a memory mapped log file, between given offsets. Lines are
+        matched in place, only matched fields are copied out of a buffer. A trailing incomplete line is left for a next
+        scan. Lines are counted per a combination of a frontend, a backend and a server first and added to proxies once
+        a scan is finished, as well as buckets of timer values are computed once per a distinct value.
+        :param buf: string or mmap.mmap object
+        :param start: offset of a first line
+        :param end: offset a scan stops at
+        :return: offset following a last parsed line
+        """
+        last = buf.rfind('\n', start, end)
+        search, indexes, missing = HTTP_LOG_PATTERN.search, self._indexes, object()
+        timer_counts, status_counts, bytes_read = defaultdict(int), defaultdict(int), defaultdict(int)
+        pos = start
+
+        while 0 <= pos <= last:
+            eol = buf.find('\n', pos, last + 1)
+            match = search(buf, pos, eol)
+            pos = eol + 1
+            if match is None:
+                self.unparsed += 1
+                continue
+
+            groups = match.groups()
+            target = groups[:3]
+            status_counts[target, groups[8][0]] += 1
+            bytes_read[target] += int(groups[9])
+            for position in TIMER_POSITIONS:
+                value = groups[position]
+                index = indexes.get(value, missing)
+                if index is missing:
+                    index = indexes[value] = self.bucket(value)
+                if index is not False:
+                    timer_counts[target, position, index] += 1
+
+        for target, size in bytes_read.iteritems():
+            for proxy in self.targets(*target):
+                proxy['bytes'] += size
+        for (target, digit), count in status_counts.iteritems():
+            status_class = digit + 'xx' if digit in '12345' else 'other'
+            for proxy in self.targets(*target):
+                proxy['requests'] += count
+                proxy['status'][status_class] = proxy['status'].get(status_class, 0) + count
+        for (target, position, index), count in timer_counts.iteritems():
+            for proxy in self.targets(*target):
+                proxy['timers'][TIMERS[position - TIMER_POSITIONS[0]]].add_index(index, count)
+
+        return max(pos, start)
+
+    def to_dict(self):
+        proxies = {}
+        for key, proxy in self.proxies.iteritems():
+            proxy = dict(proxy)
+            proxy['timers'] = dict((timer, sketch.to_dict()) for timer, sketch in proxy['timers'].iteritems())
+            proxies[key] = proxy
+        return {'accuracy': self.accuracy, 'proxies': proxies, 'unparsed': self.unparsed}
+
+    @classmethod
+    def from_dict(cls, data):
+        proxies = {}
+        for key, proxy in data['proxies'].iteritems():
+            proxy['timers'] = dict(
+                (timer, LogSketch.from_dict(sketch)) for timer, sketch in proxy['timers'].iteritems()
+            )
+            proxies[key] = proxy
+        return cls(data['accuracy'], proxies, data['unparsed'])
+
+
+def read_log_state(state_path):
+    """
+    Function reads a state of a log scan.
+    :param state_path: path to a state file
+    :return: dictionary of a state, empty when a file does not exist or is not readable
+    """
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def scan_log(log_path=None, state_path=None, max_bytes=None, reset=False, digest=None):
+    """
+    Function scans an HTTP log of HAProxy from an offset, where a previous scan stopped, and adds new lines to
+    statistics kept in a state file, see LogStats. A log is memory mapped, thus a scanned part is never loaded into
+    memory as a whole, and at most max_bytes are scanned at once, thus a multi-gigabyte log is caught up with over
+    several scans. A log is scanned from its beginning again, when it was rotated or truncated. Statistics belong to
+    a deployed configuration given by a digest, once a digest changes, they are cleared and counted from a current end
+    of a log, as lines logged before a scan noticed a deployment may have been served by either configuration. Scans
+    of all processes are serialized by a lock of a state file.
+    :param log_path: path to a log, the HAPROXY_LOG_PATH variable when omitted
+    :param state_path: path to a state file, the HAPROXY_LOG_STATE_PATH variable when omitted
+    :param max_bytes: number of bytes scanned at most, the HAPROXY_LOG_SCAN_BYTES variable when omitted
+    :param reset: when set, statistics are cleared and counted from a current end of a log
+    :param digest: digest of a last deployed configuration, None when nothing has been deployed
+    :return: dictionary of a state containing an offset, a size of a log, a digest and statistics
+    :raises: OSError when a log does not exist
+    """
+    log_path = log_path or settings.HAPROXY_LOG_PATH
+    state_path = state_path or settings.HAPROXY_LOG_STATE_PATH
+    max_bytes = max_bytes or settings.HAPROXY_LOG_SCAN_BYTES
+
+    with file_lock(state_path + '.lock'):
+        state = read_log_state(state_path)
+        log_stat = os.stat(log_path)
+        offset = state.get('offset', 0)
+        if state.get('inode') != log_stat.st_ino or log_stat.st_size < offset:
+            offset = 0
+
+        deployed = 'stats' in state and state.get('digest') != digest
+        if reset or deployed or 'stats' not in state or \
+                state['stats']['accuracy'] != settings.HAPROXY_LOG_SKETCH_ACCURACY:
+            stats = LogStats(settings.HAPROXY_LOG_SKETCH_ACCURACY)
+            if reset or deployed:
+                offset = log_stat.st_size
+        else:
+            stats = LogStats.from_dict(state['stats'])
+
+        end = min(log_stat.st_size, offset + max_bytes)
+        if end > offset:
+            with metrics.timed('logs_scan'):
+                with open(log_path, 'rb') as f:
+                    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        offset = stats.consume(buf, offset, end)
+                    finally:
+                        buf.close()
+
+        state = {'inode': log_stat.st_ino, 'offset': offset, 'size': log_stat.st_size, 'digest': digest,
+                 'stats': stats.to_dict()}
+        atomic_write(state_path, [json.dumps(state, separators=(',', ':'))])
+
+    state['stats'] = stats
+    return state
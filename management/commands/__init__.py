@@ -0,0 +1,13 @@
+from django.core.management.base import CommandError
+import json
+
+
+def command_error(e):
+    """
+    Function turns an exception of an api_core or a rest_framework package, raised by a service, into an error of
+    a management command, which is printed and makes a command exit with a non zero status.
+    :param e: rest_framework.exceptions.APIException
+    :return: django.core.management.base.CommandError
+    """
+    detail = e.detail if isinstance(e.detail, basestring) else json.dumps(e.detail, indent=2, sort_keys=True)
+    return CommandError('{0} (status {1})'.format(detail, e.status_code))
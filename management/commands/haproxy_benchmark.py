@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.test.runner import DiscoverRunner
+from optparse import make_option
+import json
+
+
+class Command(BaseCommand):
+    """
+    Command benchmarks a build, generation, validation and deployment of a configuration against synthetic datasets in
+    a test database, with a stub 'haproxy' binary and temporary paths. Results are written as a JSON document, thus
+    they may be compared between commits.
+    """
+    help = 'Benchmarks build, generate, validate and deploy stages against synthetic datasets.'
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', default='10,1000,10000,100000', help='Comma separated numbers of backends.'),
+        make_option('--versions', type='int', default=5, help='Number of versions of every backend.'),
+        make_option('--repeat', type='int', default=5, help='Number of measured calls of every stage.'),
+        make_option('--output', default=None, help='Path to a JSON file with results, stdout by default.'),
+    )
+
+    def handle(self, *args, **options):
+        from api_haproxy.benchmarks import run_benchmark
+
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            results = run_benchmark(sizes, options['versions'], options['repeat'])
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        else:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
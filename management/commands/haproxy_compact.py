@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+import json
+
+
+class Command(BaseCommand):
+    """
+    Command prunes old versions of configuration sections according to a retention policy given by options or by the
+    HAPROXY_RETENTION_VERSIONS and HAPROXY_RETENTION_DAYS variables, see HaProxyConfigManager.compact. It is intended
+    to be run periodically, e.g. by cron.
+    """
+    help = 'Prunes old versions of configuration sections, keeping active and deployed ones.'
+    option_list = BaseCommand.option_list + (
+        make_option('--keep-versions', type='int', default=None, help='Number of newest versions kept per section.'),
+        make_option('--keep-days', type='int', default=None, help='Versions newer than a number of days are kept.'),
+        make_option('--dry-run', action='store_true', default=False, help='Only reports versions to be pruned.'),
+    )
+
+    def handle(self, *args, **options):
+        from api_haproxy import settings
+        from api_haproxy.models import HaProxyConfigModel
+
+        keep_versions, keep_days = options['keep_versions'], options['keep_days']
+        if keep_versions is None and keep_days is None:
+            keep_versions, keep_days = settings.HAPROXY_RETENTION_VERSIONS, settings.HAPROXY_RETENTION_DAYS
+
+        report = HaProxyConfigModel.objects.compact(keep_versions, keep_days, options['dry_run'])
+        report['dry run'] = options['dry_run']
+        report.pop('checksums')
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+import json
+
+
+class Command(BaseCommand):
+    """
+    Command deploys a generated configuration to all deploy targets in a same way as a deploy endpoint, see
+    services.deploy_generated_configuration. A deployment is serialized with deployments requested through an API,
+    a command arriving during a running deployment shares an outcome of a next one.
+    """
+    help = 'Deploys a generated HAProxy configuration and reloads HAProxy.'
+    option_list = BaseCommand.option_list + (
+        make_option('--fail-fast', action='store_true', default=None, help='Stops at a first failed deploy target.'),
+    )
+
+    def handle(self, *args, **options):
+        from rest_framework.exceptions import APIException
+        from api_haproxy.management.commands import command_error
+        from api_haproxy.services import deploy_generated_configuration
+
+        try:
+            result = deploy_generated_configuration(options['fail_fast'])
+        except APIException as e:
+            raise command_error(e)
+        self.stdout.write(json.dumps(result, indent=2, sort_keys=True))
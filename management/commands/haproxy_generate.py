@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+import json
+
+
+class Command(BaseCommand):
+    """
+    Command generates a configuration of active sections in a same way as a POST request to a generate endpoint, see
+    services.generate_configuration, without a need to start a web server. Modules of an application are imported
+    when a command is run, thus other commands are not slowed down.
+    """
+    help = 'Generates a HAProxy configuration of active sections.'
+
+    def handle(self, *args, **options):
+        from rest_framework.exceptions import APIException
+        from api_haproxy.management.commands import command_error
+        from api_haproxy.services import generate_configuration
+
+        try:
+            result = generate_configuration()
+        except APIException as e:
+            raise command_error(e)
+        self.stdout.write(json.dumps(result, indent=2, sort_keys=True))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+import json
+import sys
+
+
+class Command(BaseCommand):
+    """
+    Command stores sections read from JSON files, or from a standard input when no file or a '-' is given, in a same
+    way as a bulk endpoint, see services.load_sections. A file contains a list of sections or an object with a sections
+    key, each section in a same form as posted to a section endpoint. Stored sections become active, thus a command
+    followed by haproxy_generate, haproxy_validate and haproxy_deploy commands configures a HAProxy without a web
+    server.
+    """
+    args = '[file ...]'
+    help = 'Loads configuration sections from JSON files or a standard input.'
+    option_list = BaseCommand.option_list + (
+        make_option('--results', action='store_true', default=False, help='Lists a result of every section.'),
+    )
+
+    def handle(self, *args, **options):
+        from api_haproxy.services import load_sections
+
+        results = []
+        for path in args or ['-']:
+            try:
+                if path == '-':
+                    sections = json.load(sys.stdin)
+                else:
+                    with open(path) as f:
+                        sections = json.load(f)
+            except (IOError, ValueError) as e:
+                raise CommandError('{0}: {1}'.format(path, e))
+
+            if isinstance(sections, dict):
+                sections = sections.get('sections', None)
+            if not isinstance(sections, list):
+                raise CommandError('{}: a list of sections is expected.'.format(path))
+            results.extend(load_sections(sections))
+
+        report = dict(
+            (key, sum(1 for result in results if result.get(key))) for key in ('created', 'duplicate', 'invalid')
+        )
+        if options['results']:
+            report['results'] = results
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+        if report['invalid']:
+            raise CommandError('{} sections are invalid.'.format(report['invalid']))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+import json
+
+
+class Command(BaseCommand):
+    """
+    Command validates a generated configuration in a same way as a validate endpoint, see
+    helpers.validate_configuration, and exits with a non zero status, when a configuration is invalid.
+    """
+    help = 'Validates a generated HAProxy configuration.'
+
+    def handle(self, *args, **options):
+        from rest_framework.exceptions import APIException
+        from api_haproxy.management.commands import command_error
+        from api_haproxy.services import validate_configuration
+
+        try:
+            result = validate_configuration()
+        except APIException as e:
+            raise command_error(e)
+        self.stdout.write(json.dumps(result, indent=2, sort_keys=True))
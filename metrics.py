@@ -0,0 +1,175 @@
+from threading import Lock
+from bisect import bisect_left
+import settings
+import time
+
+
+def format_labels(labels, **extra):
+    """
+    Function formats labels of a sample in a Prometheus text format.
+    :param labels: tuple of label name and value pairs
+    :param extra: additional labels appended after given ones
+    :return: string, empty when there are no labels
+    """
+    labels = list(labels) + sorted(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('"', '\\"')) for name, value in labels) + '}'
+
+
+class Counter(object):
+    """
+    Counter is a monotonically increasing value kept in a memory of a running process, one per combination of labels.
+    Values are per process and are not aggregated across worker processes of a server, see render_metrics.
+    """
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, amount=1, **labels):
+        if not settings.HAPROXY_METRICS_ENABLED:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items()) or [((), 0)]
+
+        for labels, value in values:
+            yield '{0}{1} {2}'.format(self.name, format_labels(labels), value)
+
+
+class Histogram(object):
+    """
+    Histogram counts observed values in cumulative buckets of given upper bounds and keeps their sum and count, one per
+    combination of labels.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, value, **labels):
+        if not settings.HAPROXY_METRICS_ENABLED:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, list(counts), total) for labels, (counts, total) in self._values.items())
+
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], counts):
+                cumulative += count
+                yield '{0}_bucket{1} {2}'.format(self.name, format_labels(labels, le=bound), cumulative)
+            yield '{0}_sum{1} {2}'.format(self.name, format_labels(labels), total)
+            yield '{0}_count{1} {2}'.format(self.name, format_labels(labels), cumulative)
+
+
+class StageTimer(object):
+    """
+    Context manager observing a duration of a stage in the stage_duration histogram.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stage_duration.observe(time.time() - self.start, stage=self.stage)
+
+
+class NoopTimer(object):
+    """
+    Context manager doing nothing, used in place of a StageTimer when metrics are disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NOOP_TIMER = NoopTimer()
+
+
+def timed(stage):
+    """
+    Function creates a context manager measuring a duration of a stage. A shared no-op context manager is returned when
+    metrics are disabled by the HAPROXY_METRICS_ENABLED variable, thus a disabled instrumentation costs a single check.
+    :param stage: name of a stage, e.g. 'generate_render'
+    :return: context manager
+    """
+    if settings.HAPROXY_METRICS_ENABLED:
+        return StageTimer(stage)
+    return NOOP_TIMER
+
+
+# Stages observed by stage_duration, once per a generation, validation or deployment unless noted otherwise:
+# generate_query - selection of an active set, generate_fetch, generate_decode and generate_render - reading, decoding
+# and formatting of sections missing in a render cache, once per a chunk of HAPROXY_QUERY_CHUNK_SIZE sections,
+# generate_write - writing of a configuration, validate_command and validate_parse - a run of a validation command and
+# parsing of its output, deploy_digest, deploy_copy and deploy_reload - a comparison, a copy and a reload, once per
+# a deploy target, logs_scan - a scan of an HTTP log
+stage_duration = Histogram(
+    'haproxy_api_stage_duration_seconds', 'Duration of stages of a generation, validation and deployment.',
+    settings.HAPROXY_METRICS_BUCKETS
+)
+reloads = Counter('haproxy_api_reloads_total', 'Number of reloads of HAProxy.')
+reloads_skipped = Counter('haproxy_api_reloads_skipped_total', 'Number of deployments skipped as unchanged.')
+deployments_coalesced = Counter(
+    'haproxy_api_deployments_coalesced_total', 'Number of deployment requests served by a deployment of another one.'
+)
+validation_failures = Counter('haproxy_api_validation_failures_total', 'Number of failed validations.')
+validation_cache_hits = Counter('haproxy_api_validation_cache_hits_total', 'Number of validations served from a cache.')
+snapshot_failures = Counter(
+    'haproxy_api_snapshot_failures_total', 'Number of deployed configurations, whose snapshots were not stored.'
+)
+
+METRICS = (
+    stage_duration, reloads, reloads_skipped, deployments_coalesced, validation_failures, validation_cache_hits,
+    snapshot_failures,
+)
+
+
+def render_metrics():
+    """
+    Function renders all metrics in a Prometheus text exposition format. Metrics are kept in a memory of a process,
+    thus a scrape reports values of a single worker process, which has served it. Values of a multi-process server
+    are therefore not totals and may go back and forth between scrapes, unless a server runs a single process.
+    :return: string
+    """
+    lines = []
+    for metric in METRICS:
+        lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+        lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
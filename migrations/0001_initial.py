@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import api_haproxy.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HaProxyConfigModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('checksum', models.CharField(unique=True, max_length=32)),
+                ('section', models.CharField(max_length=100)),
+                ('section_name', models.CharField(max_length=100, null=True)),
+                ('meta', api_haproxy.fields.Base64JsonField()),
+                ('configuration', api_haproxy.fields.Base64JsonField()),
+                ('create_time', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def populate_active_config(apps, schema_editor):
+    """
+    Points every section type to its newest version, which is a version the former grouping was expected to select.
+    """
+    HaProxyConfigModel = apps.get_model('api_haproxy', 'HaProxyConfigModel')
+    HaProxyActiveConfigModel = apps.get_model('api_haproxy', 'HaProxyActiveConfigModel')
+    keys = HaProxyConfigModel.objects.values_list('section', 'section_name').distinct()
+    active = []
+
+    for section, section_name in keys:
+        newest = HaProxyConfigModel.objects.filter(section=section, section_name=section_name)\
+            .order_by('-create_time', '-pk').values_list('pk', flat=True)[0]
+        active.append(HaProxyActiveConfigModel(section=section, section_name=section_name, config_id=newest))
+
+    HaProxyActiveConfigModel.objects.bulk_create(active)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_haproxy', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='haproxyconfigmodel',
+            index_together=set([('section', 'section_name', 'create_time')]),
+        ),
+        migrations.CreateModel(
+            name='HaProxyActiveConfigModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('section', models.CharField(max_length=100)),
+                ('section_name', models.CharField(max_length=100, null=True)),
+                ('config', models.OneToOneField(related_name='active', to='api_haproxy.HaProxyConfigModel')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='haproxyactiveconfigmodel',
+            unique_together=set([('section', 'section_name')]),
+        ),
+        migrations.RunPython(populate_active_config),
+    ]
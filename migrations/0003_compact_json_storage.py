@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, transaction
+from api_haproxy.fields import encode_json_value, decode_json_value
+
+CHUNK_SIZE = 500
+# Format data are converted to, independent of the HAPROXY_JSON_FIELD_FORMAT variable of a migrated installation, as
+# the field reads every format and writes the configured one from now on
+TARGET_FORMAT = 'json'
+
+
+def convert_storage_format(storage_format):
+    """
+    Returns a function converting stored JSON data into a given format. Rows are read as raw strings in chunks of
+    consecutive primary keys and each chunk is converted in its own transaction, thus the table is never locked for
+    a whole conversion and its keys are never held in memory at once.
+    """
+    def convert(apps, schema_editor):
+        HaProxyConfigModel = apps.get_model('api_haproxy', 'HaProxyConfigModel')
+        last_pk = 0
+
+        while True:
+            rows = list(HaProxyConfigModel.objects.filter(pk__gt=last_pk).order_by('pk')
+                        .values_list('pk', 'meta', 'configuration')[:CHUNK_SIZE])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            with transaction.atomic():
+                for pk, meta, configuration in rows:
+                    converted = dict(
+                        meta=encode_json_value(decode_json_value(meta), storage_format),
+                        configuration=encode_json_value(decode_json_value(configuration), storage_format)
+                    )
+                    if converted != dict(meta=meta, configuration=configuration):
+                        HaProxyConfigModel.objects.filter(pk=pk).update(**converted)
+
+    return convert
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_haproxy', '0002_active_config'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_storage_format(TARGET_FORMAT), convert_storage_format('base64')),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_haproxy', '0003_compact_json_storage'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='haproxyconfigmodel',
+            index_together=set([('section', 'section_name', 'create_time'), ('create_time', 'checksum')]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import api_haproxy.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_haproxy', '0004_create_time_checksum_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HaProxyDeploymentModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('digest', models.CharField(max_length=32, db_index=True)),
+                ('sections', api_haproxy.fields.Base64JsonField()),
+                ('create_time', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+import api_haproxy.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_haproxy', '0005_deployment'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='haproxyconfigmodel',
+            name='configuration',
+            field=api_haproxy.fields.Base64JsonField(null=True),
+        ),
+        migrations.AddField(
+            model_name='haproxyconfigmodel',
+            name='parent',
+            field=models.ForeignKey(related_name='children', on_delete=django.db.models.deletion.PROTECT,
+                                    to='api_haproxy.HaProxyConfigModel', null=True),
+        ),
+        migrations.AddField(
+            model_name='haproxyconfigmodel',
+            name='patch',
+            field=api_haproxy.fields.Base64JsonField(null=True),
+        ),
+        migrations.AddField(
+            model_name='haproxyconfigmodel',
+            name='depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
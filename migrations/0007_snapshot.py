@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import api_haproxy.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_haproxy', '0006_section_patch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HaProxySnapshotModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('digest', models.CharField(unique=True, max_length=32)),
+                ('content', api_haproxy.fields.Base64JsonField()),
+                ('checksums', api_haproxy.fields.Base64JsonField()),
+                ('size', models.PositiveIntegerField()),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('deploy_time', models.DateTimeField(db_index=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def empty_section_names(apps, schema_editor):
+    """
+    Stores an empty name of an active section type without a name. Concurrent activations may have left more active
+    versions of such a type, as NULL names never conflict, only a newest one of them is kept.
+    """
+    HaProxyActiveConfigModel = apps.get_model('api_haproxy', 'HaProxyActiveConfigModel')
+    unnamed = HaProxyActiveConfigModel.objects.filter(section_name__isnull=True)
+
+    for section in set(unnamed.values_list('section', flat=True)):
+        rows = unnamed.filter(section=section).order_by('-config__create_time', '-config__pk')
+        stale = list(rows.values_list('pk', flat=True)[1:])
+        HaProxyActiveConfigModel.objects.filter(pk__in=stale).delete()
+
+    unnamed.update(section_name='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_haproxy', '0007_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(empty_section_names),
+        migrations.AlterField(
+            model_name='haproxyactiveconfigmodel',
+            name='section_name',
+            field=models.CharField(default='', max_length=100),
+        ),
+    ]
@@ -1,7 +1,292 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q
 from hashlib import md5
-from fields import Base64JsonField
+from fields import Base64JsonField, LazyJsonDescriptor
+from directives import directive_items, clean_operations, patch_directives
 from django.utils import timezone
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+import settings
+import json
+
+
+class HaProxyConfigQuerySet(models.QuerySet):
+    """
+    QuerySet providing selections of configuration sections, which may be chained with further filters.
+    """
+
+    def active(self):
+        """
+        Method selects active sections with an indexed join of an active set, thus a cost of a selection grows with
+        a number of section types rather than with a number of stored versions.
+        :return: queryset of active sections
+        """
+        return self.filter(active__isnull=False)
+
+    def after(self, create_time, checksum):
+        """
+        Method selects sections following a given one in an order of a create time and a checksum. The selection is
+        used by a cursor pagination, which reads an index instead of skipping an offset of rows.
+        :param create_time: create time of a last seen section
+        :param checksum: checksum of a last seen section
+        :return: queryset of following sections
+        """
+        return self.filter(Q(create_time__gt=create_time) | Q(create_time=create_time, checksum__gt=checksum))
+
+
+class HaProxyConfigManager(models.Manager.from_queryset(HaProxyConfigQuerySet)):
+    """
+    Manager maintaining configuration sections used in a final configuration. Only one version of every section type is
+    active at a time, pointed to by a HaProxyActiveConfigModel entry.
+    """
+
+    def newest(self, section, section_name):
+        """
+        Method finds a most currently created version of a section type.
+        :param section: section type, e.g. backend
+        :param section_name: name of a section or None
+        :return: HaProxyConfigModel or None
+        """
+        versions = self.get_queryset().filter(section=section, section_name=section_name)
+        return versions.order_by('-create_time', '-pk').first()
+
+    def refresh_active(self, section, section_name):
+        """
+        Method points an active set to a newest version of a section type, when its active version was removed.
+        :param section: section type, e.g. backend
+        :param section_name: name of a section or None
+        """
+        active = HaProxyActiveConfigModel.objects.filter(section=section, section_name=section_name or '')
+        if not active.exists():
+            newest = self.newest(section, section_name)
+            if newest is not None:
+                newest.activate()
+
+    def bulk_upsert(self, configs):
+        """
+        Method stores many unsaved sections within a single transaction. Sections already stored, as well as repeated
+        ones, are reported as duplicates instead of aborting a whole batch. Created sections become active versions of
+        their section types, a later one wins when a batch contains more versions of a same section type.
+        :param configs: list of unsaved HaProxyConfigModel objects
+        :return: list of results in an order of passed in sections
+        """
+        chunk_size = settings.HAPROXY_QUERY_CHUNK_SIZE
+        checksums = [config.compute_checksum() for config in configs]
+        existing = self.stored_checksums(checksums)
+
+        results, created, seen = [], [], set()
+        for config, checksum in zip(configs, checksums):
+            result = {'checksum': checksum, 'section': config.section, 'section_name': config.section_name}
+            if checksum in existing or checksum in seen:
+                result['duplicate'] = True
+            else:
+                result['created'] = True
+                seen.add(checksum)
+                config.checksum = checksum
+                config.meta = config.generate_meta()
+                created.append(config)
+            results.append(result)
+
+        with transaction.atomic():
+            stored = []
+            for i in range(0, len(created), chunk_size):
+                stored.extend(self.insert_chunk(created[i:i + chunk_size]))
+            active = dict(((config.section, config.section_name), config.checksum) for config in stored)
+            HaProxyActiveConfigModel.objects.bulk_replace(active)
+
+        # Sections stored by a concurrent request after they were looked up are duplicates as well
+        stored = set(config.checksum for config in stored)
+        for result in results:
+            if result.get('created') and result['checksum'] not in stored:
+                del result['created']
+                result['duplicate'] = True
+        return results
+
+    def stored_checksums(self, checksums):
+        """
+        Method selects checksums, which are already stored, in chunks of the HAPROXY_QUERY_CHUNK_SIZE size.
+        :param checksums: list of checksums
+        :return: set of stored checksums
+        """
+        chunk_size = settings.HAPROXY_QUERY_CHUNK_SIZE
+        existing = set()
+        for i in range(0, len(checksums), chunk_size):
+            chunk = checksums[i:i + chunk_size]
+            existing.update(self.get_queryset().filter(checksum__in=chunk).values_list('checksum', flat=True))
+        return existing
+
+    def insert_chunk(self, configs):
+        """
+        Method inserts a chunk of sections with a single query in a savepoint. When a concurrent request has stored
+        any of them meanwhile, a chunk is inserted row by row instead and rows violating a unique checksum are skipped.
+        :param configs: list of unsaved HaProxyConfigModel objects with computed checksums
+        :return: list of inserted sections
+        """
+        try:
+            with transaction.atomic():
+                self.get_queryset().bulk_create(configs)
+            return configs
+        except IntegrityError:
+            pass
+
+        inserted = []
+        for config in configs:
+            try:
+                with transaction.atomic():
+                    config.save(force_insert=True)
+                inserted.append(config)
+            except IntegrityError:
+                pass
+        return inserted
+
+    def resolve_patches(self, configs):
+        """
+        Method loads versions patched by given sections, a level of their chains at a time for all sections at once,
+        in chunks of the HAPROXY_QUERY_CHUNK_SIZE size. A version shared by more chains is loaded once and resolves its
+        configuration once, thus a number of queries grows with a length of chains rather than with a number of
+        sections, and every section applies its own patch only, see PatchedConfigurationDescriptor.
+        :param configs: iterable of HaProxyConfigModel objects, e.g. a queryset
+        :return: list of given sections
+        """
+        configs = list(configs)
+        chunk_size = settings.HAPROXY_QUERY_CHUNK_SIZE
+        loaded = dict((config.pk, config) for config in configs)
+        level = [config for config in configs if config.parent_id is not None]
+        seen = set(config.pk for config in level)
+
+        while level:
+            missing = list(set(config.parent_id for config in level) - set(loaded))
+            for i in range(0, len(missing), chunk_size):
+                parents = self.get_queryset().filter(pk__in=missing[i:i + chunk_size])
+                loaded.update((parent.pk, parent) for parent in parents)
+
+            next_level = []
+            for config in level:
+                config.parent = loaded[config.parent_id]
+                if config.parent.parent_id is not None and config.parent_id not in seen:
+                    seen.add(config.parent_id)
+                    next_level.append(config.parent)
+            level = next_level
+        return configs
+
+    def patch(self, config, operations):
+        """
+        Method stores a new version of a section, which applies operations to directives of a given version. A new
+        version keeps operations and a link to its parent only, thus its size and a cost of its checksum are given by
+        a size of a change rather than by a size of a section. Once a chain of patches reaches the
+        HAPROXY_PATCH_CHAIN_MAX length, a whole configuration is stored instead, which bounds a number of versions read
+        to resolve a configuration. A version equal to a stored one is not stored again.
+        :param config: HaProxyConfigModel a patch is based on
+        :param operations: list of operations, see directives.clean_operations
+        :return: tuple of a HaProxyConfigModel and a flag, whether it was created
+        :raises: ValueError when operations are invalid or a directive to be removed or replaced does not exist
+        """
+        operations = clean_operations(operations)
+        configuration = patch_directives(config.configuration, operations)
+
+        if config.depth < settings.HAPROXY_PATCH_CHAIN_MAX:
+            version = self.model(section=config.section, section_name=config.section_name, parent=config,
+                                 patch=operations, depth=config.depth + 1)
+        else:
+            version = self.model(section=config.section, section_name=config.section_name,
+                                 configuration=json.dumps(configuration))
+
+        existing = self.get_queryset().filter(checksum=version.compute_checksum()).first()
+        if existing is not None:
+            return existing, False
+        version.save()
+        return version, True
+
+    def detach(self, config):
+        """
+        Method stores versions patching a given version as whole configurations, thus a given version may be deleted
+        without breaking them. Checksums of detached versions are kept.
+        :param config: HaProxyConfigModel
+        """
+        for child in config.children.all():
+            self.get_queryset().filter(pk=child.pk).update(
+                configuration=json.dumps(child.configuration), parent=None, patch=None, depth=0
+            )
+
+    def compact(self, keep_versions=None, keep_days=None, dry_run=False):
+        """
+        Method prunes old versions of sections. A version is kept, when it is one of keep_versions newest versions of
+        its section type, or when it is newer than keep_days days. Active versions and versions contained in a last
+        deployed configuration are never pruned. Versions are deleted in chunks, each in a short transaction of its
+        own, thus a table is never locked for a long time. An active set is checked again when a chunk is deleted, as
+        an old version may be touched and activated meanwhile.
+        :param keep_versions: number of newest versions kept for every section type, no version is kept when omitted
+        :param keep_days: age of versions in days, newer versions are kept, no version is kept when omitted
+        :param dry_run: when set, versions to be pruned are only counted
+        :return: dictionary containing numbers of section types and deleted versions, a size of deleted data in bytes
+        and checksums of deleted versions
+        """
+        if keep_versions is None and keep_days is None:
+            return {'section types': 0, 'deleted': 0, 'reclaimed bytes': 0, 'checksums': []}
+
+        chunk_size = settings.HAPROXY_QUERY_CHUNK_SIZE
+        cutoff = timezone.now() - timedelta(days=keep_days) if keep_days is not None else None
+        deployment = HaProxyDeploymentModel.objects.last()
+        protected = set(deployment.get_sections().values()) if deployment else set()
+        protected.update(self.active().values_list('checksum', flat=True))
+
+        types = list(self.get_queryset().values_list('section', 'section_name').distinct())
+        pruned = []
+        for section, section_name in types:
+            versions = self.get_queryset().filter(section=section, section_name=section_name)\
+                .order_by('-create_time', '-pk').values_list('pk', 'checksum', 'create_time', 'parent', 'depth')
+            versions = list(versions)
+            parents = dict((pk, parent) for pk, _, _, parent, _ in versions)
+            kept = set()
+            for index, (pk, checksum, create_time, _, _) in enumerate(versions):
+                recent = cutoff is not None and create_time >= cutoff
+                if index < (keep_versions or 0) or checksum in protected or recent:
+                    # Versions patched by a kept version are needed to resolve its configuration
+                    while pk is not None and pk not in kept:
+                        kept.add(pk)
+                        pk = parents.get(pk)
+            pruned.extend((depth, pk) for pk, _, _, _, depth in versions if pk not in kept)
+
+        # Patching versions are deleted before versions they patch, level by level of a chain
+        pruned.sort(reverse=True)
+        deleted, reclaimed = [], 0
+        for i in range(0, len(pruned), chunk_size):
+            rows = []
+            with transaction.atomic():
+                for _, level in groupby(pruned[i:i + chunk_size], key=itemgetter(0)):
+                    versions = self.get_queryset().filter(pk__in=[pk for _, pk in level], active__isnull=True)
+                    if not dry_run:
+                        # A version patched by a version activated meanwhile is kept along
+                        versions = versions.filter(children__isnull=True)
+                    level_rows = list(versions.values_list(
+                        'pk', 'checksum', 'section', 'section_name', 'meta', 'configuration', 'patch'
+                    ))
+                    if not dry_run:
+                        self.get_queryset().filter(pk__in=[row[0] for row in level_rows], active__isnull=True).delete()
+                    rows.extend(level_rows)
+            for row in rows:
+                reclaimed += sum(len(value or '') for value in row[1:])
+            deleted.extend(row[1] for row in rows)
+
+        return {'section types': len(types), 'deleted': len(deleted), 'reclaimed bytes': reclaimed,
+                'checksums': deleted}
+
+
+class PatchedConfigurationDescriptor(LazyJsonDescriptor):
+    """
+    Descriptor resolving a configuration of a version stored as a patch, by applying a patch to a configuration of its
+    parent on a first access. Parents of many versions are loaded at once by HaProxyConfigManager.resolve_patches,
+    otherwise every version of a chain is queried on its own.
+    """
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+
+        if obj.__dict__.get(self.field.name) is None and obj.parent_id is not None:
+            obj.__dict__[self.field.name] = patch_directives(obj.parent.configuration, obj.patch)
+        return super(PatchedConfigurationDescriptor, self).__get__(obj, type)
 
 
 class HaProxyConfigModel(models.Model):
@@ -11,26 +296,60 @@ class HaProxyConfigModel(models.Model):
     columns with metadata like a checksum (used as id as well as unique identifier), create time and a meta column,
     which could be customized to store information like, who posted a specific configuration block or so.
     Second, there are columns containing configuration, these columns are section, section name and configuration.
+    A configuration is an ordered list of [key, value] directives or a former dictionary. A version created by a patch
+    stores a patch and a link to its parent in place of a configuration, see HaProxyConfigManager.patch.
     """
     db_table = 'haproxy_config'
     checksum = models.CharField(max_length=32, unique=True)
     section = models.CharField(max_length=100)
     section_name = models.CharField(max_length=100, null=True)
     meta = Base64JsonField()
-    configuration = Base64JsonField()
+    configuration = Base64JsonField(null=True, descriptor_class=PatchedConfigurationDescriptor)
     create_time = models.DateTimeField(auto_now=True)
+    parent = models.ForeignKey('self', null=True, related_name='children', on_delete=models.PROTECT)
+    patch = Base64JsonField(null=True)
+    depth = models.PositiveIntegerField(default=0)
+
+    objects = HaProxyConfigManager()
+
+    class Meta:
+        index_together = [['section', 'section_name', 'create_time'], ['create_time', 'checksum']]
 
     def save(self, *args, **kwargs):
         """
         Method enhances a default models.Model.save method to store a configuration checksum for later processing
         like writes or check of an integrity during saves to a database.
         """
-        checksum = md5()
-        checksum.update(self.section + (self.section_name or '') + self.configuration)
-        self.checksum = checksum.hexdigest()
+        self.checksum = self.compute_checksum()
         self.meta = self.generate_meta()
         super(HaProxyConfigModel, self).save(*args, **kwargs)
 
+    def compute_checksum(self):
+        """
+        Method computes a checksum of a section from its section type and a serialized configuration. A checksum of
+        a version stored as a patch is computed from a checksum of its parent and from a patch.
+        :return: md5 hex digest
+        """
+        checksum = md5()
+        if self.parent_id is not None:
+            checksum.update(self.parent.checksum + json.dumps(self.patch, sort_keys=True))
+            return checksum.hexdigest()
+
+        configuration = self.configuration
+        if not isinstance(configuration, basestring):
+            configuration = json.dumps(configuration)
+        checksum.update(self.section + (self.section_name or '') + configuration)
+        return checksum.hexdigest()
+
+    def activate(self):
+        """
+        Method marks a section as an active version of its section type, replacing a previously active one. It is
+        expected to be called within a transaction together with a change, which caused an activation.
+        """
+        HaProxyActiveConfigModel.objects.update_or_create(
+            section=self.section, section_name=self.section_name or '', defaults={'config': self}
+        )
+
     def generate_meta(self):
         """
         Method generates metadata for every submitted entry to a database. This is place, where additional information
@@ -54,4 +373,186 @@ class HaProxyConfigModel(models.Model):
             weight = weights.get(str(self.section), 0)
             if self.section_name:
                 return weight + 1
-            return weight
\ No newline at end of file
+            return weight
+
+    def get_section_order(self):
+        """
+        Method returns a key sorting sections of a configuration file. Sections of a same weight, e.g. named backends,
+        are sorted by names and checksums, thus a same active set is always generated into a same file.
+        :return: tuple of a weight, a section name and a checksum
+        """
+        return self.get_section_weight(), self.section_name or '', self.checksum
+
+    def render(self):
+        """
+        Method formats a section into a configuration block in a representation valid for a HAProxy configuration.
+        Rendered block depends on a section data only, thus it can be cached by a checksum of a section.
+        :return: configuration block ending with an empty line
+        """
+        block = ["{0} {1}\n".format(str(self.section), (self.section_name or ""))]
+        for key, value in directive_items(self.configuration):
+            block.append("    {0} {1}\n".format(str(key), (value or "")))
+        block.append("\n")
+        return "".join(block)
+
+
+class HaProxyActiveConfigManager(models.Manager):
+    """
+    Manager updating an active set in bulk.
+    """
+
+    def bulk_replace(self, active):
+        """
+        Method points many section types to new active versions with a constant number of queries per chunk.
+        :param active: dictionary mapping (section, section_name) tuples to checksums of newly active sections
+        """
+        chunk_size = settings.HAPROXY_QUERY_CHUNK_SIZE
+        keys = sorted((section, section_name or '') for section, section_name in active)
+
+        for section, group in groupby(keys, key=itemgetter(0)):
+            names = [section_name for _, section_name in group]
+            for i in range(0, len(names), chunk_size):
+                self.get_queryset().filter(section=section, section_name__in=names[i:i + chunk_size]).delete()
+
+        checksums = list(active.values())
+        for i in range(0, len(checksums), chunk_size):
+            configs = HaProxyConfigModel.objects.filter(checksum__in=checksums[i:i + chunk_size])\
+                .values_list('pk', 'section', 'section_name')
+            self.get_queryset().bulk_create([
+                self.model(section=section, section_name=section_name or '', config_id=pk)
+                for pk, section, section_name in configs
+            ])
+
+
+class HaProxyActiveConfigModel(models.Model):
+    """
+    Model maintains an active set of a configuration, pointing every section type, given by a combination of a section
+    and section name, to its version used in a generated configuration. The active set is updated in a same transaction
+    as changes to HaProxyConfigModel entries, which replaces a grouping over a whole history of sections. A section type
+    without a name is stored with an empty name, as NULL values would never violate a unique section type.
+    """
+    section = models.CharField(max_length=100)
+    section_name = models.CharField(max_length=100, default='')
+    config = models.OneToOneField(HaProxyConfigModel, related_name='active')
+
+    objects = HaProxyActiveConfigManager()
+
+    class Meta:
+        unique_together = [['section', 'section_name']]
+
+
+class HaProxyDeploymentManager(models.Manager):
+    """
+    Manager recording deployments of a configuration.
+    """
+
+    def last(self):
+        """
+        Method returns a most recent deployment.
+        :return: HaProxyDeploymentModel or None, when nothing has been deployed yet
+        """
+        return self.get_queryset().order_by('-create_time', '-pk').first()
+
+    def record(self, digest, checksums):
+        """
+        Method records a deployment of a configuration, unless a same configuration was deployed last. Section types of
+        deployed sections are stored along with their checksums, thus a deployed set can be compared with an active one
+        without reading sections themselves.
+        :param digest: digest of a deployed configuration file
+        :param checksums: checksums of sections contained in a deployed configuration, in an order of a file
+        :return: HaProxyDeploymentModel
+        """
+        last = self.last()
+        if last is not None and last.digest == digest:
+            return last
+
+        chunk_size = settings.HAPROXY_QUERY_CHUNK_SIZE
+        types = {}
+        for i in range(0, len(checksums), chunk_size):
+            configs = HaProxyConfigModel.objects.filter(checksum__in=checksums[i:i + chunk_size])\
+                .values_list('checksum', 'section', 'section_name')
+            types.update((checksum, (section, section_name)) for checksum, section, section_name in configs)
+
+        sections = [[types[checksum][0], types[checksum][1], checksum] for checksum in checksums if checksum in types]
+        return self.create(digest=digest, sections=sections)
+
+
+class HaProxyDeploymentModel(models.Model):
+    """
+    Model keeps a history of deployed configurations. Every deployment lists sections contained in a deployed file as
+    [section, section_name, checksum] triples, which is a set a candidate configuration is compared with before it is
+    deployed.
+    """
+    digest = models.CharField(max_length=32, db_index=True)
+    sections = Base64JsonField()
+    create_time = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = HaProxyDeploymentManager()
+
+    def get_sections(self):
+        """
+        Method maps section types of a deployment to checksums of their deployed versions.
+        :return: dictionary mapping (section, section_name) tuples to checksums
+        """
+        return dict(((section, section_name), checksum) for section, section_name, checksum in self.sections)
+
+
+class HaProxySnapshotManager(models.Manager):
+    """
+    Manager storing snapshots of deployed configurations.
+    """
+
+    def touch(self, digest):
+        """
+        Method marks a snapshot of a given digest as deployed now, thus a configuration deployed again is not stored
+        twice and is kept by a retention as a recent one.
+        :param digest: digest of a deployed configuration
+        :return: boolean, whether a snapshot exists
+        """
+        return bool(self.filter(digest=digest).update(deploy_time=timezone.now()))
+
+    def store(self, digest, files, checksums):
+        """
+        Method stores a snapshot of a deployed configuration and prunes old snapshots, see prune.
+        :param digest: digest of a deployed configuration
+        :param files: list of pairs of a file name and a content, see helpers.read_config_files
+        :param checksums: checksums of sections contained in a deployed configuration, in an order of a configuration
+        :return: HaProxySnapshotModel
+        """
+        snapshot = self.create(digest=digest, content=files, checksums=checksums,
+                               size=sum(len(content) for _, content in files), deploy_time=timezone.now())
+        self.prune()
+        return snapshot
+
+    def prune(self, keep=None):
+        """
+        Method deletes snapshots except a number of most recently deployed ones.
+        :param keep: number of snapshots kept, the HAPROXY_SNAPSHOTS_KEPT variable when omitted, None keeps all
+        :return: number of deleted snapshots
+        """
+        keep = settings.HAPROXY_SNAPSHOTS_KEPT if keep is None else keep
+        if keep is None:
+            return 0
+
+        kept = list(self.order_by('-deploy_time', '-pk').values_list('pk', flat=True)[:keep])
+        stale = self.exclude(pk__in=kept)
+        count = stale.count()
+        stale.delete()
+        return count
+
+
+class HaProxySnapshotModel(models.Model):
+    """
+    Model keeps a whole deployed configuration, addressed by its digest, thus any previously deployed configuration is
+    restored as it was, without generating it from sections again. Content is a list of pairs of a file name and its
+    content, a single file of a configuration has an empty name, and it is always stored compressed. Checksums of
+    sections, which a configuration was generated from, are stored along.
+    """
+    digest = models.CharField(max_length=32, unique=True)
+    content = Base64JsonField(storage_format='zlib', compress_threshold=0)
+    checksums = Base64JsonField()
+    size = models.PositiveIntegerField()
+    create_time = models.DateTimeField(auto_now_add=True)
+    deploy_time = models.DateTimeField(db_index=True)
+
+    objects = HaProxySnapshotManager()
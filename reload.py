@@ -0,0 +1,175 @@
+from api_core.exceptions import InternalServerErrorException
+from helpers import raise_500_error
+from runtime import HaProxyRuntimeClient
+import subprocess
+import tempfile
+import settings
+import socket
+import signal
+import errno
+import time
+import os
+
+# Modes of a reload, see reload_target
+RELOAD_MODES = ('command', 'seamless', 'master-worker')
+
+
+def run_command(args, timeout):
+    """
+    Function runs a command and waits for it to exit. An output is collected in a temporary file rather than a pipe,
+    thus a daemon forked by a command and keeping inherited descriptors never blocks a caller. A command is killed
+    when it does not exit in time, a finished command is always reaped.
+    :param args: list of command arguments
+    :param timeout: number of seconds to wait at most
+    :return: pair of a return code and an output
+    :raises: api_core.exceptions.InternalServerErrorException when a command does not exit in time or is not found
+    """
+    with tempfile.TemporaryFile() as output:
+        try:
+            process = subprocess.Popen(args, stdout=output, stderr=subprocess.STDOUT, close_fds=True)
+        except OSError as e:
+            err_message = str(e.strerror) + '. Make sure HAProxy is installed and a path to its binary is correct.'
+            raise_500_error(e.errno, err_message)
+
+        deadline = time.time() + timeout
+        while process.poll() is None:
+            if time.time() > deadline:
+                process.kill()
+                process.wait()
+                raise_500_error(errno.ETIMEDOUT, '{} has not exited in time.'.format(' '.join(args)))
+            time.sleep(0.05)
+
+        output.seek(0)
+        return process.returncode, output.read().strip()
+
+
+def read_pids(pid_file_path):
+    """
+    Function reads pids of HAProxy processes from a pid file.
+    :param pid_file_path: path to a pid file
+    :return: list of pids, empty when a file does not exist
+    """
+    try:
+        with open(pid_file_path) as f:
+            return [int(pid) for pid in f.read().split() if pid.isdigit()]
+    except IOError:
+        return []
+
+
+def pids_alive(pids):
+    """
+    Function checks, whether all processes are running.
+    :param pids: list of pids
+    :return: False when a list is empty or any process does not exist
+    """
+    for pid in pids:
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            if e.errno != errno.EPERM:
+                return False
+    return bool(pids)
+
+
+def worker_pid(socket_path):
+    """
+    Function asks a worker serving a runtime API for its pid.
+    :param socket_path: path to a runtime API socket
+    :return: pid or None, when a socket is not available
+    """
+    try:
+        for line in HaProxyRuntimeClient(socket_path).iter_lines('show info'):
+            if line.startswith('Pid:'):
+                return int(line.split(':', 1)[1])
+    except (socket.error, ValueError):
+        return None
+
+
+def wait_until(predicate, timeout, interval=0.05):
+    """
+    Function polls a predicate until it holds or a timeout expires.
+    :param predicate: function without arguments
+    :param timeout: number of seconds to wait at most
+    :param interval: number of seconds between polls
+    :return: True when a predicate holds
+    """
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def reload_target(target):
+    """
+    Function reloads a HAProxy instance of a deploy target and waits for a new process to become ready, at most
+    HAPROXY_RELOAD_TIMEOUT seconds. An instance is reloaded in a mode given by a target or by the HAPROXY_RELOAD_MODE
+    variable:
+    'command' runs a reload command of a target and waits for it to exit successfully,
+    'seamless' starts a new daemon receiving listening sockets of an old one through a runtime API socket, which has to
+    be configured with 'expose-fd listeners', then an old one finishes serving its connections, a new process is ready
+    once a pid file lists new running processes,
+    'master-worker' signals a master process started with -W to reload its workers, or starts it when it is not running,
+    a new worker is ready once a runtime API socket is served by a new pid, thus a pid of an old worker has to be read
+    before a master is signalled.
+    :param target: deploy.DeployTarget
+    :return: dictionary containing a return code, a mode, pids of new processes and a reload latency in seconds
+    :raises: api_core.exceptions.InternalServerErrorException when a reload fails or a new process is not ready in time,
+    then a 'handed over' key of its detail marks, that a running instance has been reloaded already
+    """
+    mode = target.reload_mode or settings.HAPROXY_RELOAD_MODE
+    timeout = settings.HAPROXY_RELOAD_TIMEOUT
+    haproxy_executable = getattr(settings, 'HAPROXY_EXECUTABLE', None) or 'haproxy'
+    start = time.time()
+
+    if mode == 'command':
+        return_code, output = run_command(target.reload_command(), timeout)
+        if return_code:
+            raise_500_error(return_code, output)
+        return {'return code': 0, 'mode': mode, 'pids': read_pids(target.pid_file_path),
+                'reload seconds': time.time() - start}
+
+    old_pids = read_pids(target.pid_file_path)
+    old_running = pids_alive(old_pids)
+
+    if mode == 'seamless':
+        args = [haproxy_executable, '-D', '-f', target.config_path, '-p', target.pid_file_path]
+        if old_running:
+            args += ['-x', target.socket_path, '-sf'] + [str(pid) for pid in old_pids]
+        return_code, output = run_command(args, timeout)
+        if return_code:
+            raise_500_error(return_code, output)
+
+        def ready():
+            pids = read_pids(target.pid_file_path)
+            return bool(set(pids) - set(old_pids)) and pids_alive(pids)
+
+    elif mode == 'master-worker':
+        if old_running:
+            old_worker = worker_pid(target.socket_path)
+            # Without a pid of an old worker, any worker would be taken for a new one
+            if old_worker is None:
+                raise_500_error(errno.ENOENT, 'Runtime API socket {} does not report a worker pid, a reload could not '
+                                              'be confirmed.'.format(target.socket_path))
+            os.kill(old_pids[0], signal.SIGUSR2)
+            ready = lambda: worker_pid(target.socket_path) not in (None, old_worker)
+        else:
+            args = [haproxy_executable, '-W', '-D', '-f', target.config_path, '-p', target.pid_file_path]
+            return_code, output = run_command(args, timeout)
+            if return_code:
+                raise_500_error(return_code, output)
+            ready = lambda: pids_alive(read_pids(target.pid_file_path))
+
+    else:
+        raise_500_error(errno.EINVAL, 'Unknown reload mode {0}, use one of {1}.'.format(mode, ', '.join(RELOAD_MODES)))
+
+    if not wait_until(ready, max(timeout - (time.time() - start), 0)):
+        # A running instance has been handed over to a new process or its workers reloaded already
+        raise InternalServerErrorException(detail={
+            'return code': errno.ETIMEDOUT, 'handed over': True,
+            'error': 'New HAProxy process has not become ready in {} seconds.'.format(timeout),
+        })
+
+    return {'return code': 0, 'mode': mode, 'pids': read_pids(target.pid_file_path),
+            'reload seconds': time.time() - start}
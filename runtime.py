@@ -0,0 +1,181 @@
+from django.core.cache import cache
+import settings
+import socket
+import random
+import time
+import csv
+import re
+
+# Keys of a Django cache shared by workers, which hold a snapshot of statistics and a lock of its refresh
+STATS_CACHE_KEY = 'api_haproxy:stats'
+STATS_LOCK_KEY = 'api_haproxy:stats:lock'
+# Fraction of a ttl of a snapshot, within which workers consider it stale at random times, and a number of seconds
+# between reads of a cache by a worker waiting for a first snapshot
+STATS_REFRESH_JITTER = 0.2
+STATS_LOCK_POLL_INTERVAL = 0.05
+
+
+class HaProxyRuntimeClient(object):
+    """
+    Client of a HAProxy runtime API exposed on an unix socket, configured by a 'stats socket' directive with an admin
+    level. Every command is sent over a new connection in a non-interactive mode, HAProxy closes a connection after
+    a response is sent.
+    """
+
+    def __init__(self, socket_path=None, timeout=None):
+        self.socket_path = socket_path or settings.HAPROXY_RUNTIME_SOCKET_PATH
+        self.timeout = timeout or settings.HAPROXY_RUNTIME_SOCKET_TIMEOUT
+
+    def _connect(self, command):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(command + '\n')
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def iter_lines(self, command, chunk_size=65536):
+        """
+        Generator sends a command and yields lines of a response while it is being received, thus a response of any
+        size is processed with a constant memory.
+        :param command: runtime API command, more commands may be separated by a semicolon
+        :param chunk_size: number of bytes received at once
+        :return: generator of response lines without line endings
+        :raises: socket.error when a socket is not available
+        """
+        sock = self._connect(command)
+        try:
+            pending = ''
+            for chunk in iter(lambda: sock.recv(chunk_size), ''):
+                lines = (pending + chunk).split('\n')
+                pending = lines.pop()
+                for line in lines:
+                    yield line
+            if pending:
+                yield pending
+        finally:
+            sock.close()
+
+    def execute(self, command):
+        """
+        Method sends a command and returns a whole response.
+        :param command: runtime API command, more commands may be separated by a semicolon
+        :return: response stripped of surrounding whitespaces
+        :raises: socket.error when a socket is not available
+        """
+        return '\n'.join(self.iter_lines(command)).strip()
+
+
+# Runtime API commands applying a change of a server, the output of a successful command is listed along
+RUNTIME_SERVER_COMMANDS = {
+    'weight': ('set weight {backend}/{server} {value}', ''),
+    'maxconn': ('set maxconn server {backend}/{server} {value}', ''),
+    'enable': ('enable server {backend}/{server}', ''),
+    'disable': ('disable server {backend}/{server}', ''),
+    'add': ('add server {backend}/{server} {value}; enable server {backend}/{server}', 'New server registered.'),
+    'del': ('disable server {backend}/{server}; del server {backend}/{server}', 'Server deleted.'),
+}
+
+
+# Address of an added server, i.e. an IPv4 address, a hostname or a bracketed IPv6 address, followed by a port
+SERVER_ADDRESS_PATTERN = re.compile(r'^(?:[\w.-]+|\[[0-9a-fA-F:.]+\]):\d+$')
+# Characters separating runtime API commands, a value containing any of them would run further commands
+COMMAND_SEPARATORS = re.compile(r'[;\r\n]')
+
+
+def clean_server_value(action, value):
+    """
+    Function validates a value of a server change before it is formatted into a runtime API command. A weight and
+    a maxconn are numbers, a value of an added server is an address and a port followed by server keywords.
+    :param action: one of keys of RUNTIME_SERVER_COMMANDS
+    :param value: value of a change
+    :return: cleaned value, None for actions without a value
+    :raises: ValueError when a value is invalid
+    """
+    if action in ('weight', 'maxconn'):
+        if not str(value).isdigit():
+            raise ValueError('Value of {} has to be a number.'.format(action))
+        return str(value)
+
+    if action == 'add':
+        words = value.split() if isinstance(value, basestring) else []
+        if not words or COMMAND_SEPARATORS.search(value) or not SERVER_ADDRESS_PATTERN.match(words[0]):
+            raise ValueError('Value has to be an address and a port of a server followed by its keywords.')
+        return ' '.join(words)
+
+    return None
+
+
+def apply_server_change(backend, server, action, value=None, client=None):
+    """
+    Function applies a change of a server through a runtime API without a reload of HAProxy.
+    :param backend: name of a backend or a listen section
+    :param server: name of a server
+    :param action: one of keys of RUNTIME_SERVER_COMMANDS
+    :param value: value of a change, e.g. a weight or an address of an added server
+    :param client: HaProxyRuntimeClient, a default one is used when omitted
+    :raises: ValueError when a value is invalid or HAProxy refuses a change, socket.error when a socket is not
+    available
+    """
+    value = clean_server_value(action, value)
+    command, expected = RUNTIME_SERVER_COMMANDS[action]
+    output = (client or HaProxyRuntimeClient()).execute(command.format(backend=backend, server=server, value=value))
+    if output.replace('\n', ' ').strip() != expected:
+        raise ValueError(output)
+
+
+def parse_stat_csv(lines):
+    """
+    Generator parses an output of a 'show stat' command line by line. A first line holds names of columns prefixed by
+    a '# ' string, every following line is a row of a proxy, i.e. a frontend, a backend or a server.
+    :param lines: iterable of output lines
+    :return: generator of dictionaries mapping names of columns to values, empty values are left out
+    """
+    lines = iter(lines)
+    header = next(lines, '').lstrip('# ').rstrip(',').split(',')
+
+    for row in csv.reader(line for line in lines if line.strip()):
+        yield dict((column, value) for column, value in zip(header, row) if value)
+
+
+def get_stats_snapshot(client=None):
+    """
+    Function returns a snapshot of statistics shared by all workers through a Django cache, which needs to be a shared
+    backend like memcached, a database or files, with a default local memory cache every process keeps its own
+    snapshot. A snapshot is read from a runtime socket at most once per HAPROXY_STATS_CACHE_TTL seconds, only a worker
+    acquiring a refresh lock reads it, others serve a previous snapshot meanwhile, or wait for a first one. Workers
+    consider a snapshot stale at randomly spread times within a last fraction of its ttl, thus they do not all try to
+    refresh it at once.
+    :param client: HaProxyRuntimeClient, a default one is used when omitted
+    :return: dictionary containing a time of a snapshot and a list of rows
+    :raises: socket.error when a socket is not available
+    """
+    ttl = settings.HAPROXY_STATS_CACHE_TTL
+    snapshot = cache.get(STATS_CACHE_KEY)
+    if snapshot is not None and snapshot['time'] + ttl * (1 - STATS_REFRESH_JITTER * random.random()) >= time.time():
+        return snapshot
+
+    locked = cache.add(STATS_LOCK_KEY, True, settings.HAPROXY_RUNTIME_SOCKET_TIMEOUT)
+    if not locked:
+        if snapshot is not None:
+            return snapshot
+        # Another worker reads a first snapshot, it is waited for at most as long as a read may take
+        deadline = time.time() + settings.HAPROXY_RUNTIME_SOCKET_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(STATS_LOCK_POLL_INTERVAL)
+            snapshot = cache.get(STATS_CACHE_KEY)
+            if snapshot is not None:
+                return snapshot
+
+    try:
+        rows = list(parse_stat_csv((client or HaProxyRuntimeClient()).iter_lines('show stat')))
+        snapshot = {'time': time.time(), 'rows': rows}
+        # Stale snapshot outlives its ttl to be served while a next one is being read
+        cache.set(STATS_CACHE_KEY, snapshot, ttl * 10)
+    finally:
+        if locked:
+            cache.delete(STATS_LOCK_KEY)
+    return snapshot
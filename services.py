@@ -0,0 +1,227 @@
+from api_core.exceptions import DoesNotExistException
+from django.db import transaction, DatabaseError
+from models import HaProxyConfigModel, HaProxyDeploymentModel, HaProxySnapshotModel
+from helpers import raise_500_error, chunked, build_section, write_line_map, read_config_checksums, \
+    section_file_name, list_section_files, atomic_write, validate_configuration, read_config_files, \
+    write_config_files, files_digest
+from cache import section_render_cache
+from deploy import deploy_configuration, coalesce_deployment, file_lock
+from operator import methodcaller
+from hashlib import md5
+import metrics
+import settings
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Service layer shared by API views and management commands, validate_configuration is re-exported as a part of it
+__all__ = ['render_sections', 'write_section_files', 'generate_configuration', 'validate_configuration',
+           'deploy_generated_configuration', 'store_snapshot', 'roll_back_configuration', 'load_sections']
+
+
+def render_sections(checksums):
+    """
+    Function formats sections of given checksums into configuration blocks. Formatted blocks are cached by a section
+    checksum, thus only sections not seen in a previous generation are read, decoded and formatted.
+    :param checksums: checksums of sections
+    :return: dictionary mapping checksums to configuration blocks
+    """
+    fragments = section_render_cache.get_many(checksums)
+    missing = [checksum for checksum in checksums if checksum not in fragments]
+    rendered = {}
+    for chunk in chunked(missing, settings.HAPROXY_QUERY_CHUNK_SIZE):
+        with metrics.timed('generate_fetch'):
+            sections = HaProxyConfigModel.objects.resolve_patches(HaProxyConfigModel.objects.filter(checksum__in=chunk))
+        # Configuration is decoded on a first access, thus decoding is measured apart from rendering
+        with metrics.timed('generate_decode'):
+            for res in sections:
+                res.configuration
+        with metrics.timed('generate_render'):
+            for res in sections:
+                rendered[res.checksum] = res.render()
+    section_render_cache.set_many(rendered)
+    fragments.update(rendered)
+    return fragments
+
+
+def write_section_files(result):
+    """
+    Function writes every section into its own file of a directory specified by the HAPROXY_CONFIG_DEV_PATH variable.
+    Names of files contain checksums of sections, see helpers.section_file_name, thus only files of newly active
+    sections are written and only files of sections no longer active are removed. Sections of unchanged files are
+    neither read nor formatted.
+    :param result: active sections sorted by a weight
+    :return: dictionary containing numbers of written and removed files
+    :raises: api_core.exceptions.InternalServerErrorException when a directory cannot be written
+    """
+    dev_dir = settings.HAPROXY_CONFIG_DEV_PATH
+    files = dict(
+        (section_file_name(res.get_section_weight(), res.section, res.section_name, res.checksum), res.checksum)
+        for res in result
+    )
+
+    try:
+        if not os.path.isdir(dev_dir):
+            os.makedirs(dev_dir)
+        existing = set(list_section_files(dev_dir))
+        written = sorted(name for name in files if name not in existing)
+        removed = sorted(existing - set(files))
+        fragments = render_sections([files[name] for name in written])
+
+        with metrics.timed('generate_write'):
+            for name in written:
+                atomic_write(os.path.join(dev_dir, name), [fragments[files[name]]])
+            for name in removed:
+                os.unlink(os.path.join(dev_dir, name))
+    except (IOError, OSError) as e:
+        raise_500_error(e.errno, '{0} {1}'.format(e.strerror, e.filename or dev_dir))
+
+    return {'created': True, 'written': len(written), 'removed': len(removed)}
+
+
+def generate_configuration():
+    """
+    Function generates a configuration of active sections into a file specified by the HAPROXY_CONFIG_DEV_PATH
+    variable, sorted by weights of sections, see HaProxyConfigModel.get_section_order. A line map of a generated file
+    is stored along, mapping lines to checksums of sections, which produced them. When the HAPROXY_CONFIG_SPLIT
+    variable is set, a configuration is written into a directory instead, see write_section_files.
+    :return: dictionary of a result
+    :raises: api_core.exceptions.DoesNotExistException when there are no sections,
+    api_core.exceptions.InternalServerErrorException when a file cannot be written
+    """
+    with metrics.timed('generate_query'):
+        result = list(HaProxyConfigModel.objects.active().defer('meta', 'configuration'))
+
+    if not result:
+        raise DoesNotExistException()
+
+    result.sort(key=methodcaller('get_section_order'))
+    checksums = [res.checksum for res in result]
+    section_render_cache.retain(checksums)
+
+    if settings.HAPROXY_CONFIG_SPLIT:
+        return write_section_files(result)
+
+    fragments = render_sections(checksums)
+    line_map, line, digest = [], 1, md5()
+    for checksum in checksums:
+        line_map.append((line, checksum))
+        line += fragments[checksum].count('\n')
+        digest.update(fragments[checksum])
+
+    try:
+        with metrics.timed('generate_write'):
+            # A map is written first, its digest tells a map of a next configuration from a map of a current one
+            write_line_map(settings.HAPROXY_CONFIG_DEV_PATH, line_map, digest.hexdigest())
+            atomic_write(settings.HAPROXY_CONFIG_DEV_PATH, [fragments[checksum] for checksum in checksums])
+    except (IOError, OSError) as e:
+        raise_500_error(e.errno, e.strerror + settings.HAPROXY_CONFIG_DEV_PATH)
+
+    return {'created': True}
+
+
+def deploy_generated_configuration(fail_fast=None):
+    """
+    Function deploys a configuration generated into a file specified by the HAPROXY_CONFIG_DEV_PATH variable to all
+    deploy targets, see deploy.deploy_configuration, records sections of a deployed file and stores its snapshot, see
+    store_snapshot. A snapshot, which cannot be stored, is logged and counted, but it does not fail a finished
+    deployment. Deployments are serialized across processes and callers arriving during a running deployment share
+    an outcome of a next one, see deploy.coalesce_deployment.
+    :param fail_fast: whether to stop at a first failed target, the HAPROXY_DEPLOY_FAIL_FAST variable when omitted
+    :return: dictionary of a result
+    :raises: api_core.exceptions.DoesNotExistException when a configuration was not generated,
+    api_core.exceptions.InternalServerErrorException when a deployment fails
+    """
+    haproxy_dev_config = settings.HAPROXY_CONFIG_DEV_PATH
+
+    # Check if configs are in place
+    if not os.path.exists(haproxy_dev_config):
+        raise DoesNotExistException(
+            detail='{} does not exist. Run call to generate it first.'.format(haproxy_dev_config)
+        )
+
+    def deploy():
+        result = deploy_configuration(haproxy_dev_config, fail_fast=fail_fast)
+        checksums = read_config_checksums(haproxy_dev_config, result['digest'])
+        HaProxyDeploymentModel.objects.record(result['digest'], checksums)
+        try:
+            with transaction.atomic():
+                store_snapshot(haproxy_dev_config, result['digest'], checksums)
+        except (DatabaseError, IOError, OSError, ValueError):
+            metrics.snapshot_failures.inc()
+            logger.exception('Snapshot of a deployed configuration %s has not been stored.', result['digest'])
+        return result
+
+    return coalesce_deployment(deploy)
+
+
+def store_snapshot(config_path, digest, checksums):
+    """
+    Function stores a snapshot of a deployed configuration, see HaProxySnapshotModel. A configuration, which has been
+    deployed before, is neither read nor stored again.
+    :param config_path: path to a deployed configuration
+    :param digest: digest of a deployed configuration
+    :param checksums: checksums of sections contained in a deployed configuration
+    :return: boolean, whether a snapshot is stored
+    """
+    if HaProxySnapshotModel.objects.touch(digest):
+        return True
+
+    files = read_config_files(config_path)
+    # Configuration generated again after a deployment has read it is not a deployed one
+    if files_digest(files) != digest:
+        return False
+    HaProxySnapshotModel.objects.store(digest, files, checksums)
+    return True
+
+
+def roll_back_configuration(digest, fail_fast=None):
+    """
+    Function deploys a snapshot of a previously deployed configuration to all deploy targets. A snapshot is restored
+    into a path specified by the HAPROXY_SNAPSHOT_RESTORE_PATH variable and deployed from there, see
+    deploy.deploy_configuration, thus neither sections are read nor a configuration is generated. A rollback holds
+    a same lock as other deployments, but it is not coalesced with them, as it deploys a different configuration.
+    :param digest: digest of a snapshot
+    :param fail_fast: whether to stop at a first failed target, the HAPROXY_DEPLOY_FAIL_FAST variable when omitted
+    :return: dictionary of a result
+    :raises: api_core.exceptions.DoesNotExistException when there is no such snapshot,
+    api_core.exceptions.InternalServerErrorException when a deployment fails
+    """
+    try:
+        snapshot = HaProxySnapshotModel.objects.get(digest=digest)
+    except HaProxySnapshotModel.DoesNotExist:
+        raise DoesNotExistException(detail='Snapshot {} does not exist.'.format(digest))
+
+    restore_path = settings.HAPROXY_SNAPSHOT_RESTORE_PATH
+    with file_lock(settings.HAPROXY_DEPLOY_LOCK_PATH, settings.HAPROXY_DEPLOY_LOCK_TIMEOUT):
+        try:
+            write_config_files(restore_path, snapshot.content)
+        except (IOError, OSError) as e:
+            raise_500_error(e.errno, '{0} {1}'.format(e.strerror, e.filename or restore_path))
+
+        result = deploy_configuration(restore_path, fail_fast=fail_fast)
+        HaProxyDeploymentModel.objects.record(result['digest'], snapshot.checksums)
+        HaProxySnapshotModel.objects.touch(digest)
+
+    result['snapshot'] = digest
+    return result
+
+
+def load_sections(sections):
+    """
+    Function validates and stores many sections at once, see HaProxyConfigManager.bulk_upsert. Invalid and duplicate
+    sections are reported per item and do not abort the rest.
+    :param sections: list of dictionaries containing section, section_name and configuration keys
+    :return: list of results in an order of passed in sections
+    """
+    configs, results = [], []
+    for data in sections:
+        try:
+            configs.append(build_section(data))
+            results.append(None)
+        except (ValueError, AttributeError):
+            results.append({'invalid': True})
+
+    created = iter(HaProxyConfigModel.objects.bulk_upsert(configs))
+    return [result or next(created) for result in results]
@@ -7,9 +7,43 @@ HAPROXY_CONFIG_PATH = '/etc/haproxy/haproxy.cfg'
 # Path to developed configuration. This file replaces one specified in HAPROXY_CONFIG_PATH when changes are deployed
 HAPROXY_CONFIG_DEV_PATH = settings.BASE_DIR + '/haproxy.cfg'
 
+# Configuration is generated into a directory of files holding a single section each, instead of a single file. Paths
+# in HAPROXY_CONFIG_DEV_PATH, HAPROXY_CONFIG_PATH and HAPROXY_DEPLOY_TARGETS point to directories then, HAProxy loads
+# all files of a directory given by a -f option. Only files of changed sections are written and deployed.
+HAPROXY_CONFIG_SPLIT = False
+
+# Keywords starting a section in a configuration file, used when an existing configuration file is imported
+HAPROXY_CONFIG_SECTIONS = [
+    'global', 'defaults', 'frontend', 'backend', 'listen', 'userlist', 'peers', 'resolvers', 'mailers', 'cache',
+    'program', 'http-errors', 'ring'
+]
+
 # Sections in configuration file, which must be named
 HAPROXY_CONFIG_NAMED_SECTIONS = ['frontend', 'backend', 'listen']
 
+# Maximum number of checksums passed to a single database query, keeps IN clauses within limits of database backends
+HAPROXY_QUERY_CHUNK_SIZE = 500
+
+# Retention of old versions of sections, applied by a 'haproxy_compact' management command. A version is kept, when it
+# is one of HAPROXY_RETENTION_VERSIONS newest versions of its section type, or when it is newer than
+# HAPROXY_RETENTION_DAYS days. None disables a rule, nothing is pruned when both are None. Active versions and versions
+# of a last deployed configuration are always kept.
+HAPROXY_RETENTION_VERSIONS = 10
+HAPROXY_RETENTION_DAYS = 30
+
+# Maximum length of a chain of versions stored as patches of their parents, a next patched version stores a whole
+# configuration. 0 stores every patched version as a whole configuration.
+HAPROXY_PATCH_CHAIN_MAX = 20
+
+# Default and maximum number of sections listed on a page, when a section list is paginated
+HAPROXY_PAGE_SIZE = 100
+HAPROXY_PAGE_SIZE_MAX = 1000
+
+# Storage format of JSON data in a database: 'json' for a compact JSON, 'zlib' for a JSON compressed when its size
+# exceeds HAPROXY_JSON_FIELD_COMPRESS_THRESHOLD characters, 'base64' for a former Base64 format. All formats are read.
+HAPROXY_JSON_FIELD_FORMAT = 'json'
+HAPROXY_JSON_FIELD_COMPRESS_THRESHOLD = 4096
+
 # Strings to be ignored from haproxy command outputs
 HAPROXY_BLACKLISTED_OUTPUT = [
     'Fatal errors found in configuration.',
@@ -23,6 +57,80 @@ BASH_PATH = '/bin/bash'
 # Path to file, where pids of processes will be stored during reload
 HAPROXY_PID_FILE_PATH = '/var/run/haproxy-procs.pid'
 
+# HAProxy instances a configuration is deployed to, each described by a dictionary with 'name', 'config_path' and
+# optional 'pid_file_path', 'reload_cmd', 'restart_cmd', 'reload_mode' and 'socket_path' keys, e.g.
+# {'name': 'public', 'config_path': '/etc/haproxy/public.cfg', 'pid_file_path': '/var/run/haproxy-public.pid'}
+# When left empty, a single instance given by HAPROXY_CONFIG_PATH, HAPROXY_PID_FILE_PATH and commands below is used.
+HAPROXY_DEPLOY_TARGETS = []
+
+# Targets are deployed concurrently by HAPROXY_DEPLOY_WORKERS threads, at most HAPROXY_DEPLOY_RELOADS_MAX of them are
+# reloaded at once and a deployment waits for all of them at most HAPROXY_DEPLOY_TIMEOUT seconds. With a fail fast,
+# targets not started yet are skipped after a first failure.
+HAPROXY_DEPLOY_WORKERS = 4
+HAPROXY_DEPLOY_RELOADS_MAX = 2
+HAPROXY_DEPLOY_TIMEOUT = 60
+HAPROXY_DEPLOY_FAIL_FAST = False
+
+# Mode of a reload: 'command' runs HAPROXY_RELOAD_CMD or HAPROXY_RESTART_CMD, 'seamless' starts a new daemon taking
+# over listening sockets of an old one through HAPROXY_RUNTIME_SOCKET_PATH, which needs 'expose-fd listeners' set on
+# a stats socket, and 'master-worker' sends SIGUSR2 to a master process started with -W. A new process has to become
+# ready in HAPROXY_RELOAD_TIMEOUT seconds, otherwise a backed up configuration is restored.
+HAPROXY_RELOAD_MODE = 'command'
+HAPROXY_RELOAD_TIMEOUT = 10
+
+# Deployments of all processes are serialized by a lock of a HAPROXY_DEPLOY_LOCK_PATH file, waiting for it at most
+# HAPROXY_DEPLOY_LOCK_TIMEOUT seconds. Requests waiting for a running deployment are coalesced into a next single
+# deployment and share its outcome through a HAPROXY_DEPLOY_STATE_PATH file. A deployment waits HAPROXY_DEPLOY_DEBOUNCE
+# seconds for other requests before it starts, thus a burst of requests results in a single reload.
+HAPROXY_DEPLOY_LOCK_PATH = settings.BASE_DIR + '/haproxy-deploy.lock'
+HAPROXY_DEPLOY_STATE_PATH = settings.BASE_DIR + '/haproxy-deploy.state'
+HAPROXY_DEPLOY_LOCK_TIMEOUT = 300
+HAPROXY_DEPLOY_DEBOUNCE = 0
+
+# Every deployed configuration is kept as a compressed snapshot addressed by its digest, HAPROXY_SNAPSHOTS_KEPT most
+# recently deployed ones are kept, None keeps all. A rolled back snapshot is restored into a
+# HAPROXY_SNAPSHOT_RESTORE_PATH file, or a directory for a split configuration, and deployed from there.
+HAPROXY_SNAPSHOTS_KEPT = 50
+HAPROXY_SNAPSHOT_RESTORE_PATH = settings.BASE_DIR + '/haproxy-rollback.cfg'
+
+# Validation jobs are executed by HAPROXY_VALIDATION_WORKERS threads, at most HAPROXY_VALIDATION_QUEUE_SIZE jobs may
+# wait for a worker, both per a server process. Results of last HAPROXY_VALIDATION_JOBS_KEPT jobs are kept for polling
+# in a HAPROXY_VALIDATION_JOBS_PATH directory shared by all processes, a client may wait for a result at most
+# HAPROXY_VALIDATION_JOB_WAIT_MAX seconds within a single request.
+HAPROXY_VALIDATION_WORKERS = 2
+HAPROXY_VALIDATION_QUEUE_SIZE = 10
+HAPROXY_VALIDATION_JOBS_KEPT = 100
+HAPROXY_VALIDATION_JOB_WAIT_MAX = 30
+HAPROXY_VALIDATION_JOBS_PATH = settings.BASE_DIR + '/haproxy-jobs'
+
+# Number of validation results cached by a content of a validated configuration and an identity of a haproxy binary
+HAPROXY_VALIDATION_CACHE_SIZE = 128
+
+# Path to a runtime API unix socket, enabled by a 'stats socket /var/run/haproxy.sock level admin' directive in a global
+# section, and a timeout of its operations in seconds
+HAPROXY_RUNTIME_SOCKET_PATH = '/var/run/haproxy.sock'
+HAPROXY_RUNTIME_SOCKET_TIMEOUT = 5
+
+# Number of seconds a snapshot of statistics read from a runtime socket is shared by all requests and workers. Workers
+# share it through a Django cache, thus CACHES need to configure a shared backend, e.g. memcached, a database or files.
+# With a default local memory cache every worker process reads and keeps its own snapshot.
+HAPROXY_STATS_CACHE_TTL = 2
+
+# HTTP log of HAProxy ('option httplog') analysed by a logs endpoint. A log is scanned incrementally, at most
+# HAPROXY_LOG_SCAN_BYTES bytes per request, a read offset and aggregated statistics are kept in a HAPROXY_LOG_STATE_PATH
+# file. Percentiles of timers are estimated within a HAPROXY_LOG_SKETCH_ACCURACY relative error.
+HAPROXY_LOG_PATH = '/var/log/haproxy.log'
+HAPROXY_LOG_STATE_PATH = settings.BASE_DIR + '/haproxy-log.state'
+HAPROXY_LOG_SCAN_BYTES = 256 * 1024 * 1024
+HAPROXY_LOG_SKETCH_ACCURACY = 0.01
+HAPROXY_LOG_PERCENTILES = (50, 90, 99)
+
+# Timing of generation, validation and deployment stages and counters of reloads, exposed on a metrics endpoint. Metrics
+# are kept per a server process, a scrape reports values of a process, which has served it.
+HAPROXY_METRICS_ENABLED = True
+# Upper bounds in seconds of buckets of a stage duration histogram
+HAPROXY_METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
 ## Commands used to validate HaProxy configuration
 # Specifying this commands introduces a SECURITY HAZARD. Commands will be executed as they are without further control
 # and their output will be harvested for later processing. Use carefully or delete/comment these variables. In the
@@ -1,7 +1,85 @@
 from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from django.db import IntegrityError, transaction
 from rest_framework.test import APITestCase
 from rest_framework import status
+from cache import section_render_cache, validation_cache
+from fields import encode_json_value, decode_json_value
+from helpers import parse_haproxy_config, parse_haproxy_configtest_output, read_line_map, override_haproxy_settings
+from runtime import STATS_CACHE_KEY, STATS_LOCK_KEY, get_stats_snapshot
+from jobs import WorkerPool
+from benchmarks import run_benchmark
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from models import HaProxyConfigModel, HaProxyActiveConfigModel, HaProxyDeploymentModel, HaProxySnapshotModel
+from threading import Thread
+from StringIO import StringIO
+import settings as haproxy_settings
+import metrics
+import deploy
+import tempfile
+import shutil
+import socket
+import signal
+import sys
+import time
+import base64
 import json
+import os
+
+
+# Stub of a 'haproxy' binary started with -D, it forks a long running process, writes its pid and stops old processes
+STUB_DAEMON = """#!/bin/sh
+while [ $# -gt 0 ]; do case $1 in -p) PID_FILE=$2; shift;; -sf) shift; OLD_PIDS="$*"; break;; esac; shift; done
+[ {exit_code} -ne 0 ] && {{ echo "[ALERT] configuration is broken"; exit {exit_code}; }}
+sleep 60 >/dev/null 2>&1 &
+echo $! > $PID_FILE
+[ -n "$OLD_PIDS" ] && kill $OLD_PIDS
+exit 0
+"""
+
+
+def isolate_deployments(test_case, tmp_dir):
+    """
+    Function points a deploy lock and a state of coalesced deployments to a temporary directory, until a test case is
+    finished, thus a test neither waits for nor shares an outcome with a deployment of a host running tests.
+    :param test_case: unittest.TestCase
+    :param tmp_dir: temporary directory of a test case
+    """
+    overrides = override_haproxy_settings(HAPROXY_DEPLOY_LOCK_PATH=os.path.join(tmp_dir, 'deploy.lock'),
+                                          HAPROXY_DEPLOY_STATE_PATH=os.path.join(tmp_dir, 'deploy.state'))
+    overrides.__enter__()
+    test_case.addCleanup(overrides.__exit__, None, None, None)
+
+
+class FakeRuntimeSocket(object):
+    """
+    Unix socket server answering commands of a HAProxy runtime API with prepared responses.
+    """
+
+    def __init__(self, path, responses):
+        self.path = path
+        self.responses = responses
+        self.commands = []
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(1)
+        self.thread = Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        for response in self.responses:
+            connection, _ = self.server.accept()
+            self.commands.append(connection.recv(4096).strip())
+            connection.sendall(response)
+            connection.close()
+
+    def close(self):
+        self.thread.join(5)
+        self.server.close()
 
 
 class HaProxyConfigBuildTest(APITestCase):
@@ -83,12 +161,44 @@ class HaProxyConfigBuildTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 2)
 
+    def test_get_sections_page_ok(self):
+        self.client.post(self.base_url, self.data)
+        local_data = self.data.copy()
+        local_data['section'] = 'defaults'
+        self.client.post(self.base_url, local_data)
+
+        first = self.client.get(self.base_url, {'limit': 1})
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(first.data.get('results')), 1)
+        second = self.client.get(self.base_url, {'limit': 1, 'cursor': first.data.get('next')})
+        self.assertIsNone(second.data.get('next'))
+        sections = set(page.data.get('results')[0].get('section') for page in (first, second))
+        self.assertSetEqual(sections, {'global', 'defaults'})
+
+    def test_get_sections_stream_ok(self):
+        self.client.post(self.base_url, self.data)
+        response = self.client.get(self.base_url, {'stream': 1, 'section': 'global'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(''.join(response.streaming_content))), 1)
+
+    def test_get_specific_section_not_modified(self):
+        response = self.client.post(self.base_url, self.data)
+        section_url = self.base_url + response.data.get('checksum') + '/'
+        etag = self.client.get(section_url)['ETag']
+        response = self.client.get(section_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.put(section_url)
+        response = self.client.get(section_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
 
 class HaProxyConfigTest(APITestCase):
     base_url = '/{}/haproxy'.format(settings.API_VERSION_PREFIX)
     sections_url = '{}/section/'.format(base_url)
     generate_url = '{}/configuration/generate/'.format(base_url)
     validate_url = '{}/configuration/validate/'.format(base_url)
+    validate_jobs_url = '{}jobs/'.format(validate_url)
     posts = [
         {'section': 'global', 'section_name': None, 'configuration': '{"user": "haproxy", "group": "haproxy"}'},
         {'section': 'defaults', 'section_name': None, 'configuration': '{"log": "global", "mode": "http"}'},
@@ -113,6 +223,17 @@ class HaProxyConfigTest(APITestCase):
         response = self.client.get(self.generate_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_config_preview_not_modified(self):
+        for section in self.posts:
+            self.client.post(self.sections_url, section)
+        etag = self.client.get(self.generate_url)['ETag']
+        response = self.client.get(self.generate_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.post(self.sections_url, {'section': 'global', 'configuration': '{"daemon": ""}'})
+        response = self.client.get(self.generate_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_config_preview_fail(self):
         response = self.client.get(self.generate_url)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -127,5 +248,938 @@ class HaProxyConfigTest(APITestCase):
             response = self.client.get(self.validate_url)
             self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def test_config_validation_job_ok(self):
+        with tempfile.NamedTemporaryFile() as config, override_haproxy_settings(
+                HAPROXY_EXECUTABLE='non-existing', HAPROXY_VALIDATION_CMD=None, HAPROXY_CONFIG_DEV_PATH=config.name):
+            response = self.client.post(self.validate_jobs_url)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            job_url = '{}{}/'.format(self.validate_jobs_url, response.data.get('job'))
+            response = self.client.get(job_url, {'wait': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get('status'), 'finished')
+        self.assertEqual(response.data.get('status code'), status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def test_config_validation_cached(self):
+        tmp_dir = tempfile.mkdtemp()
+        executable, config, calls = [os.path.join(tmp_dir, name) for name in ('haproxy', 'haproxy.cfg', 'calls')]
+        with open(executable, 'w') as f:
+            f.write('#!/bin/sh\necho call >> {}\necho Configuration file is valid\n'.format(calls))
+        os.chmod(executable, 0o755)
+        with open(config, 'w') as f:
+            f.write('global\n    daemon \n\n')
+
+        validation_cache.clear()
+        with override_haproxy_settings(HAPROXY_VALIDATION_CMD='{} -f {} -c'.format(executable, config),
+                                       HAPROXY_CONFIG_DEV_PATH=config):
+            for _ in range(2):
+                response = self.client.get(self.validate_url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with open(calls) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        shutil.rmtree(tmp_dir)
+
+    def test_config_validation_job_not_found(self):
+        response = self.client.get('{}{}/'.format(self.validate_jobs_url, 'nonexisting'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_config_validation_job_shared_by_processes(self):
+        state_dir = tempfile.mkdtemp()
+        # Pools of two server processes share a state directory, a job runs in a first one only
+        accepting, polling = WorkerPool(1, 1, 10, state_dir), WorkerPool(1, 1, 10, state_dir)
+        job = accepting.submit(lambda: time.sleep(0.2) or {'return code': 0})
+        stored = polling.get(job.id)
+        self.assertTrue(stored.wait(5))
+        self.assertEqual(stored.to_dict(), {'job': job.id, 'status': 'finished', 'status code': 200,
+                                            'result': {'return code': 0}})
+        self.assertIsNone(polling.get('nonexisting'))
+        shutil.rmtree(state_dir)
+
+
+class HaProxyConfigBulkTest(APITestCase):
+    base_url = '/{}/haproxy/section/'.format(settings.API_VERSION_PREFIX)
+    bulk_url = '{}bulk/'.format(base_url)
+    import_url = '{}import/'.format(base_url)
+    config = (
+        'global\n'
+        '    daemon\n'
+        '# comment\n'
+        'backend bak\n'
+        '    balance roundrobin  # inline comment\n'
+        '    server web1 1.1.1.1:80 check\n'
+        '    server web2 1.1.1.2:80 check\n'
+    )
+
+    def test_bulk_create_reports_items(self):
+        sections = HaProxyConfigTest.posts + [HaProxyConfigTest.posts[0], {'section': 'backend', 'configuration': '{}'}]
+        response = self.client.post(self.bulk_url, sections, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([result.get('created') for result in response.data[:4]], [True] * 4)
+        self.assertTrue(response.data[4].get('duplicate'))
+        self.assertTrue(response.data[5].get('invalid'))
+        self.assertEqual(len(self.client.get(self.base_url).data), 4)
+
+    def test_parse_haproxy_config_ok(self):
+        sections = list(parse_haproxy_config(self.config.splitlines(True)))
+        self.assertEqual([(s['section'], s['section_name']) for s in sections], [('global', None), ('backend', 'bak')])
+        self.assertListEqual(json.loads(sections[1]['configuration']), [
+            ['balance', 'roundrobin'], ['server', 'web1 1.1.1.1:80 check'], ['server', 'web2 1.1.1.2:80 check']
+        ])
+
+    def test_parse_haproxy_config_keeps_repeated_lines(self):
+        lines = ['frontend fe\n', '    http-request deny\n', '    http-request deny\n']
+        section = next(parse_haproxy_config(lines))
+        self.assertListEqual(json.loads(section['configuration']), [['http-request', 'deny']] * 2)
+
+    def test_bulk_create_concurrent_duplicate(self):
+        self.client.post(self.base_url, HaProxyConfigTest.posts[0], format='json')
+        # Section stored by another request after a lookup of stored sections is reported as a duplicate
+        HaProxyConfigModel.objects.stored_checksums = lambda checksums: set()
+        try:
+            response = self.client.post(self.bulk_url, HaProxyConfigTest.posts[:2], format='json')
+        finally:
+            del HaProxyConfigModel.objects.stored_checksums
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data[0].get('duplicate'))
+        self.assertTrue(response.data[1].get('created'))
+        self.assertEqual(len(self.client.get(self.base_url).data), 2)
+
+    def test_import_config_file_ok(self):
+        config_file = SimpleUploadedFile('haproxy.cfg', self.config)
+        response = self.client.post(self.import_url, {'config': config_file})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 2)
+
+
+class HaProxyActiveConfigTest(APITestCase):
+    base_url = '/{}/haproxy'.format(settings.API_VERSION_PREFIX)
+    sections_url = '{}/section/'.format(base_url)
+    generate_url = '{}/configuration/generate/'.format(base_url)
+    versions = [
+        {'section': 'backend', 'section_name': 'bak', 'configuration': '{"balance": "roundrobin"}'},
+        {'section': 'backend', 'section_name': 'bak', 'configuration': '{"balance": "leastconn"}'}
+    ]
+
+    def post_versions(self):
+        return [self.client.post(self.sections_url, version).data.get('checksum') for version in self.versions]
+
+    def active_checksums(self):
+        return [section.get('checksum') for section in self.client.get(self.generate_url).data]
+
+    def test_newest_version_is_active(self):
+        checksums = self.post_versions()
+        self.assertListEqual(self.active_checksums(), [checksums[1]])
+
+    def test_touched_version_is_active(self):
+        checksums = self.post_versions()
+        self.client.put('{}{}/'.format(self.sections_url, checksums[0]))
+        self.assertListEqual(self.active_checksums(), [checksums[0]])
+
+    def test_deleted_active_version_falls_back(self):
+        checksums = self.post_versions()
+        self.client.delete('{}{}/'.format(self.sections_url, checksums[1]))
+        self.assertListEqual(self.active_checksums(), [checksums[0]])
+
+    def test_unnamed_section_type_active_once(self):
+        for configuration in ('{"maxconn": "100"}', '{"maxconn": "200"}'):
+            checksum = self.client.post(self.sections_url, {'section': 'global', 'configuration': configuration},
+                                        format='json').data.get('checksum')
+        self.assertListEqual(self.active_checksums(), [checksum])
+
+        # Section types without a name are unique, as their empty names do conflict
+        config = HaProxyConfigModel.objects.create(section='global', configuration='{"maxconn": "300"}')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            HaProxyActiveConfigModel.objects.create(section='global', section_name='', config=config)
+
+
+class HaProxyConfigCompactTest(APITestCase):
+    sections_url = '/{}/haproxy/section/'.format(settings.API_VERSION_PREFIX)
+
+    def setUp(self):
+        self.checksums = [
+            self.client.post(self.sections_url, {
+                'section': 'backend', 'section_name': 'bak', 'configuration': json.dumps({'maxconn': str(version)})
+            }).data.get('checksum') for version in range(4)
+        ]
+        # Oldest version is touched, thus active, a second oldest one is deployed
+        self.client.put('{}{}/'.format(self.sections_url, self.checksums[0]))
+        HaProxyDeploymentModel.objects.record('digest', [self.checksums[1]])
+
+    def test_compact_keeps_active_and_deployed(self):
+        report = HaProxyConfigModel.objects.compact(keep_versions=1)
+        self.assertEqual(report['deleted'], 2)
+        self.assertGreater(report['reclaimed bytes'], 0)
+        self.assertSetEqual(set(report['checksums']), set(self.checksums[2:]))
+        self.assertSetEqual(set(HaProxyConfigModel.objects.values_list('checksum', flat=True)),
+                            set(self.checksums[:2]))
+
+    def test_compact_dry_run_and_age(self):
+        report = HaProxyConfigModel.objects.compact(keep_versions=1, dry_run=True)
+        self.assertEqual(report['deleted'], 2)
+        self.assertEqual(HaProxyConfigModel.objects.count(), 4)
+
+        report = HaProxyConfigModel.objects.compact(keep_days=1)
+        self.assertEqual(report['deleted'], 0)
+
+
+class HaProxyConfigPatchTest(APITestCase):
+    sections_url = '/{}/haproxy/section/'.format(settings.API_VERSION_PREFIX)
+    backend = {'section': 'backend', 'section_name': 'bak', 'configuration': json.dumps([
+        ['balance', 'roundrobin'], ['server', 'web1 1.1.1.1:80 check'], ['server', 'web2 1.1.1.2:80 check'],
+        ['acl', 'is_api path_beg /api'],
+    ])}
+
+    def setUp(self):
+        self.checksum = self.client.post(self.sections_url, self.backend).data.get('checksum')
+
+    def patch(self, checksum, operations):
+        return self.client.patch('{}{}/'.format(self.sections_url, checksum), {'operations': operations}, format='json')
+
+    def test_patch_directives_ok(self):
+        response = self.patch(self.checksum, [
+            {'op': 'add', 'key': 'server', 'value': 'web3 1.1.1.3:80 check'},
+            {'op': 'replace', 'key': 'server', 'match': 'web1', 'value': 'web1 1.1.1.1:80 check weight 5'},
+            {'op': 'remove', 'key': 'server', 'match': 'web2'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        config = HaProxyConfigModel.objects.active().get(section='backend')
+        self.assertEqual(config.checksum, response.data.get('checksum'))
+        self.assertEqual(config.render(), (
+            'backend bak\n'
+            '    balance roundrobin\n'
+            '    server web1 1.1.1.1:80 check weight 5\n'
+            '    server web3 1.1.1.3:80 check\n'
+            '    acl is_api path_beg /api\n'
+            '\n'
+        ))
+
+        # Patched version stores a patch only, a same patch of a same version is not stored again
+        raw = HaProxyConfigModel.objects.filter(checksum=config.checksum).values_list('configuration', 'patch')[0]
+        self.assertIsNone(raw[0])
+        self.assertEqual(len(decode_json_value(raw[1])), 3)
+        response = self.patch(self.checksum, [
+            {'op': 'add', 'key': 'server', 'value': 'web3 1.1.1.3:80 check'},
+            {'op': 'replace', 'key': 'server', 'match': 'web1', 'value': 'web1 1.1.1.1:80 check weight 5'},
+            {'op': 'remove', 'key': 'server', 'match': 'web2'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(HaProxyConfigModel.objects.count(), 2)
+
+    def test_patch_invalid(self):
+        response = self.patch(self.checksum, [{'op': 'remove', 'key': 'server', 'match': 'web9'}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.patch(self.checksum, [{'op': 'move', 'key': 'server'}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.patch('0' * 32, [{'op': 'remove', 'key': 'acl'}])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_patch_chain_limit_and_delete(self):
+        checksum = self.checksum
+        with override_haproxy_settings(HAPROXY_PATCH_CHAIN_MAX=2):
+            for weight in range(3):
+                value = 'web1 1.1.1.1:80 weight {}'.format(weight)
+                checksum = self.patch(checksum, [{'op': 'replace', 'key': 'server', 'match': 'web1', 'value': value}])\
+                    .data.get('checksum')
+        config = HaProxyConfigModel.objects.get(checksum=checksum)
+        self.assertEqual(config.depth, 0)
+        self.assertIn(['server', 'web1 1.1.1.1:80 weight 2'], config.configuration)
+
+        # Deleting a patched version stores its children as whole configurations
+        child = HaProxyConfigModel.objects.get(parent__checksum=self.checksum)
+        configuration = child.configuration
+        self.client.delete('{}{}/'.format(self.sections_url, self.checksum))
+        detached = HaProxyConfigModel.objects.get(checksum=child.checksum)
+        self.assertIsNone(detached.parent_id)
+        self.assertListEqual(detached.configuration, configuration)
+
+    def test_resolve_patches_queries_levels(self):
+        checksum = self.checksum
+        for weight in range(3):
+            value = 'web1 1.1.1.1:80 weight {}'.format(weight)
+            checksum = self.patch(checksum, [{'op': 'replace', 'key': 'server', 'match': 'web1', 'value': value}])\
+                .data.get('checksum')
+
+        # A version is resolved with a query per level of its chain, versions loaded together share their parents
+        with self.assertNumQueries(4):
+            config = HaProxyConfigModel.objects.resolve_patches(HaProxyConfigModel.objects.filter(checksum=checksum))[0]
+            self.assertIn(['server', 'web1 1.1.1.1:80 weight 2'], config.configuration)
+        with self.assertNumQueries(1):
+            configs = HaProxyConfigModel.objects.resolve_patches(HaProxyConfigModel.objects.filter(section='backend'))
+            self.assertEqual(sum(len(config.configuration) for config in configs), 16)
+
+    def test_compact_keeps_patched_versions(self):
+        operation = {'op': 'add', 'key': 'acl', 'value': 'is_static path_beg /static'}
+        checksum = self.patch(self.checksum, [operation]).data.get('checksum')
+        report = HaProxyConfigModel.objects.compact(keep_versions=1)
+        self.assertEqual(report['deleted'], 0)
+        self.assertEqual(HaProxyConfigModel.objects.get(checksum=checksum).configuration[-1][1], operation['value'])
+
+
+class HaProxyConfigDiffTest(APITestCase):
+    base_url = '/{}/haproxy'.format(settings.API_VERSION_PREFIX)
+    sections_url = '{}/section/'.format(base_url)
+    diff_url = '{}/configuration/diff/'.format(base_url)
+    deployed = [
+        {'section': 'global', 'configuration': '{"daemon": ""}'},
+        {'section': 'backend', 'section_name': 'bak', 'configuration': '{"balance": "roundrobin", "mode": "http"}'},
+        {'section': 'backend', 'section_name': 'old', 'configuration': '{"balance": "roundrobin"}'},
+    ]
+
+    def setUp(self):
+        checksums = [self.client.post(self.sections_url, section).data.get('checksum') for section in self.deployed]
+        HaProxyDeploymentModel.objects.record('digest', checksums)
+        self.client.delete('{}{}/'.format(self.sections_url, checksums[2]))
+        self.client.post(self.sections_url, {
+            'section': 'backend', 'section_name': 'bak', 'configuration': '{"balance": "leastconn", "maxconn": "10"}'
+        })
+        self.client.post(self.sections_url, {'section': 'backend', 'section_name': 'new', 'configuration': '{}'})
+
+    def test_diff_lists_changed_sections(self):
+        response = self.client.get(self.diff_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['deployed']['digest'], 'digest')
+        self.assertListEqual([section['section_name'] for section in response.data['added']], ['new'])
+        self.assertListEqual([section['section_name'] for section in response.data['removed']], ['old'])
+        self.assertEqual(len(response.data['changed']), 1)
+        self.assertDictEqual(response.data['changed'][0]['directives'], {
+            'added': {'maxconn': '10'},
+            'removed': {'mode': 'http'},
+            'changed': {'balance': {'old': 'roundrobin', 'new': 'leastconn'}},
+        })
+
+    def test_diff_without_deployment(self):
+        HaProxyDeploymentModel.objects.all().delete()
+        response = self.client.get(self.diff_url)
+        self.assertIsNone(response.data['deployed'])
+        self.assertEqual(len(response.data['added']), 3)
+        self.assertListEqual(response.data['changed'], [])
+
+
+class HaProxyConfigSplitTest(APITestCase):
+    base_url = '/{}/haproxy'.format(settings.API_VERSION_PREFIX)
+    sections_url = '{}/section/'.format(base_url)
+    generate_url = '{}/configuration/generate/'.format(base_url)
+    deploy_url = '{}/configuration/deploy/'.format(base_url)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dev_dir = os.path.join(self.tmp_dir, 'dev')
+        self.prod_dir = os.path.join(self.tmp_dir, 'prod')
+        os.mkdir(self.prod_dir)
+        isolate_deployments(self, self.tmp_dir)
+        self.client.post(self.sections_url, {'section': 'global', 'configuration': '{"daemon": ""}'})
+        self.client.post(self.sections_url, {
+            'section': 'backend', 'section_name': 'bak', 'configuration': '{"balance": "roundrobin"}'
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def post(self, url):
+        with override_haproxy_settings(HAPROXY_CONFIG_SPLIT=True, HAPROXY_CONFIG_DEV_PATH=self.dev_dir,
+                                       HAPROXY_CONFIG_PATH=self.prod_dir, BASH_PATH='/bin/bash',
+                                       HAPROXY_RELOAD_CMD='true'):
+            return self.client.post(url)
+
+    def test_split_generation_writes_changed_sections(self):
+        response = self.post(self.generate_url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data.get('written'), 2)
+        files = sorted(os.listdir(self.dev_dir))
+        self.assertTrue(files[0].startswith('01-global--'))
+        self.assertTrue(files[1].startswith('08-backend-bak-'))
+
+        self.client.post(self.sections_url, {
+            'section': 'backend', 'section_name': 'bak', 'configuration': '{"balance": "leastconn"}'
+        })
+        response = self.post(self.generate_url)
+        self.assertEqual((response.data.get('written'), response.data.get('removed')), (1, 1))
+        self.assertEqual(sorted(os.listdir(self.dev_dir))[0], files[0])
+        with open(os.path.join(self.dev_dir, sorted(os.listdir(self.dev_dir))[1])) as f:
+            self.assertEqual(f.read(), 'backend bak\n    balance leastconn\n\n')
+
+    def test_split_deployment_switches_directory(self):
+        self.post(self.generate_url)
+        response = self.post(self.deploy_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data.get('reloaded'))
+        self.assertListEqual(sorted(os.listdir(self.prod_dir)), sorted(os.listdir(self.dev_dir)))
+        self.assertEqual(len(HaProxyDeploymentModel.objects.last().sections), 2)
+        # Production directory is a link to a staged directory, formerly staged ones are removed
+        self.assertTrue(os.path.islink(self.prod_dir))
+        self.assertListEqual(os.listdir(self.prod_dir + '.bak'), [])
+        self.assertEqual(len([name for name in os.listdir(self.tmp_dir) if name.startswith('.prod.')]), 2)
+
+        response = self.post(self.deploy_url)
+        self.assertFalse(response.data.get('reloaded'))
+
+
+class HaProxyConfigRenderCacheTest(APITestCase):
+    base_url = '/{}/haproxy'.format(settings.API_VERSION_PREFIX)
+    sections_url = '{}/section/'.format(base_url)
+    generate_url = '{}/configuration/generate/'.format(base_url)
+    posts = HaProxyConfigTest.posts
+
+    def setUp(self):
+        section_render_cache.clear()
+
+    def test_config_generation_writes_cached_sections(self):
+        checksums = [self.client.post(self.sections_url, section).data.get('checksum') for section in self.posts]
+        self.client.post(self.generate_url)
+        self.assertTrue(all(checksum in section_render_cache for checksum in checksums))
+
+        with open(haproxy_settings.HAPROXY_CONFIG_DEV_PATH) as f:
+            config = f.read()
+        self.assertIn('frontend nodes\n', config)
+        self.assertIn('    balance roundrobin\n', config)
+
+    def test_config_generation_timed_once(self):
+        for section in self.posts:
+            self.client.post(self.sections_url, section, format='json')
+        metrics.stage_duration.clear()
+        with override_haproxy_settings(HAPROXY_QUERY_CHUNK_SIZE=2):
+            self.client.post(self.generate_url)
+        rendered = metrics.render_metrics()
+        self.assertIn('haproxy_api_stage_duration_seconds_count{stage="generate_query"} 1\n', rendered)
+        self.assertIn('haproxy_api_stage_duration_seconds_count{stage="generate_fetch"} 2\n', rendered)
+
+    def test_section_delete_evicts_cache(self):
+        checksum = self.client.post(self.sections_url, self.posts[0]).data.get('checksum')
+        self.client.post(self.generate_url)
+        self.assertIn(checksum, section_render_cache)
+        self.client.delete('{}{}/'.format(self.sections_url, checksum))
+        self.assertNotIn(checksum, section_render_cache)
+
+
+class Base64JsonFieldTest(TestCase):
+    data = {'user': 'haproxy', 'group': 'haproxy'}
+
+    def test_storage_formats_decode_ok(self):
+        for storage_format in ('json', 'zlib', 'base64'):
+            self.assertDictEqual(decode_json_value(encode_json_value(json.dumps(self.data), storage_format)), self.data)
+
+    def test_legacy_base64_decode_ok(self):
+        legacy = 'base64:' + base64.encodestring(json.dumps(json.dumps(self.data)))
+        self.assertDictEqual(decode_json_value(legacy), self.data)
+
+    def test_configuration_decoded_on_access(self):
+        HaProxyConfigModel(section='global', configuration=json.dumps(self.data)).save()
+        config = HaProxyConfigModel.objects.get(section='global')
+        self.assertTrue(config.__dict__['configuration'].startswith('json:'))
+        self.assertDictEqual(config.configuration, self.data)
+
+
+class HaProxyConfigTestOutputTest(APITestCase):
+    generate_url = HaProxyConfigTest.generate_url
+    output = (
+        "[WARNING] 123/164812 (12345) : parsing [{0}:6] : 'option httplog' not usable\n"
+        "   | with tcp mode\n"
+        "[ALERT] 123/164812 (12345) : parsing [{0}:13] : unknown keyword 'foo' in 'backend' section\n"
+        "[ALERT] 123/164812 (12345) : Error(s) found in configuration file : {0}\n"
+        "[ALERT] 123/164812 (12345) : Fatal errors found in configuration.\n"
+    )
+
+    def test_parse_output_ok(self):
+        config_path = '/etc/haproxy/haproxy.cfg'
+        line_map = [[1, 'a' * 32], [10, 'b' * 32]]
+        diagnostics = parse_haproxy_configtest_output(self.output.format(config_path), line_map, config_path)
+        self.assertEqual(len(diagnostics), 2)
+        self.assertDictEqual(diagnostics[0], {
+            'level': 'WARNING', 'file': config_path, 'line': 6, 'checksum': 'a' * 32,
+            'message': "parsing [{}:6] : 'option httplog' not usable with tcp mode".format(config_path)
+        })
+        self.assertEqual(diagnostics[1].get('checksum'), 'b' * 32)
+
+    def test_config_generation_writes_line_map(self):
+        checksums = [self.client.post(HaProxyConfigTest.sections_url, section).data.get('checksum')
+                     for section in HaProxyConfigTest.posts]
+        self.client.post(self.generate_url)
+        line_map = read_line_map(haproxy_settings.HAPROXY_CONFIG_DEV_PATH)
+        self.assertListEqual([checksum for _, checksum in line_map], checksums)
+        self.assertListEqual([line for line, _ in line_map], [1, 5, 9, 13])
+
+        # Map of a replaced configuration is not read along with it
+        with open(haproxy_settings.HAPROXY_CONFIG_DEV_PATH, 'a') as f:
+            f.write('# edited\n')
+        self.assertIsNone(read_line_map(haproxy_settings.HAPROXY_CONFIG_DEV_PATH))
+
+    def test_config_generation_orders_same_weight(self):
+        for name in ('web', 'api', 'db'):
+            self.client.post(HaProxyConfigTest.sections_url, {
+                'section': 'backend', 'section_name': name, 'configuration': '{"balance": "roundrobin"}'
+            })
+        self.client.post(self.generate_url)
+        with open(haproxy_settings.HAPROXY_CONFIG_DEV_PATH) as f:
+            names = [line.split()[1] for line in f if line.startswith('backend ')]
+        self.assertListEqual(names, ['api', 'db', 'web'])
+
+class HaProxyConfigDeployTest(APITestCase):
+    deploy_url = '/{}/haproxy/configuration/deploy/'.format(settings.API_VERSION_PREFIX)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dev_path = os.path.join(self.tmp_dir, 'haproxy.cfg.dev')
+        self.prod_path = os.path.join(self.tmp_dir, 'haproxy.cfg')
+        self.write(self.prod_path, 'global\n    daemon \n\n')
+        isolate_deployments(self, self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def deploy(self):
+        with override_haproxy_settings(HAPROXY_CONFIG_DEV_PATH=self.dev_path, HAPROXY_CONFIG_PATH=self.prod_path,
+                                       BASH_PATH='/bin/bash', HAPROXY_RELOAD_CMD='true'):
+            return self.client.post(self.deploy_url)
+
+    def test_deploy_unchanged_skips_reload(self):
+        self.write(self.dev_path, self.read(self.prod_path))
+        response = self.deploy()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data.get('reloaded'))
+        self.assertFalse(os.path.exists(self.prod_path + '.bak'))
+
+    def test_deploy_changed_replaces_config(self):
+        original = self.read(self.prod_path)
+        self.write(self.dev_path, 'global\n    daemon \n    maxconn 4096\n\n')
+        response = self.deploy()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data.get('reloaded'))
+        self.assertEqual(self.read(self.prod_path), self.read(self.dev_path))
+        self.assertEqual(self.read(self.prod_path + '.bak'), original)
+        self.assertEqual(HaProxyDeploymentModel.objects.last().digest, response.data.get('digest'))
+
+    def roll_back(self, digest):
+        url = '/{0}/haproxy/configuration/snapshots/{1}/rollback/'.format(settings.API_VERSION_PREFIX, digest)
+        with override_haproxy_settings(HAPROXY_CONFIG_PATH=self.prod_path, BASH_PATH='/bin/bash',
+                                       HAPROXY_RELOAD_CMD='true',
+                                       HAPROXY_SNAPSHOT_RESTORE_PATH=os.path.join(self.tmp_dir, 'rollback.cfg')):
+            return self.client.post(url)
+
+    def test_deploy_stores_snapshot_once(self):
+        digests = []
+        for content in ('global\n    maxconn 100\n\n', 'global\n    maxconn 200\n\n', 'global\n    maxconn 100\n\n'):
+            self.write(self.dev_path, content)
+            digests.append(self.deploy().data['digest'])
+
+        self.assertEqual(digests[0], digests[2])
+        self.assertEqual(HaProxySnapshotModel.objects.count(), 2)
+        snapshot = HaProxySnapshotModel.objects.get(digest=digests[0])
+        self.assertListEqual(snapshot.content, [['', 'global\n    maxconn 100\n\n']])
+        raw = HaProxySnapshotModel.objects.filter(pk=snapshot.pk).values_list('content', flat=True)[0]
+        self.assertTrue(raw.startswith('zlib:'))
+
+        with override_haproxy_settings(HAPROXY_SNAPSHOTS_KEPT=1):
+            self.assertEqual(HaProxySnapshotModel.objects.prune(), 1)
+        self.assertEqual(HaProxySnapshotModel.objects.get().digest, digests[2])
+
+    def test_deploy_snapshot_failure_logged(self):
+        metrics.snapshot_failures.clear()
+        # Configuration not encoded in UTF-8 cannot be serialized into a snapshot
+        self.write(self.dev_path, 'global\n    # caf\xe9\n\n')
+        response = self.deploy()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(HaProxySnapshotModel.objects.count(), 0)
+        self.assertEqual(HaProxyDeploymentModel.objects.last().digest, response.data['digest'])
+        self.assertIn('haproxy_api_snapshot_failures_total 1\n', metrics.render_metrics())
+
+    def test_roll_back_restores_snapshot(self):
+        self.write(self.dev_path, 'global\n    maxconn 100\n\n')
+        digest = self.deploy().data['digest']
+        self.write(self.dev_path, 'global\n    maxconn 200\n\n')
+        self.deploy()
+
+        response = self.roll_back(digest)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data.get('reloaded'))
+        self.assertEqual(response.data.get('snapshot'), digest)
+        self.assertEqual(self.read(self.prod_path), 'global\n    maxconn 100\n\n')
+        self.assertEqual(self.read(self.dev_path), 'global\n    maxconn 200\n\n')
+        self.assertEqual(HaProxyDeploymentModel.objects.last().digest, digest)
+
+        response = self.client.get('/{}/haproxy/configuration/snapshots/'.format(settings.API_VERSION_PREFIX))
+        self.assertListEqual([snapshot['deployed'] for snapshot in response.data], [True, False])
+
+    def test_roll_back_missing_snapshot(self):
+        response = self.roll_back('0' * 32)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def deploy_targets(self, reload_cmds, **kwargs):
+        targets = []
+        for name, reload_cmd in reload_cmds:
+            config_path = os.path.join(self.tmp_dir, '{}.cfg'.format(name))
+            self.write(config_path, self.read(self.prod_path))
+            targets.append({'name': name, 'config_path': config_path, 'reload_cmd': reload_cmd})
+
+        with override_haproxy_settings(HAPROXY_CONFIG_DEV_PATH=self.dev_path, HAPROXY_DEPLOY_TARGETS=targets,
+                                       BASH_PATH='/bin/bash', **kwargs):
+            return self.client.post(self.deploy_url)
+
+    def test_deploy_targets_concurrently(self):
+        self.write(self.dev_path, 'global\n    daemon \n    maxconn 4096\n\n')
+        start = time.time()
+        response = self.deploy_targets([('public', 'sleep 1'), ('private', 'sleep 1')], HAPROXY_DEPLOY_RELOADS_MAX=2)
+        self.assertLess(time.time() - start, 1.9)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual([target['target'] for target in response.data['targets']], ['public', 'private'])
+        self.assertTrue(all(target['reloaded'] for target in response.data['targets']))
+        self.assertEqual(self.read(os.path.join(self.tmp_dir, 'private.cfg')), self.read(self.dev_path))
+
+    def test_deploy_targets_failure(self):
+        self.write(self.dev_path, 'global\n    daemon \n    maxconn 4096\n\n')
+        response = self.deploy_targets([('public', 'echo failed; false'), ('private', 'true')])
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        public, private = response.data['targets']
+        self.assertEqual(public['return code'], 1)
+        self.assertEqual(public['error'], 'failed')
+        self.assertTrue(private['reloaded'])
+
+    def test_deploy_targets_fail_fast(self):
+        self.write(self.dev_path, 'global\n    daemon \n    maxconn 4096\n\n')
+        # Single worker deploys targets in order, thus a second one is not started before a first one fails
+        workers, deploy.deploy_workers = deploy.deploy_workers, WorkerPool(1, 0, 10)
+        try:
+            response = self.deploy_targets([('public', 'false'), ('private', 'true')], HAPROXY_DEPLOY_FAIL_FAST=True)
+        finally:
+            deploy.deploy_workers = workers
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        public, private = response.data['targets']
+        self.assertEqual(public['return code'], 1)
+        self.assertTrue(private['skipped'])
+
+    def test_deploy_requests_coalesced(self):
+        deployments = []
+
+        def deploy_configuration():
+            deployments.append(len(deployments) + 1)
+            time.sleep(0.3)
+            return {'deployment': len(deployments)}
+
+        results = []
+        threads = [Thread(target=lambda: results.append(deploy.coalesce_deployment(deploy_configuration)))
+                   for _ in range(5)]
+        with override_haproxy_settings(HAPROXY_DEPLOY_DEBOUNCE=0.2):
+            for thread in threads:
+                thread.start()
+                time.sleep(0.02)
+            for thread in threads:
+                thread.join()
+
+        self.assertListEqual(deployments, [1])
+        self.assertListEqual(results, [{'deployment': 1}] * 5)
+
+    def stub_haproxy(self, fail=False):
+        executable = os.path.join(self.tmp_dir, 'haproxy')
+        self.write(executable, STUB_DAEMON.format(exit_code=1 if fail else 0))
+        os.chmod(executable, 0o755)
+        return executable
+
+    def deploy_seamless(self, executable):
+        pid_path = os.path.join(self.tmp_dir, 'haproxy.pid')
+        with override_haproxy_settings(HAPROXY_CONFIG_DEV_PATH=self.dev_path, HAPROXY_CONFIG_PATH=self.prod_path,
+                                       HAPROXY_EXECUTABLE=executable, HAPROXY_PID_FILE_PATH=pid_path,
+                                       HAPROXY_RELOAD_MODE='seamless', HAPROXY_RELOAD_TIMEOUT=5):
+            return self.client.post(self.deploy_url)
+
+    def test_deploy_seamless_reload(self):
+        self.write(self.dev_path, 'global\n    daemon \n    maxconn 4096\n\n')
+        response = self.deploy_seamless(self.stub_haproxy())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        target = response.data['targets'][0]
+        self.assertEqual(target['mode'], 'seamless')
+        self.assertEqual(len(target['pids']), 1)
+        self.assertGreater(target['reload seconds'], 0)
+        os.kill(target['pids'][0], signal.SIGTERM)
+
+    def test_deploy_failed_reload_rolls_back(self):
+        original = self.read(self.prod_path)
+        self.write(self.dev_path, 'global\n    daemon \n    maxconn 4096\n\n')
+        response = self.deploy_seamless(self.stub_haproxy(fail=True))
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(response.data['targets'][0]['error'], '[ALERT] configuration is broken')
+        self.assertFalse(response.data['targets'][0]['rolled back'])
+        self.assertEqual(self.read(self.prod_path), original)
+
+    def test_deploy_failed_reload_keeps_running_process(self):
+        self.write(self.dev_path, 'global\n    daemon \n    maxconn 4096\n\n')
+        pids = self.deploy_seamless(self.stub_haproxy()).data['targets'][0]['pids']
+        self.write(self.dev_path, 'global\n    daemon \n    maxconn 2048\n\n')
+        response = self.deploy_seamless(self.stub_haproxy(fail=True))
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertTrue(response.data['targets'][0]['rolled back'])
+        self.assertEqual(self.read(self.prod_path), 'global\n    daemon \n    maxconn 4096\n\n')
+        os.kill(pids[0], signal.SIGTERM)
+
+    def test_deploy_master_worker_without_worker_pid(self):
+        original = self.read(self.prod_path)
+        pid_path = os.path.join(self.tmp_dir, 'haproxy.pid')
+        self.write(pid_path, str(os.getpid()))
+        self.write(self.dev_path, 'global\n    daemon \n    maxconn 4096\n\n')
+        with override_haproxy_settings(HAPROXY_CONFIG_DEV_PATH=self.dev_path, HAPROXY_CONFIG_PATH=self.prod_path,
+                                       HAPROXY_PID_FILE_PATH=pid_path, HAPROXY_RELOAD_MODE='master-worker',
+                                       HAPROXY_RUNTIME_SOCKET_PATH=os.path.join(self.tmp_dir, 'haproxy.sock')):
+            response = self.client.post(self.deploy_url)
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertIn('does not report a worker pid', response.data['targets'][0]['error'])
+        self.assertTrue(response.data['targets'][0]['rolled back'])
+        self.assertEqual(self.read(self.prod_path), original)
+
+    def test_deploy_metrics(self):
+        metrics_url = '/{}/haproxy/metrics/'.format(settings.API_VERSION_PREFIX)
+        for metric in metrics.METRICS:
+            metric.clear()
+        self.write(self.dev_path, 'global\n    daemon \n    maxconn 4096\n\n')
+        self.deploy()
+        self.deploy()
+
+        response = self.client.get(metrics_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('haproxy_api_reloads_total 1\n', response.content)
+        self.assertIn('haproxy_api_reloads_skipped_total 1\n', response.content)
+        self.assertIn('haproxy_api_stage_duration_seconds_count{stage="deploy_digest"} 2\n', response.content)
+        self.assertIn('haproxy_api_stage_duration_seconds_bucket{stage="deploy_copy",le="+Inf"} 1\n', response.content)
+
+        with override_haproxy_settings(HAPROXY_METRICS_ENABLED=False):
+            self.deploy()
+            response = self.client.get(metrics_url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn('haproxy_api_reloads_skipped_total 1\n', metrics.render_metrics())
+
+
+class HaProxyRuntimeServerTest(APITestCase):
+    base_url = '/{}/haproxy'.format(settings.API_VERSION_PREFIX)
+    sections_url = '{}/section/'.format(base_url)
+    runtime_url = '{}/runtime/server/bak/web1/'.format(base_url)
+    backend = {'section': 'backend', 'section_name': 'bak', 'configuration': '{"server": "web1 1.1.1.1:80 weight 10"}'}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'haproxy.sock')
+        self.client.post(self.sections_url, self.backend)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_set_weight_ok(self):
+        runtime = FakeRuntimeSocket(self.socket_path, ['\n'])
+        with override_haproxy_settings(HAPROXY_RUNTIME_SOCKET_PATH=self.socket_path):
+            response = self.client.post(self.runtime_url, {'action': 'weight', 'value': 50})
+        runtime.close()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(runtime.commands, ['set weight bak/web1 50'])
+        config = HaProxyConfigModel.objects.active().get(section='backend')
+        self.assertEqual(config.checksum, response.data.get('checksum'))
+        self.assertListEqual(config.configuration, [['server', 'web1 1.1.1.1:80 weight 50']])
+        self.assertIsNotNone(config.parent_id)
+
+    def test_refused_change_not_recorded(self):
+        runtime = FakeRuntimeSocket(self.socket_path, ['No such server.\n'])
+        with override_haproxy_settings(HAPROXY_RUNTIME_SOCKET_PATH=self.socket_path):
+            response = self.client.post(self.runtime_url, {'action': 'disable'})
+        runtime.close()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(HaProxyConfigModel.objects.count(), 1)
+
+    def test_add_server_command_injection_refused(self):
+        runtime = FakeRuntimeSocket(self.socket_path, ['\n'])
+        with override_haproxy_settings(HAPROXY_RUNTIME_SOCKET_PATH=self.socket_path):
+            for value in ('1.2.3.4:80; shutdown sessions server bak/web1', '1.2.3.4:80\nshutdown frontend fe',
+                          'check 1.2.3.4:80'):
+                response = self.client.post(self.runtime_url, {'action': 'add', 'value': value})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        runtime.close()
+        self.assertListEqual(runtime.commands, [])
+        self.assertEqual(HaProxyConfigModel.objects.count(), 1)
+
+    def test_runtime_socket_not_available(self):
+        with override_haproxy_settings(HAPROXY_RUNTIME_SOCKET_PATH=self.socket_path):
+            response = self.client.post(self.runtime_url, {'action': 'enable'})
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def test_stats_snapshot_shared(self):
+        stats = (
+            '# pxname,svname,scur,status,\n'
+            'bak,web1,3,UP,\n'
+            'bak,BACKEND,3,UP,\n'
+            'stats,FRONTEND,0,OPEN,\n'
+        )
+        cache.delete(STATS_CACHE_KEY)
+        runtime = FakeRuntimeSocket(self.socket_path, [stats])
+        with override_haproxy_settings(HAPROXY_RUNTIME_SOCKET_PATH=self.socket_path):
+            responses = [self.client.get('{}/runtime/stats/'.format(self.base_url)) for _ in range(2)]
+        runtime.close()
+        self.assertListEqual(runtime.commands, ['show stat'])
+        self.assertEqual(responses[0].data, responses[1].data)
+
+        rows = responses[0].data.get('stats')
+        self.assertEqual(len(rows), 3)
+        self.assertDictContainsSubset({'pxname': 'bak', 'svname': 'web1', 'scur': '3', 'section': 'backend'}, rows[0])
+        self.assertNotIn('checksum', rows[2])
+
+    def test_stats_first_snapshot_waited_for(self):
+        cache.delete(STATS_CACHE_KEY)
+        cache.set(STATS_LOCK_KEY, True)
+        snapshot = {'time': time.time(), 'rows': []}
+        # Worker holding a lock stores a first snapshot, others do not read a socket meanwhile
+        writer = Thread(target=lambda: time.sleep(0.2) or cache.set(STATS_CACHE_KEY, snapshot))
+        writer.start()
+        with override_haproxy_settings(HAPROXY_RUNTIME_SOCKET_PATH=self.socket_path):
+            self.assertEqual(get_stats_snapshot(), snapshot)
+        writer.join()
+        cache.delete(STATS_LOCK_KEY)
+
+
+class HaProxyLogStatsTest(APITestCase):
+    base_url = '/{}/haproxy'.format(settings.API_VERSION_PREFIX)
+    logs_url = '{}/logs/stats/'.format(base_url)
+    line = ('Feb  6 12:14:14 localhost haproxy[14389]: 10.0.1.2:33317 [06/Feb/2009:12:14:14.655] http-in~ bak/{server} '
+            '10/0/30/{tr}/{tt} {status} 2750 - - ---- 1/1/1/1/0 0/0 "GET /index.html HTTP/1.1"\n')
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp_dir, 'haproxy.log')
+        self.state_path = os.path.join(self.tmp_dir, 'haproxy-log.state')
+        self.checksum = self.client.post('{}/section/'.format(self.base_url), {
+            'section': 'backend', 'section_name': 'bak', 'configuration': '{"balance": "roundrobin"}'
+        }).data.get('checksum')
+        HaProxyDeploymentModel.objects.record('digest', [self.checksum])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def append(self, lines):
+        with open(self.log_path, 'a') as f:
+            f.write(lines)
+
+    def get(self, **params):
+        with override_haproxy_settings(HAPROXY_LOG_PATH=self.log_path, HAPROXY_LOG_STATE_PATH=self.state_path):
+            return self.client.get(self.logs_url, params)
+
+    def test_log_stats_incremental(self):
+        self.append(''.join(self.line.format(server='web1', tr=tt - 40, tt=tt, status=200) for tt in range(41, 141)))
+        self.append(self.line.format(server='web2', tr=-1, tt=5000, status=503) + 'incomplete line')
+
+        response = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['pending bytes'], len('incomplete line'))
+        rows = dict(((row['type'], row['name']), row) for row in response.data['stats'])
+        self.assertSetEqual(set(rows), {('frontend', 'http-in'), ('backend', 'bak'), ('server', 'bak/web1'),
+                                        ('server', 'bak/web2')})
+
+        backend = rows[('backend', 'bak')]
+        self.assertEqual(backend['requests'], 101)
+        self.assertEqual(backend['bytes'], 101 * 2750)
+        self.assertDictEqual(backend['status'], {'2xx': 100, '5xx': 1})
+        self.assertEqual(backend['checksum'], self.checksum)
+        self.assertEqual(rows[('server', 'bak/web1')]['checksum'], self.checksum)
+        self.assertNotIn('checksum', rows[('frontend', 'http-in')])
+        self.assertEqual(backend['timers']['Tr']['count'], 100)
+        self.assertAlmostEqual(backend['timers']['Tt']['p50'], 91, delta=91 * 0.02)
+
+        # Only lines appended since a previous scan are counted
+        self.append(' completed\n' + self.line.format(server='web1', tr=10, tt=50, status=200))
+        response = self.get(type='backend')
+        self.assertEqual(response.data['stats'][0]['requests'], 102)
+        self.assertEqual(response.data['unparsed lines'], 1)
+        self.assertEqual(response.data['pending bytes'], 0)
+
+    def test_log_stats_follow_deployment(self):
+        self.append(self.line.format(server='web1', tr=10, tt=50, status=200))
+        self.assertEqual(self.get().data['digest'], 'digest')
+
+        # Activated version is not joined, until it is deployed, then counting starts anew
+        checksum = self.client.post('{}/section/'.format(self.base_url), {
+            'section': 'backend', 'section_name': 'bak', 'configuration': '{"balance": "leastconn"}'
+        }).data.get('checksum')
+        self.append(self.line.format(server='web1', tr=10, tt=50, status=200))
+        response = self.get(type='backend')
+        self.assertEqual(response.data['stats'][0]['requests'], 2)
+        self.assertEqual(response.data['stats'][0]['checksum'], self.checksum)
+
+        HaProxyDeploymentModel.objects.record('digest2', [checksum])
+        self.append(self.line.format(server='web1', tr=10, tt=50, status=200))
+        response = self.get(type='backend')
+        self.assertEqual(response.data['digest'], 'digest2')
+        self.assertListEqual(response.data['stats'], [])
+        self.append(self.line.format(server='web1', tr=10, tt=50, status=200))
+        response = self.get(type='backend')
+        self.assertEqual(response.data['stats'][0]['requests'], 1)
+        self.assertEqual(response.data['stats'][0]['checksum'], checksum)
+
+    def test_log_stats_reset_and_missing_log(self):
+        self.assertEqual(self.get().status_code, status.HTTP_404_NOT_FOUND)
+
+        self.append(self.line.format(server='web1', tr=10, tt=50, status=200))
+        with override_haproxy_settings(HAPROXY_LOG_PATH=self.log_path, HAPROXY_LOG_STATE_PATH=self.state_path):
+            response = self.client.delete(self.logs_url)
+        self.assertEqual(response.data['offset'], os.path.getsize(self.log_path))
+        self.assertListEqual(self.get().data['stats'], [])
+
+
+class HaProxyCommandTest(TestCase):
+    sections = [
+        {'section': 'global', 'configuration': {'daemon': ''}},
+        {'section': 'backend', 'section_name': 'bak', 'configuration': [['server', 'web1 1.1.1.1:80 check']]},
+    ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dev_path = os.path.join(self.tmp_dir, 'haproxy.cfg.dev')
+        self.prod_path = os.path.join(self.tmp_dir, 'haproxy.cfg')
+        # Production configuration is expected to exist, as HAProxy is installed along with one
+        open(self.prod_path, 'w').close()
+        isolate_deployments(self, self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def call(self, name, *args, **options):
+        output = StringIO()
+        call_command(name, *args, stdout=output, **options)
+        return json.loads(output.getvalue())
+
+    def test_load_generate_validate_deploy(self):
+        sections_path = os.path.join(self.tmp_dir, 'sections.json')
+        with open(sections_path, 'w') as f:
+            json.dump({'sections': self.sections}, f)
+        self.assertDictEqual(self.call('haproxy_load', sections_path), {'created': 2, 'duplicate': 0, 'invalid': 0})
+
+        with override_haproxy_settings(HAPROXY_CONFIG_DEV_PATH=self.dev_path, HAPROXY_CONFIG_PATH=self.prod_path,
+                                       HAPROXY_VALIDATION_CMD='true', BASH_PATH='/bin/bash', HAPROXY_RELOAD_CMD='true'):
+            self.assertTrue(self.call('haproxy_generate').get('created'))
+            self.assertEqual(self.call('haproxy_validate').get('return code'), 0)
+            self.assertEqual(self.call('haproxy_deploy').get('return code'), 0)
+
+        with open(self.prod_path) as f:
+            self.assertIn('    server web1 1.1.1.1:80 check\n', f.read())
+        self.assertEqual(HaProxyDeploymentModel.objects.count(), 1)
+
+    def test_load_stdin_and_errors(self):
+        stdin = sys.stdin
+        sys.stdin = StringIO(json.dumps(self.sections + [{'section': 'backend', 'configuration': {}}]))
+        try:
+            self.assertRaises(CommandError, self.call, 'haproxy_load')
+        finally:
+            sys.stdin = stdin
+        self.assertEqual(HaProxyConfigModel.objects.count(), 2)
+
+        with override_haproxy_settings(HAPROXY_CONFIG_DEV_PATH=self.dev_path):
+            self.assertRaises(CommandError, self.call, 'haproxy_deploy')
+
 
+class HaProxyBenchmarkTest(TestCase):
 
+    def test_benchmark_stages(self):
+        results = run_benchmark([2], 1, 1)
+        stages = results['sizes']['2']
+        for stage in ('build_post', 'generate_post_cold', 'generate_post_warm', 'validate_cold', 'deploy_changed'):
+            self.assertEqual(stages[stage]['runs'], 1)
+            self.assertGreaterEqual(stages[stage]['max'], stages[stage]['min'])
+        self.assertEqual(stages['dataset']['rows'], 5)
+        json.dumps(results)
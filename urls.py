@@ -3,8 +3,19 @@ import views
 
 urlpatterns = [
     url(r'^section/$', views.HaProxyConfigBuildView.as_view()),
+    url(r'^section/bulk/$', views.HaProxyConfigBulkView.as_view()),
+    url(r'^section/import/$', views.HaProxyConfigImportView.as_view()),
     url(r'^section/(?P<checksum>\w+)/$', views.HaProxyConfigBuildView.as_view()),
     url(r'^configuration/generate/$', views.HaProxyConfigGenerateView.as_view()),
+    url(r'^configuration/diff/$', views.HaProxyConfigDiffView.as_view()),
     url(r'^configuration/validate/$', views.HaProxyConfigValidationView.as_view()),
-    url(r'^configuration/deploy/$', views.HaProxyConfigDeployView.as_view())
+    url(r'^configuration/validate/jobs/$', views.HaProxyConfigValidationJobView.as_view()),
+    url(r'^configuration/validate/jobs/(?P<job_id>\w+)/$', views.HaProxyConfigValidationJobView.as_view()),
+    url(r'^configuration/deploy/$', views.HaProxyConfigDeployView.as_view()),
+    url(r'^configuration/snapshots/$', views.HaProxySnapshotView.as_view()),
+    url(r'^configuration/snapshots/(?P<digest>\w+)/rollback/$', views.HaProxySnapshotRollbackView.as_view()),
+    url(r'^runtime/stats/$', views.HaProxyRuntimeStatsView.as_view()),
+    url(r'^logs/stats/$', views.HaProxyLogStatsView.as_view()),
+    url(r'^runtime/server/(?P<backend>[\w.-]+)/(?P<server>[\w.-]+)/$', views.HaProxyRuntimeServerView.as_view()),
+    url(r'^metrics/$', views.HaProxyMetricsView.as_view())
 ]
@@ -1,16 +1,29 @@
 from rest_framework.views import APIView
-from models import HaProxyConfigModel
+from models import HaProxyConfigModel, HaProxyDeploymentModel, HaProxySnapshotModel
 from serializers import HaProxyConfigModelSerializer
 from rest_framework.response import Response
-from rest_framework.status import HTTP_201_CREATED
+from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_304_NOT_MODIFIED
+from rest_framework.exceptions import Throttled
+from rest_framework.utils.encoders import JSONEncoder
 from api_core import exceptions as core_exceptions
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import timezone
 from operator import methodcaller
-from helpers import parse_haproxy_configtest_output, raise_500_error
-from os.path import isfile
-import shutil
-import subprocess
+from helpers import raise_500_error, chunked, build_section, parse_haproxy_config, encode_cursor, decode_cursor, \
+    iter_sections, section_etag, configuration_etag, etag_matches, diff_directives, proxy_sections, \
+    deployed_proxy_sections
+from services import generate_configuration, validate_configuration, deploy_generated_configuration, load_sections, \
+    roll_back_configuration
+from directives import server_operations
+from runtime import RUNTIME_SERVER_COMMANDS, clean_server_value, apply_server_change, get_stats_snapshot
+from cache import section_render_cache
+from jobs import validation_jobs
+from logs import scan_log
+from Queue import Full
+import metrics
+import socket
+import errno
 import settings
 import json
 
@@ -26,24 +39,77 @@ class HaProxyConfigBuildView(APIView):
 
     def get(self, request, checksum=None):
         """
-        Method, responding to a GET request, lists a specific configuration section stored in a database whenever
-        an unique checksum string is provided. Otherwise list of all configuration sections is returned in a response.
+        Method, responding to a GET request, lists a specific configuration section stored in a database whenever an
+        unique checksum string is provided. A section is sent with an ETag and a request with a matching If-None-Match
+        header is answered with a 304 status without reading a section itself. Otherwise list of all configuration
+        sections is returned in a response. A list may be filtered by section, section_name and active query parameters.
+        When a limit or a cursor query parameter is present, a page of sections is returned together with a cursor of a
+        next page, ordered by a create time and a checksum. When a stream query parameter is present, whole list is
+        streamed in chunks instead.
         :param request: request data
         :param checksum: an unique identifier of a configuration section
         :return: rest_framework.response.Response containing serialized data
         """
         if checksum is not None:
+            create_time = HaProxyConfigModel.objects.filter(checksum=checksum).values_list('create_time', flat=True)
+            if not create_time:
+                raise core_exceptions.DoesNotExistException()
+
+            etag = section_etag(checksum, create_time[0])
+            if etag_matches(request, etag):
+                return Response(status=HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
             try:
                 config = HaProxyConfigModel.objects.get(checksum=checksum)
                 serializer = HaProxyConfigModelSerializer(config)
             except HaProxyConfigModel.DoesNotExist:
                 raise core_exceptions.DoesNotExistException()
-        else:
-            config = HaProxyConfigModel.objects.all()
-            serializer = HaProxyConfigModelSerializer(config, many=True)
+            return Response(serializer.data, headers={'ETag': etag})
+
+        params = request.QUERY_PARAMS
+        config = HaProxyConfigModel.objects.all()
+        if 'section' in params:
+            config = config.filter(section=params['section'])
+        if 'section_name' in params:
+            config = config.filter(section_name=params['section_name'])
+        if params.get('active', '').lower() in ('1', 'true'):
+            config = config.active()
+
+        if 'stream' in params:
+            return StreamingHttpResponse(self.stream(config), content_type='application/json')
+
+        if 'limit' in params or 'cursor' in params:
+            try:
+                limit = min(int(params.get('limit', settings.HAPROXY_PAGE_SIZE)), settings.HAPROXY_PAGE_SIZE_MAX)
+                if 'cursor' in params:
+                    config = config.after(*decode_cursor(params['cursor']))
+            except ValueError:
+                raise core_exceptions.InvalidRequestException()
+            if limit < 1:
+                raise core_exceptions.InvalidRequestException()
+
+            page = HaProxyConfigModel.objects.resolve_patches(config.order_by('create_time', 'checksum')[:limit + 1])
+            cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+            serializer = HaProxyConfigModelSerializer(page[:limit], many=True)
+            return Response({'results': serializer.data, 'next': cursor})
 
+        serializer = HaProxyConfigModelSerializer(HaProxyConfigModel.objects.resolve_patches(config), many=True)
         return Response(serializer.data)
 
+    @staticmethod
+    def stream(config):
+        """
+        Generator serializes sections into a JSON list one by one, thus a response of any size is sent with a constant
+        memory usage.
+        :param config: queryset of sections
+        :return: generator of JSON chunks
+        """
+        separator = '['
+        for section in iter_sections(config, settings.HAPROXY_PAGE_SIZE_MAX):
+            yield separator + json.dumps(HaProxyConfigModelSerializer(section).data, cls=JSONEncoder)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
+
     def post(self, request):
         """
         Method is responding to a POST request, which in turn creates a new configuration section, after successful pass
@@ -51,30 +117,23 @@ class HaProxyConfigBuildView(APIView):
         :param request: request data
         :return: rest_framework.response.Response containing serialized data
         """
-        section = request.DATA.get('section', None)
-        section_name = request.DATA.get('section_name', None)
-        configuration = request.DATA.get('configuration', None)
-
-        named_sections = settings.HAPROXY_CONFIG_NAMED_SECTIONS
-        if section in named_sections and not all([x is not None for x in [section, section_name, configuration]]):
-            raise core_exceptions.InvalidRequestException()
-        else:
-            try:
-                json.loads(configuration)  # Should raise ValueError if configuration data are invalid
-                config = HaProxyConfigModel(section=section, section_name=section_name, configuration=configuration)
+        try:
+            config = build_section(request.DATA)
+            with transaction.atomic():
                 config.save()
-            except IntegrityError:
-                raise core_exceptions.DuplicateEntryException()
-            except ValueError:
-                raise core_exceptions.InvalidRequestException()
+                config.activate()
+        except IntegrityError:
+            raise core_exceptions.DuplicateEntryException()
+        except ValueError:
+            raise core_exceptions.InvalidRequestException()
 
         return Response({'checksum': config.checksum}, status=HTTP_201_CREATED)
 
     def put(self, request, checksum=None):
         """
         Method, responding to a PUT request, modifies existing section, updates its create_time field and sets
-        a modify_time key to meta field of a section. Updated section will be selected into configuration file
-        generation.
+        a modify_time key to meta field of a section. Updated section becomes an active version of its section type,
+        thus it will be selected into configuration file generation.
         :param request: request data
         :return: rest_framework.response.Response containing serialized data
         """
@@ -82,18 +141,53 @@ class HaProxyConfigBuildView(APIView):
             raise core_exceptions.InvalidRequestException()
 
         try:
-            config = HaProxyConfigModel.objects.get(checksum=checksum)
-            meta = config.meta
-            meta[unicode('modify_time')] = unicode(str(timezone.now()))
-            HaProxyConfigModel.objects.filter(checksum=checksum).update(meta=json.dumps(meta))
+            with transaction.atomic():
+                config = HaProxyConfigModel.objects.get(checksum=checksum)
+                now = timezone.now()
+                meta = config.meta
+                meta[unicode('modify_time')] = unicode(str(now))
+                HaProxyConfigModel.objects.filter(checksum=checksum).update(meta=json.dumps(meta), create_time=now)
+                config.activate()
         except HaProxyConfigModel.DoesNotExist:
             raise core_exceptions.DoesNotExistException()
 
         return Response({'checksum': config.checksum})
 
+    def patch(self, request, checksum=None):
+        """
+        Method, responding to a PATCH request, creates a new version of a section by adding, removing or replacing
+        individual directives, thus a server is added to a large backend without posting a whole section again.
+        A request contains a list of operations, either as a whole body or under an operations key, see
+        directives.clean_operations. A new version is stored as a patch of a given one and becomes an active version of
+        its section type.
+        :param request: request data
+        :param checksum: an unique identifier of a patched configuration section
+        :return: rest_framework.response.Response containing serialized data
+        """
+        if not checksum:
+            raise core_exceptions.InvalidRequestException()
+
+        operations = request.DATA
+        if isinstance(operations, dict):
+            operations = operations.get('operations', None)
+
+        try:
+            with transaction.atomic():
+                config = HaProxyConfigModel.objects.get(checksum=checksum)
+                version, created = HaProxyConfigModel.objects.patch(config, operations)
+                version.activate()
+        except HaProxyConfigModel.DoesNotExist:
+            raise core_exceptions.DoesNotExistException()
+        except ValueError as e:
+            raise core_exceptions.InvalidRequestException(detail=str(e))
+
+        return Response({'checksum': version.checksum}, status=HTTP_201_CREATED if created else HTTP_200_OK)
+
     def delete(self, request, checksum=None):
         """
-        Method, responding to a DELETE request, deletes existing section.
+        Method, responding to a DELETE request, deletes existing section. When deleted section was active, a newest
+        remaining version of its section type becomes active instead. Versions patching a deleted section are stored as
+        whole configurations first.
         :param request: request data
         :return: rest_framework.response.Response containing serialized data
         """
@@ -101,68 +195,165 @@ class HaProxyConfigBuildView(APIView):
             raise core_exceptions.InvalidRequestException()
 
         try:
-            HaProxyConfigModel.objects.filter(checksum=checksum).delete()
+            with transaction.atomic():
+                for config in HaProxyConfigModel.objects.filter(checksum=checksum):
+                    HaProxyConfigModel.objects.detach(config)
+                    config.delete()
+                    HaProxyConfigModel.objects.refresh_active(config.section, config.section_name)
+            section_render_cache.evict(checksum)
         except HaProxyConfigModel.DoesNotExist:
             raise core_exceptions.DoesNotExistException()
 
         return Response({'deleted': True})
 
+class HaProxyConfigBulkView(APIView):
+    """
+    An API view handling a bulk build of a HAProxy configuration. Many sections are validated and stored within a single
+    request and a single transaction, which makes onboarding of a large configuration a matter of one call.
+    """
+
+    def post(self, request):
+        """
+        Method, responding to a POST request, creates many configuration sections at once. A request contains a list of
+        sections, either as a whole body or under a sections key, each of them in a same form as posted to
+        HaProxyConfigBuildView. Invalid and duplicate sections are reported per item and do not abort the rest.
+        :param request: request data
+        :return: rest_framework.response.Response containing serialized data
+        """
+        sections = request.DATA
+        if isinstance(sections, dict):
+            sections = sections.get('sections', None)
+        if not isinstance(sections, list):
+            raise core_exceptions.InvalidRequestException()
+
+        return Response(load_sections(sections), status=HTTP_201_CREATED)
+
+
+class HaProxyConfigImportView(APIView):
+    """
+    An API view importing an existing HAProxy configuration file. A file is parsed into sections while it is being read
+    and parsed sections are stored in batches, thus a configuration of any size is imported with a constant memory.
+    """
+
+    def post(self, request):
+        """
+        Method, responding to a POST request, imports a configuration file uploaded as a config field. Whole import is
+        performed in a single transaction, sections already stored are reported as duplicates.
+        :param request: request data
+        :return: rest_framework.response.Response containing serialized data
+        """
+        config_file = request.FILES.get('config', None)
+        if config_file is None:
+            raise core_exceptions.InvalidRequestException()
+
+        results = []
+        try:
+            with transaction.atomic():
+                for batch in chunked(parse_haproxy_config(config_file), settings.HAPROXY_QUERY_CHUNK_SIZE):
+                    configs = [build_section(data) for data in batch]
+                    results.extend(HaProxyConfigModel.objects.bulk_upsert(configs))
+        except ValueError as e:
+            raise core_exceptions.InvalidRequestException(detail=str(e))
+
+        return Response(results, status=HTTP_201_CREATED)
+
+
 class HaProxyConfigGenerateView(APIView):
     """
-    An API view handling generation process of a HAProxy configuration file. The generation process walks through all
-    configuration sections stored in a database. Only newest one of each unique section type is retrieved from a
-    database and passed to a next step. Uniqueness of a section type is guaranteed by a combination of a section and
-    section name. The next step constructs a sorted list containing these selected objects, which represent specific
-    configuration blocks, and based on an used request method either sends them in response or write them to a file.
+    An API view handling generation process of a HAProxy configuration file. The generation process walks through an
+    active set of configuration sections stored in a database. Only active one of each unique section type, which is the
+    newest or most recently touched one, is retrieved from a database and passed to a next step. Uniqueness of a section
+    type is guaranteed by a combination of a section and section name. The next step constructs a sorted list containing
+    these selected objects, which represent specific configuration blocks, and based on an used request method either
+    sends them in response or write them to a file.
     Sections will be sorted as follows: global, defaults, defaults(named), frontend, backend, listen
     """
 
     def get(self, request):
         """
         Method, responding to a GET request, fetches most currently posted sections of every type. Fetched sections are
-        send serialized in a response to a client, thus providing preview of a final configuration.
+        send serialized in a response to a client, thus providing preview of a final configuration. A preview is sent
+        with an ETag derived from checksums of active sections and a request with a matching If-None-Match header is
+        answered with a 304 status without reading sections themselves.
         :param request: request data
         :return: rest_framework.response.Response containing serialized data
         """
-        result = HaProxyConfigModel.objects.all()
-        result.query.group_by = ['section', 'section_name']
+        active = HaProxyConfigModel.objects.active().values_list('checksum', 'create_time')
 
-        if not result:
+        if not active:
             raise core_exceptions.DoesNotExistException()
 
-        result = sorted(result, key=methodcaller('get_section_weight'))
+        etag = configuration_etag(active)
+        if etag_matches(request, etag):
+            return Response(status=HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        result = HaProxyConfigModel.objects.resolve_patches(HaProxyConfigModel.objects.active())
+        result.sort(key=methodcaller('get_section_order'))
         serializer = HaProxyConfigModelSerializer(result, many=True)
-        return Response(serializer.data)
+        return Response(serializer.data, headers={'ETag': etag})
 
     def post(self, request):
         """
-        Method, responding to a POST request, creates a new configuration, which is stored in a file specified by
-        the HAPROXY_CONFIG_PATH variable defined in a settings file specific to a api_haproxy application. Objects from
+        Method, responding to a POST request, creates a new configuration, which is stored in a file specified by the
+        HAPROXY_CONFIG_DEV_PATH variable defined in a settings file specific to a api_haproxy application. Objects from
         a database are retrieved with a same logic as in the HaProxyConfigGenerateView.get method and formatted into a
-        representation valid for a HAProxy configuration.
+        representation valid for a HAProxy configuration, see services.generate_configuration.
         :param request: request data
         :return: rest_framework.response.Response containing serialized data
         """
-        result = HaProxyConfigModel.objects.all()
-        result.query.group_by = ['section', 'section_name']
+        return Response(generate_configuration(), status=HTTP_201_CREATED)
 
-        if not result:
-            raise core_exceptions.DoesNotExistException()
 
-        result = sorted(result, key=methodcaller('get_section_weight'))
-        config = ""
-        try:
-            with open(settings.HAPROXY_CONFIG_DEV_PATH, 'w') as f:
-                for res in result:
-                    config += "{0} {1}\n".format(str(res.section), (res.section_name or ""))
-                    for key, value in res.configuration.iteritems():
-                        config += "    {0} {1}\n".format(str(key), (value or ""))
-                    config += "\n"
-                f.write(config)
-        except IOError as e:
-            raise_500_error(e.errno, e.strerror + settings.HAPROXY_CONFIG_DEV_PATH)
+class HaProxyConfigDiffView(APIView):
+    """
+    An API view comparing a candidate configuration, given by an active set of sections, with a last deployed one.
+    Sections are compared by checksums first, thus only sections, which differ, are read and decoded.
+    """
 
-        return Response({'created': True}, status=HTTP_201_CREATED)
+    def get(self, request):
+        """
+        Method, responding to a GET request, lists added, removed and changed section types. Changed section types are
+        listed along with differences of their directives. When nothing has been deployed yet, all active sections are
+        listed as added.
+        :param request: request data
+        :return: rest_framework.response.Response containing serialized data
+        """
+        active = dict(
+            ((section, section_name), checksum) for section, section_name, checksum in
+            HaProxyConfigModel.objects.active().values_list('section', 'section_name', 'checksum')
+        )
+        deployment = HaProxyDeploymentModel.objects.last()
+        deployed = deployment.get_sections() if deployment else {}
+
+        added = sorted(key for key in active if key not in deployed)
+        removed = sorted(key for key in deployed if key not in active)
+        changed = sorted(key for key in active if key in deployed and active[key] != deployed[key])
+
+        configurations = {}
+        checksums = [active[key] for key in changed] + [deployed[key] for key in changed]
+        for chunk in chunked(checksums, settings.HAPROXY_QUERY_CHUNK_SIZE):
+            versions = HaProxyConfigModel.objects.resolve_patches(HaProxyConfigModel.objects.filter(checksum__in=chunk))
+            for config in versions:
+                configurations[config.checksum] = config.configuration
+
+        def describe(key, checksum):
+            return {'section': key[0], 'section_name': key[1], 'checksum': checksum}
+
+        data = {
+            'deployed': {'digest': deployment.digest, 'create_time': deployment.create_time} if deployment else None,
+            'added': [describe(key, active[key]) for key in added],
+            'removed': [describe(key, deployed[key]) for key in removed],
+            'changed': [],
+        }
+        for key in changed:
+            change = describe(key, active[key])
+            change['deployed checksum'] = deployed[key]
+            # Deployed version may have been deleted since, its directives are not known then
+            if deployed[key] in configurations:
+                change['directives'] = diff_directives(configurations[deployed[key]], configurations[active[key]])
+            data['changed'].append(change)
+
+        return Response(data)
 
 
 class HaProxyConfigValidationView(APIView):
@@ -182,87 +373,300 @@ class HaProxyConfigValidationView(APIView):
         :param request: request data
         :return: rest_framework.response.Response containing serialized data
         """
-        haproxy_executable = getattr(settings, 'HAPROXY_EXECUTABLE', None) or 'haproxy'
-        haproxy_validation_cmd = getattr(settings, 'HAPROXY_VALIDATION_CMD', None)
-        haproxy_dev_conf = settings.HAPROXY_CONFIG_DEV_PATH
+        return Response(validate_configuration())
+
+
+class HaProxyConfigValidationJobView(APIView):
+    """
+    An API view running validations of a generated HAProxy configuration file as asynchronous jobs. Jobs are executed by
+    a bounded pool of workers with a bounded queue, thus validations never occupy a request worker and never pile up
+    without a limit. States of jobs are shared by all processes, thus a job is polled for through any of them.
+    """
+
+    def post(self, request):
+        """
+        Method, responding to a POST request, submits a validation job, which performs same validation as
+        HaProxyConfigValidationView. Submission is refused with a 429 status, when a queue of jobs is full.
+        :param request: request data
+        :return: rest_framework.response.Response containing serialized data
+        """
+        try:
+            job = validation_jobs.submit(validate_configuration)
+        except Full:
+            raise Throttled(detail='Validation queue is full, try again later.')
+
+        return Response(job.to_dict(), status=HTTP_202_ACCEPTED)
 
-        if not haproxy_validation_cmd:
-            haproxy_validation_cmd = '{0} -f {1} -c'.format(haproxy_executable, haproxy_dev_conf)
+    def get(self, request, job_id):
+        """
+        Method, responding to a GET request, reports a state of a validation job and its result, when finished. A wait
+        query parameter holds a request for a given number of seconds at most, until a job is finished.
+        :param request: request data
+        :param job_id: identifier of a validation job
+        :return: rest_framework.response.Response containing serialized data
+        """
+        job = validation_jobs.get(job_id)
+        if job is None:
+            raise core_exceptions.DoesNotExistException()
+
+        try:
+            wait = min(float(request.QUERY_PARAMS.get('wait', 0)), settings.HAPROXY_VALIDATION_JOB_WAIT_MAX)
+        except ValueError:
+            raise core_exceptions.InvalidRequestException()
+        if wait > 0:
+            job.wait(wait)
 
-        if not isfile(haproxy_dev_conf):
-            raise core_exceptions.DoesNotExistException(detail='{} is not a file.'.format(haproxy_dev_conf))
+        return Response(job.to_dict())
 
-        validate = 'There has been no output so far.'
+
+class HaProxyRuntimeServerView(APIView):
+    """
+    An API view changing servers of a running HAProxy through its runtime API, without a reload and thus without
+    a churn of processes and connections. Every change is recorded as a new active version of a backend section, thus
+    it persists a next generation and deployment of a configuration.
+    """
+
+    def post(self, request, backend, server):
+        """
+        Method, responding to a POST request, applies a change given by an action and a value to a server. Actions are
+        weight, maxconn, enable, disable, add and del. A new version of a section is stored as a patch in a same
+        transaction, which is rolled back when HAProxy refuses a change.
+        :param request: request data
+        :param backend: name of a backend or a listen section
+        :param server: name of a server
+        :return: rest_framework.response.Response containing serialized data
+        """
+        action = request.DATA.get('action', None)
+        value = request.DATA.get('value', None)
+
+        if action not in RUNTIME_SERVER_COMMANDS:
+            raise core_exceptions.InvalidRequestException()
+        # Value is formatted into a runtime API command as well as into a stored section
         try:
-            validate = subprocess.check_output(haproxy_validation_cmd.split(), stderr=subprocess.STDOUT)
-        # Exception is caught when an executed command returns a non zero code
-        except subprocess.CalledProcessError as e:
-            raise_500_error(e.returncode, parse_haproxy_configtest_output(e.output))
+            value = clean_server_value(action, value)
+        except ValueError as e:
+            raise core_exceptions.InvalidRequestException(detail=str(e))
+
+        config = HaProxyConfigModel.objects.active().filter(section__in=['backend', 'listen'], section_name=backend)
+        config = config.first()
+        if config is None:
+            raise core_exceptions.DoesNotExistException()
+
+        try:
+            operations = server_operations(config.configuration, server, action, value)
+            with transaction.atomic():
+                version, _ = HaProxyConfigModel.objects.patch(config, operations)
+                version.activate()
+                apply_server_change(backend, server, action, value)
+        except ValueError as e:
+            raise core_exceptions.InvalidRequestException(detail=str(e))
+        except socket.error as e:
+            err_message = str(e) + '. Make sure HAProxy runtime socket is enabled and a path to it is correct.'
+            raise_500_error(getattr(e, 'errno', None), err_message)
+
+        return Response({'checksum': version.checksum})
+
+
+class HaProxyRuntimeStatsView(APIView):
+    """
+    An API view reporting statistics of a running HAProxy read by a 'show stat' command from its runtime socket. Rows
+    of frontends, backends and servers are joined to active sections, which configure them.
+    """
+
+    def get(self, request):
+        """
+        Method, responding to a GET request, sends a shared snapshot of statistics, see runtime.get_stats_snapshot, thus
+        a frequent polling does not multiply a load of a runtime socket. Every row is extended with a section and
+        a checksum of an active section of a proxy, when there is one. A pxname query parameter filters rows of a proxy.
+        :param request: request data
+        :return: rest_framework.response.Response containing serialized data
+        """
+        try:
+            snapshot = get_stats_snapshot()
+        except socket.error as e:
+            err_message = str(e) + '. Make sure HAProxy runtime socket is enabled and a path to it is correct.'
+            raise_500_error(getattr(e, 'errno', None), err_message)
+
+        sections = proxy_sections()
+        pxname = request.QUERY_PARAMS.get('pxname', None)
+        rows = []
+        for row in snapshot['rows']:
+            if pxname is not None and row.get('pxname') != pxname:
+                continue
+            row = dict(row)
+            section = sections.get((row.get('pxname'), 'frontend' if row.get('svname') == 'FRONTEND' else 'backend'))
+            if section is not None:
+                row['section'], row['checksum'] = section
+            rows.append(row)
+
+        return Response({'time': snapshot['time'], 'stats': rows})
+
+
+class HaProxyLogStatsView(APIView):
+    """
+    An API view reporting requests parsed from an HTTP log of HAProxy, configured by the HAPROXY_LOG_PATH variable,
+    per frontend, backend and server. Every proxy is joined to a section of a last deployed configuration, which
+    configures it, along with its checksum, thus latencies and errors may be tied to a version of a configuration, which
+    served requests. Statistics are counted anew, once a new configuration is deployed, see logs.scan_log.
+    """
+
+    def get(self, request):
+        """
+        Method, responding to a GET request, scans lines appended to a log since a previous scan, see logs.scan_log,
+        and lists numbers of requests, bytes and status classes, an error rate given by a share of 5xx responses and
+        percentiles of Tq, Tw, Tc, Tr and Tt timers in milliseconds, listed in the HAPROXY_LOG_PERCENTILES variable.
+        A type query parameter filters proxies of a type, i.e. frontend, backend or server, a name parameter filters
+        proxies of a name. Pending bytes are left to be scanned by a next request. A digest of a deployed configuration,
+        which statistics belong to, is listed along.
+        :param request: request data
+        :return: rest_framework.response.Response containing serialized data
+        """
+        deployment = HaProxyDeploymentModel.objects.last()
+        state = self.scan(digest=deployment.digest if deployment else None)
+        params = request.QUERY_PARAMS
+        sections = deployed_proxy_sections(deployment)
+
+        rows = []
+        for key in sorted(state['stats'].proxies):
+            proxy = state['stats'].proxies[key]
+            if params.get('type', proxy['type']) != proxy['type'] or params.get('name', proxy['name']) != proxy['name']:
+                continue
+
+            row = dict((name, proxy[name]) for name in ('type', 'name', 'requests', 'bytes', 'status'))
+            row['error rate'] = float(proxy['status'].get('5xx', 0)) / proxy['requests'] if proxy['requests'] else 0.0
+            row['timers'] = {}
+            for timer, sketch in proxy['timers'].iteritems():
+                row['timers'][timer] = dict(
+                    ('p{}'.format(percentile), sketch.quantile(percentile / 100.0))
+                    for percentile in settings.HAPROXY_LOG_PERCENTILES
+                )
+                row['timers'][timer]['count'] = sketch.count()
 
-        # Exception is caught when no executable is found
-        except OSError as e:
-            err_message = str(e.strerror) + '. Make sure HAProxy is installed and a path to its binary is correct.'
-            raise_500_error(e.errno, err_message)
+            proxy_name = proxy['name'].split('/')[0] if proxy['type'] == 'server' else proxy['name']
+            section = sections.get((proxy_name, 'frontend' if proxy['type'] == 'frontend' else 'backend'))
+            if section is not None:
+                row['section'], row['checksum'] = section
+            rows.append(row)
 
-        validate_output = parse_haproxy_configtest_output(validate)
-        return Response({'return code': 0, 'detail': validate_output})
+        return Response({
+            'offset': state['offset'], 'pending bytes': state['size'] - state['offset'], 'digest': state['digest'],
+            'unparsed lines': state['stats'].unparsed, 'stats': rows,
+        })
+
+    def delete(self, request):
+        """
+        Method, responding to a DELETE request, clears collected statistics, which are counted from a current end of
+        a log onwards, e.g. to compare requests served by a newly deployed configuration only.
+        :param request: request data
+        :return: rest_framework.response.Response containing serialized data
+        """
+        deployment = HaProxyDeploymentModel.objects.last()
+        state = self.scan(reset=True, digest=deployment.digest if deployment else None)
+        return Response({'deleted': True, 'offset': state['offset']})
+
+    @staticmethod
+    def scan(**kwargs):
+        try:
+            return scan_log(**kwargs)
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENOENT and e.filename == settings.HAPROXY_LOG_PATH:
+                raise core_exceptions.DoesNotExistException(detail='{} does not exist.'.format(e.filename))
+            raise_500_error(e.errno, '{0} {1}'.format(e.strerror, e.filename))
 
 
 class HaProxyConfigDeployView(APIView):
     """
-    An API view interacting with 'haproxy' command to deploy new configuration and reload a HAProxy daemon. This
+    An API view interacting with 'haproxy' command to deploy new configuration and reload HAProxy daemons. This
     process tries to load commands as well as paths to configuration files from a settings.py file. In the case, when
-    there are no such settings available, the process uses hardcoded defaults. At the end, production configuration file
-    is backed up and replaced with a development configuration file, followed by a restart or reload of a daemon.
+    there are no such settings available, the process uses hardcoded defaults. At the end, production configuration
+    files of all deploy targets are backed up and replaced with a development configuration file, followed by a restart
+    or reload of daemons.
     """
 
     def post(self, request):
         """
-        Method is calling 'haproxy' command to deploy specified configuration file and reload a HAProxy daemon.
-        Production file listed in the HAPROXY_CONFIG_PATH variable is replaced with a file listed in the
-        HAPROXY_CONFIG_DEV_PATH variable, the one generated with a HaProxyConfigGenerateView. Replaced production file
-        is renamed to same name, but ends with a .bak extension. After files are switched, method calls 'haproxy'
-        command and attempts to reload configuration, expecting that bash is present, otherwise restart will be
-        performed. It is not recommended to run this method before previous validation run.
+        Method is calling 'haproxy' command to deploy specified configuration file and reload HAProxy daemons.
+        Production files of targets listed in the HAPROXY_DEPLOY_TARGETS variable, or a single file listed in the
+        HAPROXY_CONFIG_PATH variable, are replaced with a file listed in the HAPROXY_CONFIG_DEV_PATH variable, the one
+        generated with a HaProxyConfigGenerateView. Replaced production files are copied to same names, but ending with
+        a .bak extension. Files are replaced atomically and nothing is deployed nor reloaded, when a content of both
+        files is identical. Targets are deployed concurrently, see deploy.deploy_configuration, a fail_fast parameter
+        overrides the HAPROXY_DEPLOY_FAIL_FAST variable. Sections of a successfully deployed file are recorded, thus a
+        next candidate configuration may be compared with them. Deployments are serialized across processes and
+        requests arriving during a running deployment share an outcome of a next one, see
+        services.deploy_generated_configuration. It is not recommended to run this method before previous validation
+        run.
         :param request: request data
         :return: rest_framework.response.Response containing serialized data
         """
-        haproxy_executable = getattr(settings, 'HAPROXY_EXECUTABLE', None) or 'haproxy'
-        haproxy_reload_cmd = getattr(settings, 'HAPROXY_RELOAD_CMD', None)
-        haproxy_restart_cmd = getattr(settings, 'HAPROXY_RESTART_CMD', None)
-        haproxy_dev_config = settings.HAPROXY_CONFIG_DEV_PATH
-        haproxy_prod_config = settings.HAPROXY_CONFIG_PATH
-
-        # Check if executables are specified in settings, otherwise provide defaults
-        if getattr(settings, 'BASH_PATH', None):
-            if not haproxy_reload_cmd:
-                haproxy_reload_cmd = '{0} -f {1} -p {2} -sf $(<{2})'.format(
-                    haproxy_executable, haproxy_prod_config, '/var/run/haproxy-pids.pid'
-                )
-            haproxy_reload = [settings.BASH_PATH, '-c', haproxy_reload_cmd]
-        else:
-            if not haproxy_restart_cmd:
-                haproxy_restart_cmd = '/etc/init.d/haproxy restart'
-            haproxy_reload = haproxy_restart_cmd.split()
-
-        # Check if configs are in place
-        if not isfile(haproxy_dev_config):
-            raise core_exceptions.DoesNotExistException(
-                detail='{} is not a file. Run call to generate it first.'.format(haproxy_dev_config)
-            )
-        if not isfile(haproxy_prod_config):
-            raise core_exceptions.DoesNotExistException(detail='{} is not a file.'.format(haproxy_prod_config))
-
-        deploy = 'There has been no output so far.'
-        try:
-            shutil.copy(haproxy_prod_config, haproxy_prod_config + '.bak')
-            shutil.copy(haproxy_dev_config, haproxy_prod_config)
-            deploy = subprocess.Popen(haproxy_reload, stdin=None, stdout=None, stderr=None)
-        except subprocess.CalledProcessError as e:
-            raise_500_error(e.returncode, parse_haproxy_configtest_output(e.output))
+        fail_fast = request.DATA.get('fail_fast')
+        if fail_fast is not None:
+            fail_fast = str(fail_fast).lower() in ('1', 'true')
+
+        return Response(deploy_generated_configuration(fail_fast))
+
 
-        except OSError as e:
-            err_message = str(e.strerror) + '. Make sure HAProxy is installed and a path to its binary is correct.'
-            raise_500_error(e.errno, err_message)
+class HaProxySnapshotView(APIView):
+    """
+    An API view listing snapshots of deployed configurations. Snapshots are stored by every successful deployment, see
+    services.store_snapshot.
+    """
+
+    def get(self, request):
+        """
+        Method, responding to a GET request, lists snapshots from a most recently deployed one. Contents of snapshots
+        are not read, a currently deployed snapshot is marked.
+        :param request: request data
+        :return: rest_framework.response.Response containing serialized data
+        """
+        deployment = HaProxyDeploymentModel.objects.last()
+        snapshots = HaProxySnapshotModel.objects.defer('content').order_by('-deploy_time', '-pk')
+        return Response([{
+            'digest': snapshot.digest,
+            'size': snapshot.size,
+            'sections': len(snapshot.checksums),
+            'create_time': snapshot.create_time,
+            'deploy_time': snapshot.deploy_time,
+            'deployed': deployment is not None and deployment.digest == snapshot.digest,
+        } for snapshot in snapshots])
+
+
+class HaProxySnapshotRollbackView(APIView):
+    """
+    An API view rolling a deployment back to a snapshot of a previously deployed configuration.
+    """
+
+    def post(self, request, digest):
+        """
+        Method, responding to a POST request, deploys a snapshot of a given digest to all deploy targets and reloads
+        HAProxy daemons, see services.roll_back_configuration. A configuration is not generated, thus a rollback costs
+        a same regardless of a number of sections and their versions. A fail_fast parameter overrides the
+        HAPROXY_DEPLOY_FAIL_FAST variable.
+        :param request: request data
+        :param digest: digest of a snapshot
+        :return: rest_framework.response.Response containing serialized data
+        """
+        fail_fast = request.DATA.get('fail_fast')
+        if fail_fast is not None:
+            fail_fast = str(fail_fast).lower() in ('1', 'true')
+
+        return Response(roll_back_configuration(digest, fail_fast))
+
+
+class HaProxyMetricsView(APIView):
+    """
+    An API view exposing durations of generation, validation and deployment stages and counters of reloads, skipped
+    reloads and failed validations in a Prometheus text format. Metrics are kept by every worker process separately.
+    """
+
+    def get(self, request):
+        """
+        Method, responding to a GET request, renders all metrics of a current process.
+        :param request: request data
+        :return: django.http.HttpResponse containing metrics in a Prometheus text format
+        :raises: api_core.exceptions.DoesNotExistException when metrics are disabled
+        """
+        if not settings.HAPROXY_METRICS_ENABLED:
+            raise core_exceptions.DoesNotExistException(detail='Metrics are disabled.')
 
-        return Response({'return code': 0})
+        return HttpResponse(metrics.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')